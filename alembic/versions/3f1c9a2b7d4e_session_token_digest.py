@@ -0,0 +1,62 @@
+"""session token digest
+
+Revision ID: 3f1c9a2b7d4e
+Revises: 8648ae6436f0
+Create Date: 2026-10-18 09:12:31.402117
+
+"""
+import hashlib
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '3f1c9a2b7d4e'
+down_revision = '8648ae6436f0'
+branch_labels = None
+depends_on = None
+
+_BACKFILL_BATCH = 1000
+
+
+def upgrade():
+    op.add_column('session_token', sa.Column('token_digest', sa.TEXT(), nullable=True))
+
+    # tokens are replaced by their sha256 digest so verify/delete become a point lookup
+    conn = op.get_bind()
+    conn.execute(sa.text("delete from session_token where token is null or user_id is null"))
+    last_id = 0
+    while True:
+        rows = conn.execute(sa.text(
+            "select id, token from session_token where id > :last_id order by id limit :n"),
+            {"last_id": last_id, "n": _BACKFILL_BATCH}).fetchall()
+        if not rows:
+            break
+        conn.execute(sa.text("update session_token set token_digest = :digest where id = :id"),
+                     [{"id": r.id, "digest": hashlib.sha256(r.token.encode("utf-8")).hexdigest()}
+                      for r in rows])
+        last_id = rows[-1].id
+
+    # tokens issued before they carried a jti were deterministic, so the same login in the same
+    # second stored the same token twice. keep the oldest copy so the unique index can be built
+    conn.execute(sa.text("""
+        delete from session_token a using session_token b
+        where a.token_digest = b.token_digest and a.id > b.id
+        """))
+
+    op.alter_column('session_token', 'token_digest', nullable=False)
+    op.alter_column('session_token', 'user_id', nullable=False)
+    op.create_index('ix_session_token_token_digest', 'session_token', ['token_digest'], unique=True)
+    op.create_index('ix_session_token_user_id_created_utc', 'session_token',
+                    ['user_id', 'created_utc'])
+    op.drop_column('session_token', 'token')
+
+
+def downgrade():
+    # the raw tokens can't be recovered from their digests so every session is dropped and
+    # users have to log in again
+    op.execute("delete from session_token")
+    op.add_column('session_token', sa.Column('token', sa.TEXT(), nullable=True))
+    op.drop_index('ix_session_token_user_id_created_utc', table_name='session_token')
+    op.drop_index('ix_session_token_token_digest', table_name='session_token')
+    op.alter_column('session_token', 'user_id', nullable=True)
+    op.drop_column('session_token', 'token_digest')
@@ -0,0 +1,24 @@
+"""unique account email
+
+Revision ID: 5b8d0e4f2c61
+Revises: a7e2d5c81b90
+Create Date: 2026-10-18 11:27:40.560931
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '5b8d0e4f2c61'
+down_revision = 'a7e2d5c81b90'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # fails if duplicate emails already exist; those accounts have to be merged by hand first
+    op.create_index('ix_user_account_email', 'user_account', ['email'], unique=True)
+
+
+def downgrade():
+    op.drop_index('ix_user_account_email', table_name='user_account')
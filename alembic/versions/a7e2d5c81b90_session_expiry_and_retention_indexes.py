@@ -0,0 +1,35 @@
+"""session expiry and retention indexes
+
+Revision ID: a7e2d5c81b90
+Revises: 3f1c9a2b7d4e
+Create Date: 2026-10-18 10:03:55.118342
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = 'a7e2d5c81b90'
+down_revision = '3f1c9a2b7d4e'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('session_token', sa.Column('expires_utc', postgresql.TIMESTAMP(), nullable=True))
+    # every token issued so far used the default 30 day lifetime
+    op.execute("update session_token set expires_utc = created_utc + interval '30 days'")
+    op.alter_column('session_token', 'expires_utc', nullable=False)
+
+    # (time, id) indexes let the reaper walk expired rows in keyset order
+    op.create_index('ix_session_token_expires_utc_id', 'session_token', ['expires_utc', 'id'])
+    op.create_index('ix_endpoint_log_start_utc_id', 'endpoint_log', ['start_utc', 'id'])
+    op.create_index('ix_system_log_event_utc_id', 'system_log', ['event_utc', 'id'])
+
+
+def downgrade():
+    op.drop_index('ix_system_log_event_utc_id', table_name='system_log')
+    op.drop_index('ix_endpoint_log_start_utc_id', table_name='endpoint_log')
+    op.drop_index('ix_session_token_expires_utc_id', table_name='session_token')
+    op.drop_column('session_token', 'expires_utc')
@@ -0,0 +1,27 @@
+"""endpoint log db stats
+
+Revision ID: c4d9e1a7f3b2
+Revises: 5b8d0e4f2c61
+Create Date: 2026-10-18 14:02:11.318204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = 'c4d9e1a7f3b2'
+down_revision = '5b8d0e4f2c61'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # nullable so existing rows and rows logged outside a request stay valid
+    op.add_column('endpoint_log', sa.Column('db_queries', postgresql.INTEGER(), nullable=True))
+    op.add_column('endpoint_log', sa.Column('db_time_ms', postgresql.INTEGER(), nullable=True))
+
+
+def downgrade():
+    op.drop_column('endpoint_log', 'db_time_ms')
+    op.drop_column('endpoint_log', 'db_queries')
@@ -0,0 +1,40 @@
+"""revoked token
+
+Revision ID: e2a8c6d4f1b9
+Revises: c4d9e1a7f3b2
+Create Date: 2026-10-18 15:41:27.902113
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.schema import CreateSequence, Sequence
+
+# revision identifiers, used by Alembic.
+revision = 'e2a8c6d4f1b9'
+down_revision = 'c4d9e1a7f3b2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute(CreateSequence(Sequence("revoked_token_id_seq")))
+    op.create_table('revoked_token',
+    sa.Column('id', sa.INTEGER(), server_default=sa.text("nextval('revoked_token_id_seq')"), nullable=False),
+    sa.Column('jti', postgresql.TEXT(), nullable=False),
+    sa.Column('expires_utc', postgresql.TIMESTAMP(), nullable=False),
+    sa.Column('revoked_utc', postgresql.TIMESTAMP(), server_default=sa.text('now()'), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_revoked_token_jti', 'revoked_token', ['jti'], unique=True)
+    # workers poll for new revocations by revoked_utc; the reaper walks expired rows by (expires_utc, id)
+    op.create_index('ix_revoked_token_revoked_utc', 'revoked_token', ['revoked_utc'])
+    op.create_index('ix_revoked_token_expires_utc_id', 'revoked_token', ['expires_utc', 'id'])
+
+
+def downgrade():
+    op.drop_index('ix_revoked_token_expires_utc_id', table_name='revoked_token')
+    op.drop_index('ix_revoked_token_revoked_utc', table_name='revoked_token')
+    op.drop_index('ix_revoked_token_jti', table_name='revoked_token')
+    op.drop_table('revoked_token')
+    op.execute("drop sequence revoked_token_id_seq")
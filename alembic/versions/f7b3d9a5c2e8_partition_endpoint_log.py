@@ -0,0 +1,114 @@
+"""partition endpoint log and add per-minute rollups
+
+Revision ID: f7b3d9a5c2e8
+Revises: e2a8c6d4f1b9
+Create Date: 2026-10-18 17:12:49.270318
+
+"""
+import datetime
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = 'f7b3d9a5c2e8'
+down_revision = 'e2a8c6d4f1b9'
+branch_labels = None
+depends_on = None
+
+# daily partitions created past today so the reaper/rollup jobs have time to add more
+_DAYS_AHEAD = 7
+
+_COLUMNS = "id, start_utc, duration_ms, endpoint, username, method, http_code, error_message, " \
+           "db_queries, db_time_ms"
+
+
+def upgrade():
+    # needs postgres 11+ for default partitions and primary keys on partitioned tables.
+    # the old table is renamed out of the way, its rows copied into the partitions, then dropped
+    op.execute("alter table endpoint_log rename to endpoint_log_old")
+    op.execute("alter table endpoint_log_old rename constraint endpoint_log_pkey to endpoint_log_old_pkey")
+    op.execute("alter index ix_endpoint_log_start_utc_id rename to ix_endpoint_log_old_start_utc_id")
+
+    op.execute("""
+        create table endpoint_log (
+            id integer not null default nextval('endpoint_log_id_seq'),
+            start_utc timestamp not null,
+            duration_ms integer not null,
+            endpoint text,
+            username text,
+            method text,
+            http_code text,
+            error_message text,
+            db_queries integer,
+            db_time_ms integer,
+            constraint endpoint_log_pkey primary key (id, start_utc)
+        ) partition by range (start_utc)
+        """)
+    op.execute("create index ix_endpoint_log_start_utc_id on endpoint_log (start_utc, id)")
+    # catches rows outside every daily partition, e.g. if the jobs stop running for a week
+    op.execute("create table endpoint_log_default partition of endpoint_log default")
+
+    conn = op.get_bind()
+    bounds = conn.execute(sa.text(
+        "select min(start_utc)::date as first, max(start_utc)::date as last from endpoint_log_old")).first()
+    today = datetime.datetime.utcnow().date()
+    day = min(bounds.first, today) if bounds.first else today
+    last = max(bounds.last, today) if bounds.last else today
+    last += datetime.timedelta(days=_DAYS_AHEAD)
+    while day <= last:
+        op.execute("""
+            create table endpoint_log_p{name} partition of endpoint_log
+            for values from ('{start}') to ('{end}')
+            """.format(name=day.strftime("%Y%m%d"), start=day, end=day + datetime.timedelta(days=1)))
+        day += datetime.timedelta(days=1)
+
+    op.execute("insert into endpoint_log ({cols}) select {cols} from endpoint_log_old".format(cols=_COLUMNS))
+    op.execute("drop table endpoint_log_old")
+
+    op.create_table('endpoint_stats_minute',
+    sa.Column('minute_utc', postgresql.TIMESTAMP(), nullable=False),
+    sa.Column('endpoint', sa.TEXT(), nullable=False),
+    sa.Column('method', sa.TEXT(), nullable=False),
+    sa.Column('http_code', sa.TEXT(), nullable=False),
+    sa.Column('count', sa.INTEGER(), nullable=False),
+    sa.Column('error_count', sa.INTEGER(), nullable=False),
+    sa.Column('duration_ms_sum', sa.BIGINT(), nullable=False),
+    sa.Column('duration_ms_min', sa.INTEGER(), nullable=False),
+    sa.Column('duration_ms_max', sa.INTEGER(), nullable=False),
+    sa.Column('db_queries_sum', sa.BIGINT(), nullable=True),
+    sa.Column('db_time_ms_sum', sa.BIGINT(), nullable=True),
+    sa.Column('duration_ms_buckets', postgresql.ARRAY(sa.INTEGER()), nullable=False),
+    sa.PrimaryKeyConstraint('minute_utc', 'endpoint', 'method', 'http_code')
+    )
+    op.create_table('rollup_watermark',
+    sa.Column('name', sa.TEXT(), nullable=False),
+    sa.Column('last_utc', postgresql.TIMESTAMP(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+
+
+def downgrade():
+    op.drop_table('rollup_watermark')
+    op.drop_table('endpoint_stats_minute')
+
+    op.execute("alter table endpoint_log rename to endpoint_log_partitioned")
+    op.execute("alter table endpoint_log_partitioned rename constraint endpoint_log_pkey to endpoint_log_partitioned_pkey")
+    op.execute("alter index ix_endpoint_log_start_utc_id rename to ix_endpoint_log_partitioned_start_utc_id")
+    op.create_table('endpoint_log',
+    sa.Column('id', sa.INTEGER(), server_default=sa.text("nextval('endpoint_log_id_seq')"), nullable=False),
+    sa.Column('start_utc', postgresql.TIMESTAMP(), nullable=False),
+    sa.Column('duration_ms', sa.INTEGER(), nullable=False),
+    sa.Column('endpoint', sa.TEXT(), nullable=True),
+    sa.Column('username', sa.TEXT(), nullable=True),
+    sa.Column('method', sa.TEXT(), nullable=True),
+    sa.Column('http_code', sa.TEXT(), nullable=True),
+    sa.Column('error_message', sa.TEXT(), nullable=True),
+    sa.Column('db_queries', postgresql.INTEGER(), nullable=True),
+    sa.Column('db_time_ms', postgresql.INTEGER(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_endpoint_log_start_utc_id', 'endpoint_log', ['start_utc', 'id'])
+    op.execute("insert into endpoint_log ({cols}) select {cols} from endpoint_log_partitioned".format(cols=_COLUMNS))
+    # dropping the parent drops every partition with it
+    op.execute("drop table endpoint_log_partitioned")
@@ -0,0 +1,62 @@
+"""
+    PostgreSQLConn.insert with one statement per row versus multi-row VALUES pages, across batch
+    sizes. needs DATABASE_URL. rows go into a temporary table that disappears with the connection.
+
+    python -m benchmarks.bench_insert --sizes 10 1000 100000
+"""
+import argparse
+import time
+from webapp.core.utils.postgresqlconn import PostgreSQLConn
+
+_TABLE = "bench_insert"
+
+
+def make_rows(n: int) -> list:
+    return [{"id": i, "name": "row {}".format(i), "score": i * 0.5} for i in range(n)]
+
+
+def legacy_insert(db: PostgreSQLConn, rows: list) -> int:
+    """ the insert path before batching: one statement and one round trip per row """
+    n = 0
+    for row in rows:
+        query = "insert into {} ({}) select {}".format(
+            _TABLE, ",".join(row.keys()), ",".join(["%s"] * len(row)))
+        n += db.execute_write_query(query, tuple(row.values()))
+    return n
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 1000, 100000])
+    parser.add_argument("--page-size", type=int, default=1000)
+    parser.add_argument("--legacy-max", type=int, default=10000,
+                        help="skip the per-row path above this many rows")
+    args = parser.parse_args()
+
+    with PostgreSQLConn("YOUR_DATABASE_NAME") as db:
+        db.execute_write_query(
+            "create temporary table {} (id integer, name text, score double precision)".format(_TABLE))
+
+        for size in args.sizes:
+            rows = make_rows(size)
+            results = {}
+            for name, fn in (("before", legacy_insert),
+                             ("after", lambda d, r: d.insert(_TABLE, r, page_size=args.page_size))):
+                if name == "before" and size > args.legacy_max:
+                    continue
+                db.execute_write_query("truncate {}".format(_TABLE))
+                start = time.perf_counter()
+                n = fn(db, rows)
+                elapsed = time.perf_counter() - start
+                assert n == size, "{} inserted {} of {} rows".format(name, n, size)
+                results[name] = elapsed
+
+            print("{size:>7} rows: {cols}".format(**{
+                "size": size,
+                "cols": "  ".join("{} {:8.3f} s ({:9.0f} rows/s)".format(name, t, size / t)
+                                  for name, t in results.items()),
+                }))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""
+    cost of turning a payload into response bytes: the old dumps/loads round trip followed by
+    flask-restful's own json.dumps, versus ResponseJson serializing once. runs offline.
+
+    python -m benchmarks.bench_responsejson
+"""
+import datetime
+import decimal
+import json
+import uuid
+import simplejson
+from webapp.core.utils import jsonencoder
+from webapp.core.utils.responsejson import ResponseJson
+from .harness import bench
+
+
+def make_payload(n_items: int) -> dict:
+    return {
+        "message": "ok",
+        "items": [{
+            "id": i,
+            "uuid": "usr_" + uuid.uuid4().hex,
+            "price": decimal.Decimal("19.99"),
+            "name": "item number {}".format(i),
+            "tags": ["red", "blue", "green"],
+            "active": i % 2 == 0,
+            } for i in range(n_items)],
+        }
+
+
+def legacy(payload: dict) -> bytes:
+    data = simplejson.loads(simplejson.dumps(payload))
+    return (json.dumps(data) + "\n").encode("utf-8")
+
+
+def current(payload: dict) -> bytes:
+    return ResponseJson(payload).body
+
+
+def main():
+    print("json backend: {}".format(jsonencoder.backend))
+    for name, n_items, number in (("small", 1, 20000), ("medium", 100, 500), ("large", 10000, 5)):
+        payload = make_payload(n_items)
+        before = bench(lambda: legacy(payload), number=number)
+        after = bench(lambda: current(payload), number=number)
+        print("{name:>6} ({n} items): before {b:10.1f} us  after {a:10.1f} us  ({x:4.1f}x)".format(**{
+            "name": name,
+            "n": n_items,
+            "b": before["p50"],
+            "a": after["p50"],
+            "x": before["p50"] / after["p50"],
+            }))
+
+
+if __name__ == "__main__":
+    main()
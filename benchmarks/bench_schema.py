@@ -0,0 +1,60 @@
+"""
+    argument parsing cost per request: building a RequestParser and running parse_args, as the
+    resources used to, versus a Schema compiled once. endpoints with 3, 10 and 30 query string
+    arguments. runs offline.
+
+    python -m benchmarks.bench_schema
+"""
+from flask import Flask
+from flask_restful.reqparse import Argument
+from webapp.extensions.requestparser import RequestParser
+from webapp.extensions.schema import Schema
+from .harness import bench
+
+_CHOICES = ("red", "blue", "green")
+
+
+def argument_specs(n: int) -> list:
+    """ (name, add_argument kwargs, query string value) cycling through str, int and choice args.
+    the first argument is required like EchoWorld's message """
+    specs = []
+    for i in range(n):
+        kind = i % 3
+        if kind == 0:
+            specs.append(("text{}".format(i), {"type": str, "required": i == 0}, "hello"))
+        elif kind == 1:
+            specs.append(("number{}".format(i), {"type": int}, str(i)))
+        else:
+            specs.append(("vote{}".format(i), {"type": str, "choices": _CHOICES}, "blue"))
+    return specs
+
+
+def main():
+    app = Flask(__name__)
+
+    for n in (3, 10, 30):
+        specs = argument_specs(n)
+        url = "/bench?" + "&".join("{}={}".format(name, value) for name, _, value in specs)
+        schema = Schema(*[Argument(name, location="args", **kwargs) for name, kwargs, _ in specs])
+
+        def legacy():
+            parser = RequestParser()
+            for name, kwargs, _ in specs:
+                parser.add_argument(name, location="args", **kwargs)
+            return parser.parse_args()
+
+        with app.test_request_context(url):
+            assert legacy() == schema.parse(), "the schema and the parser disagree"
+            before = bench(legacy, number=2000)
+            after = bench(schema.parse, number=2000)
+
+        print("{n:>2} args: before {b:8.1f} us  after {a:8.1f} us  ({x:4.1f}x)".format(**{
+            "n": n,
+            "b": before["p50"],
+            "a": after["p50"],
+            "x": before["p50"] / after["p50"],
+            }))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+    signups per second through the old three-session AccountManager.create path versus the
+    single-transaction insert-on-conflict path. needs DATABASE_URL, JWT_SECRET and JWT_ISS and
+    a database migrated to head. every account it creates is deleted afterwards.
+
+    python -m benchmarks.bench_signup --signups 500 --concurrency 8
+"""
+import argparse
+import uuid
+from sqlalchemy import text
+from webapp.core.models.account import Account
+from webapp.core.utils.dbsession import dbsession
+from webapp.core.utils.security import generate_hash
+from webapp.managers.accountmanager import AccountManager
+from webapp.managers.sessionmanager import SessionManager
+from .harness import run_concurrent, summarize
+
+
+def legacy_create(email: str, password: str):
+    """ the signup path before the single round trip rewrite: a lookup, an insert and a
+    separate session insert, each in its own session """
+    with dbsession() as session:
+        account = session.query(Account).filter(Account.email == email).first()
+    if account:
+        return
+
+    account = Account(email, generate_hash(password))
+    with dbsession() as session:
+        session.add(account)
+        user_id = account.user_id
+    SessionManager().create(user_id, email)
+
+
+def current_create(email: str, password: str):
+    AccountManager().create(email, password)
+
+
+def cleanup(prefix: str):
+    with dbsession() as session:
+        session.execute(text("""
+            delete from session_token where user_id in (
+                select user_id from user_account where email like :pattern)
+            """), {"pattern": prefix + "%"})
+        session.execute(text("delete from user_account where email like :pattern"),
+                        {"pattern": prefix + "%"})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--signups", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=8)
+    args = parser.parse_args()
+
+    for name, create in (("before", legacy_create), ("after", current_create)):
+        prefix = "bench+{}+{}".format(name, uuid.uuid4().hex[:8])
+        try:
+            elapsed, latencies = run_concurrent(
+                lambda i: create("{}+{}@example.com".format(prefix, i), "password"),
+                args.signups, args.concurrency)
+        finally:
+            cleanup(prefix)
+
+        stats = summarize(latencies)
+        print("{name:>6}: {rate:8.1f} signups/sec  p50 {p50:6.1f} ms  p99 {p99:6.1f} ms".format(**{
+            "name": name,
+            "rate": args.signups / elapsed,
+            "p50": stats["p50"],
+            "p99": stats["p99"],
+            }))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+    token verification cost under a storm of invalid tokens: the old verify_token, which read the
+    secret from the environment and printed a traceback for every rejection, versus the key ring.
+    runs offline. the old path's tracebacks go to /dev/null, so the numbers only understate what
+    they cost against a real log pipe.
+
+    python -m benchmarks.bench_tokens
+"""
+import contextlib
+import datetime
+import os
+import traceback
+
+os.environ.setdefault("JWT_SECRET", "bench-secret")
+os.environ.setdefault("JWT_ISS", "bench")
+
+import jwt
+from webapp.core.utils.security import generate_token, keyring, token_stats
+from .harness import bench, run_concurrent, summarize
+
+
+def legacy_verify(token: str) -> bool:
+    """ verify_token before the key ring """
+    jwt_secret = os.getenv("JWT_SECRET")
+    jwt_iss = os.getenv("JWT_ISS")
+    try:
+        jwt.decode(token, jwt_secret, issuer=jwt_iss)
+        return True
+    except Exception as e:
+        traceback.print_exc()
+        return False
+
+
+def storm_tokens() -> dict:
+    """ one token of every kind a client can throw at us """
+    valid = generate_token({"email": "bench@example.com", "uuid": "usr_bench"}, 3600)
+    header, payload, signature = valid.split(".")
+    expired = jwt.encode({"iss": os.getenv("JWT_ISS"), "exp": datetime.datetime.utcnow() -
+                          datetime.timedelta(hours=1)}, os.getenv("JWT_SECRET"), algorithm="HS256")
+    return {
+        "valid": valid,
+        "garbage": "not-a-token",
+        "truncated": header + "." + payload,
+        "bad_signature": header + "." + payload + "." + signature[::-1],
+        "expired": expired.decode("utf-8") if isinstance(expired, bytes) else expired,
+        "wrong_key": jwt.encode({"iss": os.getenv("JWT_ISS")}, "someone-else",
+                                algorithm="HS256").decode("utf-8"),
+    }
+
+
+def main():
+    ring = keyring()
+    tokens = storm_tokens()
+
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stderr(devnull):
+        for name, token in tokens.items():
+            before = bench(lambda: legacy_verify(token), number=2000)
+            after = bench(lambda: ring.decode(token), number=2000)
+            print("{name:>13}: before {b:8.1f} us  after {a:8.1f} us  ({x:5.1f}x)".format(**{
+                "name": name,
+                "b": before["p50"],
+                "a": after["p50"],
+                "x": before["p50"] / after["p50"],
+                }))
+
+        # a mixed storm from concurrent clients: nine bad tokens for every good one
+        storm = [t for name, t in tokens.items() if name != "valid"] * 2 + [tokens["valid"]]
+        n = 20000
+        for name, verify in (("before", legacy_verify), ("after", ring.decode)):
+            elapsed, latencies = run_concurrent(lambda i: verify(storm[i % len(storm)]), n, 8)
+            stats = summarize(latencies)
+            print("{name:>6} storm: {rate:9.0f} checks/sec  p99 {p99:6.3f} ms".format(**{
+                "name": name,
+                "rate": n / elapsed,
+                "p99": stats["p99"],
+                }))
+
+    print("rejections: {}".format(token_stats()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""
+    microbenchmarks for the per-request utilities in webapp/core/utils and webapp/extensions. every
+    case is warmed up, then timed over several rounds and summarized in microseconds per call.
+    runs offline; no database is needed.
+
+    python -m benchmarks.bench_utils
+    python -m benchmarks.bench_utils --only token,aes --output before.json
+    python -m benchmarks.bench_utils --baseline before.json
+
+    with --baseline the p50 of every case is compared against a saved run and cases that got slower
+    by more than --threshold are flagged
+"""
+import argparse
+import json
+import os
+import sys
+
+# token helpers read these at call time; give them something to sign with when run bare
+os.environ.setdefault("JWT_SECRET", "bench-secret")
+os.environ.setdefault("JWT_ISS", "bench")
+
+from flask import Flask
+from webapp.core.utils.aescipher import AESCipher
+from webapp.core.utils.basics import prefixed_uuid4
+from webapp.core.utils.logger import caller_source
+from webapp.core.utils.responsejson import ResponseJson, MessageResponseJson
+from webapp.core.utils.security import generate_token, verify_token, generate_hash, verify_hash
+from webapp.extensions.requestparser import RequestParser
+from webapp.extensions.schema import Schema
+from .harness import bench
+
+_AES_PAYLOAD_SIZES = (16, 1024, 65536)
+
+
+def _echo_parser() -> RequestParser:
+    """ the same arguments EchoWorld parses """
+    parser = RequestParser()
+    parser.add_argument("message", type=str, required=True, location="args")
+    parser.add_argument("number", type=int, required=False, location="args")
+    parser.add_argument("vote", type=str, required=False, choices=("red", "blue", "green"),
+                        location="args")
+    return parser
+
+
+def cases() -> list:
+    """ (name, fn, calls per round). the number of calls keeps each round in the tens of ms """
+    payload = {"message": "hello, world"}
+    token = generate_token({"email": "bench@example.com", "uuid": "usr_bench"}, 3600)
+    hashed = generate_hash("password")
+
+    app = Flask(__name__)
+
+    def parse_echo():
+        with app.test_request_context("/api/echo?message=hi&number=3&vote=red"):
+            _echo_parser().parse_args()
+
+    echo_schema = Schema.from_parser(_echo_parser())
+
+    def schema_echo():
+        with app.test_request_context("/api/echo?message=hi&number=3&vote=red"):
+            echo_schema.parse()
+
+    def source():
+        return caller_source(1)
+
+    found = [
+        ("responsejson.construct", lambda: ResponseJson(payload), 20000),
+        ("responsejson.body", lambda: ResponseJson(payload).body, 20000),
+        ("responsejson.message", lambda: MessageResponseJson("hi", {"number": 3}).body, 20000),
+        ("requestparser.echo", parse_echo, 2000),
+        ("schema.echo", schema_echo, 2000),
+        ("token.generate", lambda: generate_token({"email": "bench@example.com"}, 3600), 2000),
+        ("token.verify", lambda: verify_token(token), 2000),
+        ("hash.generate", lambda: generate_hash("password"), 50),
+        ("hash.verify", lambda: verify_hash("password", hashed), 50),
+        ("uuid.prefixed_uuid4", lambda: prefixed_uuid4("usr"), 20000),
+        ("logger.caller_source", source, 20000),
+    ]
+
+    cipher = AESCipher("bench-key")
+    for size in _AES_PAYLOAD_SIZES:
+        plain = "x" * size
+        encrypted = cipher.encrypt(plain)
+        number = max(10, 2000 * 16 // size)
+        found.append(("aes.encrypt.{}b".format(size), lambda p=plain: cipher.encrypt(p), number))
+        found.append(("aes.decrypt.{}b".format(size), lambda e=encrypted: cipher.decrypt(e), number))
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--only", default=None,
+                        help="comma separated name prefixes of the cases to run")
+    parser.add_argument("--repeat", type=int, default=7, help="timed rounds per case")
+    parser.add_argument("--warmup", type=int, default=None,
+                        help="untimed calls before timing. defaults to one round's worth")
+    parser.add_argument("--output", default=None, help="write the results as JSON to this file")
+    parser.add_argument("--baseline", default=None, help="a previous --output file to compare with")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="relative p50 slowdown that counts as a regression")
+    args = parser.parse_args()
+
+    prefixes = tuple(args.only.split(",")) if args.only else None
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    results = {}
+    regressions = 0
+    for name, fn, number in cases():
+        if prefixes and not name.startswith(prefixes):
+            continue
+        warmup = number if args.warmup is None else args.warmup
+        stats = bench(fn, number=number, repeat=args.repeat, warmup=warmup)
+        results[name] = stats
+
+        line = "{name:<24} p50 {p50:10.2f} us  mean {mean:10.2f} us  stdev {stdev:8.2f}  " \
+               "min {min:10.2f}  max {max:10.2f}".format(name=name, **stats)
+        before = baseline.get(name)
+        if before and before["p50"]:
+            change = (stats["p50"] - before["p50"]) / before["p50"]
+            line += "  {:+6.1%}".format(change)
+            if change > args.threshold:
+                line += "  REGRESSION"
+                regressions += 1
+        print(line)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
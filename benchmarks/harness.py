@@ -0,0 +1,74 @@
+"""
+    small helpers shared by the benchmark scripts. run the scripts from the repo root, e.g.
+    python -m benchmarks.bench_signup
+"""
+import statistics
+import threading
+import time
+
+
+def percentile(samples: list, pct: float) -> float:
+    """ nearest-rank percentile of an unsorted list """
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[rank]
+
+
+def summarize(samples: list) -> dict:
+    """ mean, stdev and tail percentiles of a list of timings """
+    return {
+        "n": len(samples),
+        "mean": statistics.mean(samples) if samples else 0.0,
+        "stdev": statistics.stdev(samples) if len(samples) > 1 else 0.0,
+        "min": min(samples) if samples else 0.0,
+        "p50": percentile(samples, 50),
+        "p95": percentile(samples, 95),
+        "p99": percentile(samples, 99),
+        "max": max(samples) if samples else 0.0,
+    }
+
+
+def bench(fn, number: int=1000, repeat: int=5, warmup: int=100) -> dict:
+    """ time fn() in a tight loop. after `warmup` untimed calls, runs `repeat` rounds of `number`
+    calls and summarizes the per-call time of each round in microseconds """
+    for _ in range(warmup):
+        fn()
+
+    rounds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        rounds.append((time.perf_counter() - start) / number * 1e6)
+    return summarize(rounds)
+
+
+def run_concurrent(fn, n: int, concurrency: int) -> (float, list):
+    """ call fn(i) for i in range(n) spread across `concurrency` threads. returns the wall clock
+    seconds for the whole run and the latency, in ms, of every call """
+    latencies = []
+    lock = threading.Lock()
+    counter = iter(range(n))
+
+    def worker():
+        local = []
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                break
+            start = time.perf_counter()
+            fn(i)
+            local.append((time.perf_counter() - start) * 1000)
+        with lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return time.perf_counter() - start, latencies
@@ -0,0 +1,352 @@
+"""
+    end-to-end HTTP load test. serves webapp.app:app with waitress against a throwaway postgres
+    cluster (initdb/pg_ctl must be on the PATH) or an existing database given with --database-url,
+    migrates it to head with alembic, then drives each endpoint at fixed concurrency levels. the
+    results, tagged with the current git sha, are written as JSON to benchmarks/results/.
+
+    python -m benchmarks.loadtest run --concurrency 1,8,32 --requests 500
+    python -m benchmarks.loadtest compare benchmarks/results/BASE.json benchmarks/results/HEAD.json
+
+    compare exits with status 1 if any scenario regressed by more than --threshold
+"""
+import argparse
+import base64
+import datetime
+import http.client
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from sqlalchemy import create_engine, text
+from .harness import run_concurrent, summarize
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_RESULTS_DIR = os.path.join(_ROOT, "benchmarks", "results")
+
+# what the waitress-serve console script runs. waitress 1.0 has no __main__ so "-m waitress" fails;
+# this keeps the server on the same interpreter as the harness
+_WAITRESS_SERVE = "import sys; from waitress.runner import run; sys.exit(run())"
+
+_SEED_EMAIL = "loadtest@example.com"
+_SEED_PASSWORD = "loadtest-password"
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _basic_auth(username: str, password: str) -> dict:
+    creds = base64.b64encode("{}:{}".format(username, password).encode()).decode()
+    return {"Authorization": "Basic " + creds}
+
+
+def _git_sha() -> (str, bool):
+    """ the checked out commit and whether the work tree has uncommitted changes """
+    try:
+        sha = subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=_ROOT).decode().strip()
+        dirty = bool(subprocess.check_output(["git", "status", "--porcelain", "--untracked-files=no"],
+                                             cwd=_ROOT).strip())
+        return sha, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown", False
+
+
+@contextmanager
+def throwaway_postgres():
+    """ a temporary postgres cluster on a free port, deleted on exit. yields its url """
+    datadir = tempfile.mkdtemp(prefix="loadtest-pg-")
+    port = _free_port()
+    try:
+        subprocess.check_call(["initdb", "-D", datadir, "-U", "postgres", "-A", "trust"],
+                              stdout=subprocess.DEVNULL)
+        subprocess.check_call(["pg_ctl", "-D", datadir, "-w", "-l", os.path.join(datadir, "log"),
+                               "-o", "-p {} -k {} -c listen_addresses=127.0.0.1".format(port, datadir),
+                               "start"], stdout=subprocess.DEVNULL)
+        try:
+            yield "postgresql://postgres@127.0.0.1:{}/postgres".format(port)
+        finally:
+            subprocess.call(["pg_ctl", "-D", datadir, "-w", "-m", "fast", "stop"],
+                            stdout=subprocess.DEVNULL)
+    finally:
+        shutil.rmtree(datadir, ignore_errors=True)
+
+
+@contextmanager
+def waitress_server(env: dict, threads: int):
+    """ serve the app in a child process. yields the port once it answers /api/hello """
+    port = _free_port()
+    proc = subprocess.Popen([sys.executable, "-c", _WAITRESS_SERVE,
+                             "--port={}".format(port), "--threads={}".format(threads),
+                             "webapp.app:app"], cwd=_ROOT, env=env)
+    try:
+        deadline = time.monotonic() + 30
+        while True:
+            if proc.poll() is not None:
+                raise RuntimeError("waitress exited with status {}".format(proc.returncode))
+            try:
+                conn = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+                conn.request("GET", "/api/hello")
+                conn.getresponse().read()
+                conn.close()
+                break
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise RuntimeError("waitress did not start within 30 seconds")
+                time.sleep(0.1)
+        yield port
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+class Client():
+    """ one keep-alive connection per thread """
+
+    def __init__(self, port: int):
+        self.port = port
+        self.__local = threading.local()
+
+    def request(self, method: str, path: str, headers: dict=None) -> (int, bytes):
+        conn = getattr(self.__local, "conn", None)
+        if conn is None:
+            conn = self.__local.conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=30)
+        try:
+            conn.request(method, path, headers=headers or {})
+            response = conn.getresponse()
+            return response.status, response.read()
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            self.__local.conn = None
+            raise
+
+
+def scenarios(client: Client, run_id: str) -> list:
+    """ (name, path, fn(key) -> status) for every endpoint under test. key is unique per call """
+    login = _basic_auth(_SEED_EMAIL, _SEED_PASSWORD)
+
+    def signup(key):
+        email = "loadtest+{}+{}@example.com".format(run_id, key)
+        return client.request("POST", "/api/account", _basic_auth(email, "password"))[0]
+
+    return [
+        ("hello", "/api/hello", lambda key: client.request("GET", "/api/hello")[0]),
+        ("echo", "/api/echo",
+         lambda key: client.request("GET", "/api/echo?message=hi&number=42&vote=red")[0]),
+        ("protectedhello", "/api/protectedhello",
+         lambda key: client.request("GET", "/api/protectedhello", login)[0]),
+        ("account", "/api/account", signup),
+        ("session", "/api/session", lambda key: client.request("GET", "/api/session", login)[0]),
+    ]
+
+
+def db_cost(engine, path: str, since: datetime.datetime) -> dict:
+    """ average statements and database ms per request from the endpoint log """
+    with engine.connect() as conn:
+        row = conn.execute(text("""
+            select count(*) as n, avg(db_queries) as queries, avg(db_time_ms) as time_ms
+            from endpoint_log
+            where start_utc >= :since and endpoint like :pattern
+            """), {"since": since, "pattern": "%" + path}).first()
+    return {
+        "logged_requests": row.n,
+        "db_queries_per_request": float(row.queries) if row.queries is not None else None,
+        "db_time_ms_per_request": float(row.time_ms) if row.time_ms is not None else None,
+    }
+
+
+def run_load(database_url: str, levels: list, n_requests: int, warmup: int, threads: int) -> list:
+    env = dict(os.environ)
+    env.update({
+        "DATABASE_URL": database_url,
+        "JWT_SECRET": env.get("JWT_SECRET", "loadtest-secret"),
+        "JWT_ISS": env.get("JWT_ISS", "loadtest"),
+        # get endpoint log rows into the table quickly so their db stats can be read back
+        "ENDPOINT_LOG_FLUSH_MS": "100",
+        "ENDPOINT_LOG_QUEUE_SIZE": str(max(10000, n_requests * 2)),
+    })
+
+    subprocess.check_call([sys.executable, "-m", "alembic", "upgrade", "head"], cwd=_ROOT, env=env)
+    engine = create_engine(database_url)
+    run_id = uuid.uuid4().hex[:8]
+    results = []
+
+    with waitress_server(env, threads) as port:
+        client = Client(port)
+        # the account behind the authenticated scenarios. it may exist from an earlier run against
+        # the same database, so only the login has to succeed
+        client.request("POST", "/api/account", _basic_auth(_SEED_EMAIL, _SEED_PASSWORD))
+        status, body = client.request("GET", "/api/session", _basic_auth(_SEED_EMAIL, _SEED_PASSWORD))
+        if status != 200:
+            raise RuntimeError("unable to seed the load test account: {} {}".format(status, body))
+
+        for name, path, fn in scenarios(client, run_id):
+            for concurrency in levels:
+                prefix = "{}-c{}".format(name, concurrency)
+                run_concurrent(lambda i: fn("{}-warmup-{}".format(prefix, i)), warmup, concurrency)
+
+                errors = []
+                def call(i):
+                    status = fn("{}-{}".format(prefix, i))
+                    if status >= 400:
+                        errors.append(status)
+
+                since = datetime.datetime.utcnow()
+                elapsed, latencies = run_concurrent(call, n_requests, concurrency)
+                stats = summarize(latencies)
+
+                # wait for the endpoint log writer to flush this scenario's rows
+                time.sleep(0.5)
+                result = {
+                    "scenario": name,
+                    "concurrency": concurrency,
+                    "requests": n_requests,
+                    "errors": len(errors),
+                    "throughput_rps": n_requests / elapsed if elapsed else 0.0,
+                    "latency_ms": {k: stats[k] for k in ("mean", "p50", "p95", "p99", "max")},
+                }
+                result.update(db_cost(engine, path, since))
+                results.append(result)
+                print("{scenario:>15} c={concurrency:<3} {throughput_rps:8.1f} req/s  "
+                      "p50 {p50:7.1f} ms  p95 {p95:7.1f} ms  p99 {p99:7.1f} ms  "
+                      "queries/req {queries}  errors {errors}".format(**{
+                          "scenario": name,
+                          "concurrency": concurrency,
+                          "throughput_rps": result["throughput_rps"],
+                          "p50": stats["p50"],
+                          "p95": stats["p95"],
+                          "p99": stats["p99"],
+                          "queries": result["db_queries_per_request"],
+                          "errors": result["errors"],
+                          }))
+
+    engine.dispose()
+    return results
+
+
+def run(args):
+    levels = [int(c) for c in args.concurrency.split(",")]
+    sha, dirty = _git_sha()
+
+    if args.database_url:
+        results = run_load(args.database_url, levels, args.requests, args.warmup, args.threads)
+    else:
+        with throwaway_postgres() as url:
+            results = run_load(url, levels, args.requests, args.warmup, args.threads)
+
+    started = datetime.datetime.utcnow()
+    report = {
+        "git_sha": sha,
+        "dirty": dirty,
+        "created_utc": started.isoformat() + "Z",
+        "config": {
+            "concurrency": levels,
+            "requests": args.requests,
+            "warmup": args.warmup,
+            "threads": args.threads,
+            "python": sys.version.split()[0],
+        },
+        "results": results,
+    }
+
+    path = args.output
+    if not path:
+        os.makedirs(_RESULTS_DIR, exist_ok=True)
+        path = os.path.join(_RESULTS_DIR, "{}-{}{}.json".format(
+            started.strftime("%Y%m%dT%H%M%S"), sha[:12], "-dirty" if dirty else ""))
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    print("results written to {}".format(path))
+
+
+def compare(args) -> int:
+    """ print the change of every metric between two runs. returns the number of regressions """
+    with open(args.base) as f:
+        base = json.load(f)
+    with open(args.head) as f:
+        head = json.load(f)
+
+    base_results = {(r["scenario"], r["concurrency"]): r for r in base["results"]}
+    print("base {} -> head {}".format(base["git_sha"][:12], head["git_sha"][:12]))
+
+    regressions = 0
+    for result in head["results"]:
+        key = (result["scenario"], result["concurrency"])
+        before = base_results.get(key)
+        if before is None:
+            continue
+
+        # (label, base value, head value, True if higher is better)
+        checks = [
+            ("req/s", before["throughput_rps"], result["throughput_rps"], True),
+            ("p50", before["latency_ms"]["p50"], result["latency_ms"]["p50"], False),
+            ("p95", before["latency_ms"]["p95"], result["latency_ms"]["p95"], False),
+            ("p99", before["latency_ms"]["p99"], result["latency_ms"]["p99"], False),
+        ]
+        flagged = []
+        for label, old, new, higher_is_better in checks:
+            if not old:
+                continue
+            change = (new - old) / old
+            if (-change if higher_is_better else change) > args.threshold:
+                flagged.append("{} {:+.1%}".format(label, change))
+
+        # any extra statement per request is a regression regardless of timing noise
+        old_q, new_q = before.get("db_queries_per_request"), result.get("db_queries_per_request")
+        if old_q is not None and new_q is not None and new_q - old_q > 0.01:
+            flagged.append("queries/req {:.2f} -> {:.2f}".format(old_q, new_q))
+        if result["errors"] > before["errors"]:
+            flagged.append("errors {} -> {}".format(before["errors"], result["errors"]))
+
+        regressions += len(flagged)
+        print("{:>15} c={:<3} {:8.1f} -> {:8.1f} req/s  p99 {:7.1f} -> {:7.1f} ms  {}".format(
+            key[0], key[1], before["throughput_rps"], result["throughput_rps"],
+            before["latency_ms"]["p99"], result["latency_ms"]["p99"],
+            "REGRESSION: " + ", ".join(flagged) if flagged else "ok"))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command")
+
+    run_parser = commands.add_parser("run", help="run the load test and store the results")
+    run_parser.add_argument("--database-url", default=None,
+                            help="use this database instead of a throwaway cluster")
+    run_parser.add_argument("--concurrency", default="1,8,32",
+                            help="comma separated client concurrency levels")
+    run_parser.add_argument("--requests", type=int, default=500,
+                            help="requests per scenario and concurrency level")
+    run_parser.add_argument("--warmup", type=int, default=50)
+    run_parser.add_argument("--threads", type=int, default=8, help="waitress worker threads")
+    run_parser.add_argument("--output", default=None, help="results file path")
+
+    compare_parser = commands.add_parser("compare", help="flag regressions between two runs")
+    compare_parser.add_argument("base")
+    compare_parser.add_argument("head")
+    compare_parser.add_argument("--threshold", type=float, default=0.10,
+                                help="relative change that counts as a regression")
+
+    args = parser.parse_args()
+    if args.command == "run":
+        run(args)
+    elif args.command == "compare":
+        sys.exit(1 if compare(args) else 0)
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,8 @@
 from flask import request
 from flask_restful import Resource
-from ..core.utils.responsejson import ErrorResponseJson, ExceptionResponseJson
+from ..core.utils.hashpool import HashPoolSaturatedException
+from ..core.utils.responsejson import ErrorResponseJson, ExceptionResponseJson, \
+    ServiceUnavailableResponseJson
 from ..extensions.requestparser import RequestParser
 from ..extensions.decorators import require_auth_header, validate_json
 from ..managers.accountmanager import AccountManager
@@ -19,6 +21,8 @@ class Account(Resource):
             result = acct_manager.create(email, password)
             return result.make_response()
 
+        except HashPoolSaturatedException:
+            return ServiceUnavailableResponseJson().make_response()
         except KeyError as e:
             return ErrorResponseJson("missing required key: {}".format(str(e))).make_response()
         except Exception as e:
@@ -8,6 +8,7 @@ from flask_restful import Api
 from .account import Account
 from .session import Session
 from .hello import HelloWorld, EchoWorld, ProtectedWorld
+from .metrics import Metrics
 
 # endpoint routing errors, not the same as application level errors handled by the ResponseJson class
 errors = {
@@ -33,4 +34,5 @@ demo_api.add_resource(EchoWorld,"/echo")
 demo_api.add_resource(ProtectedWorld,"/protectedhello")
 demo_api.add_resource(Account,"/account")
 demo_api.add_resource(Session,"/session")
+demo_api.add_resource(Metrics,"/metrics")
 
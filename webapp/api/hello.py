@@ -1,8 +1,9 @@
 from flask import request
 from flask_restful import Resource
+from flask_restful.reqparse import Argument
 from ..core.utils.responsejson import ResponseJson, MessageResponseJson
 from ..extensions.decorators import require_password
-from ..extensions.requestparser import RequestParser 
+from ..extensions.schema import Schema
 
 
 class HelloWorld(Resource):
@@ -14,15 +15,18 @@ class HelloWorld(Resource):
 
 
 class EchoWorld(Resource):
-    """ this is an example of how to parse URL parameters """
+    """ this is an example of how to parse URL parameters. the schema is compiled once, when the
+    class is defined, rather than on every request """
+
+    schema = Schema(
+        Argument("message", type=str, required=True, location="args"),
+        Argument("number", type=int, required=False, location="args"),
+        Argument("vote", type=str, required=False, choices=("red", "blue", "green"),
+                location="args"),
+        )
 
     def get(self):
-        parser = RequestParser()
-        parser.add_argument("message", type=str, required=True, location="args")
-        parser.add_argument("number", type=int, required=False, location="args")
-        parser.add_argument("vote", type=str, required=False, choices=("red", "blue", "green"),
-                location="args")
-        args = parser.parse_args()
+        args = self.schema.parse()
 
         data = {
             "number": args.number if args.number else None,
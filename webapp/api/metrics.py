@@ -0,0 +1,20 @@
+import hmac
+import os
+from flask import request, Response
+from flask_restful import Resource
+from ..core.utils import metrics
+from ..core.utils.responsejson import UnauthorizedResponseJson
+
+
+class Metrics(Resource):
+    """ prometheus scrape endpoint. if METRICS_TOKEN is set, scrapers have to send it as a bearer
+    token """
+
+    def get(self):
+        token = os.getenv("METRICS_TOKEN")
+        if token:
+            given = request.headers.get("Authorization", "")
+            if not hmac.compare_digest(given.encode(), "Bearer {}".format(token).encode()):
+                return UnauthorizedResponseJson().make_response()
+
+        return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
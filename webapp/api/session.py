@@ -3,7 +3,8 @@
 """
 from flask import request
 from flask_restful import Resource
-from ..core.utils.responsejson import ExceptionResponseJson
+from ..core.utils.hashpool import HashPoolSaturatedException
+from ..core.utils.responsejson import ExceptionResponseJson, ServiceUnavailableResponseJson
 from ..extensions.requestparser import RequestParser
 from ..extensions.decorators import require_token, require_auth_header
 from ..managers.accountmanager import AccountManager
@@ -23,6 +24,8 @@ class Session(Resource):
             result = acct_manager.login(email, password)
             return result.make_response()
 
+        except HashPoolSaturatedException:
+            return ServiceUnavailableResponseJson().make_response()
         except Exception as e:
             return ExceptionResponseJson(str(e), e).make_response()
 
@@ -1,51 +1,78 @@
 import os
 import time
 import datetime
-from flask import Flask, request, jsonify, g
+import traceback
+from flask import Flask, request, g
 from flask_restful import Resource, Api
 from .api.endpoints import demo_blueprint
-from .core.utils.responsejson import ErrorResponseJson
+from .core.utils.responsejson import ErrorResponseJson, ExceptionResponseJson
 from .core.utils.logger import Logger
+from .core.utils import metrics, replica, sqlstats
+from .core.utils.dbsession import begin_unit_of_work, commit_unit_of_work, end_unit_of_work
 
 app = Flask(__name__)
 app.config["SQLALCHEMY_DATABASE_URI"] = os.getenv("DATABASE_URL")
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
-app.config["SQLALCHEMY_RECORD_QUERIES"] = True
 
 @app.before_request
 def before_request():
     """ called before every request """
     g.start_time = time.time()
+    sqlstats.begin_request()
+    replica.begin_request()
+    begin_unit_of_work()
 
 @app.after_request
 def after_request(response):
     """ called after every request """
 
+    # commit the request's database work in one transaction. this happens here rather than in
+    # teardown so a failed commit can still turn into an error response
+    try:
+        commit_unit_of_work()
+    except Exception as e:
+        traceback.print_exc()
+        response = ExceptionResponseJson("unable to save changes", e).make_response()
+
     # log the endpoint hit and any errors
-    delta = int((time.time() - g.start_time) * 1000)
+    elapsed_ms = (time.time() - g.start_time) * 1000
+    delta = int(elapsed_ms)
     start_utc = datetime.datetime.utcfromtimestamp(g.start_time)
     username = request.authorization.username if request.authorization else None
     err_msg = response.get_data(as_text=True) if response.status_code // 100 >= 4 else None
+    db_queries, db_time_ms = sqlstats.current()
     Logger.endpoint_hit(start_utc, delta, request.base_url, username, request.method,
-                        response.status_code, err_msg)
+                        response.status_code, err_msg, db_queries=db_queries, db_time_ms=db_time_ms)
+
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    metrics.observe_request(route, request.method, response.status_code, elapsed_ms)
     return response
 
+@app.teardown_request
+def teardown_request(exc):
+    """ called at the end of every request, even if it raised. releases the request's database
+    session, rolling back anything that wasn't committed """
+    end_unit_of_work()
+
 @app.errorhandler(401)
 def unauthorizedAccess(error):
-    json_resp, http_code = ErrorResponseJson("Unauthorized Access").make_response()
-    return jsonify(json_resp), 401
+    r = ErrorResponseJson("Unauthorized Access")
+    r.return_code = 401
+    return r.make_response()
 
 
 @app.errorhandler(404)
 def pageNotFoundError(error):
-    json_resp, http_code = ErrorResponseJson("HTTP Page Not Found").make_response()
-    return jsonify(json_resp), 404
+    r = ErrorResponseJson("HTTP Page Not Found")
+    r.return_code = 404
+    return r.make_response()
 
 
 @app.errorhandler(405)
 def invalidMethod(error):
-    json_resp, http_code = ErrorResponseJson("HTTP Method Not Allowed").make_response()
-    return jsonify(json_resp), 405
+    r = ErrorResponseJson("HTTP Method Not Allowed")
+    r.return_code = 405
+    return r.make_response()
 
 
 # register endpoint blueprints
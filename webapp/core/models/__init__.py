@@ -5,3 +5,6 @@ from .account import *
 from .endpointlog import *
 from .sessiontoken import *
 from .systemlog import *
+from .revokedtoken import *
+from .endpointstatsminute import *
+from .rollupwatermark import *
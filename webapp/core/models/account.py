@@ -1,7 +1,7 @@
 """
     object model rep of an user account
 """
-from sqlalchemy import Column
+from sqlalchemy import Column, Index
 from sqlalchemy.sql import func
 from sqlalchemy.dialects import postgresql as pgsql
 from sqlalchemy.schema import Sequence
@@ -11,6 +11,9 @@ from ..models import Base
 
 class Account(Base):
     __tablename__ = "user_account"
+    __table_args__ = (
+        Index("ix_user_account_email", "email", unique=True),
+    )
 
     _ID_SEQ = Sequence("user_account_id_seq")
     id = Column(pgsql.INTEGER, _ID_SEQ, server_default=_ID_SEQ.next_value(), primary_key=True,
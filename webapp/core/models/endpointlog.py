@@ -2,29 +2,37 @@
     log of all endpoint hits and their return errors
 """
 import datetime
-from sqlalchemy import Column
+from sqlalchemy import Column, Index
 from sqlalchemy.dialects import postgresql as pgsql
 from sqlalchemy.schema import Sequence
 from . import Base
 
 class EndpointLog(Base):
-    """ a table that keeps track of endpoint hits """
+    """ a table that keeps track of endpoint hits. it's range partitioned into one table per day
+    of start_utc (endpoint_log_pYYYYMMDD) plus endpoint_log_default for anything outside them;
+    see webapp/jobs/partitions.py """
     __tablename__ = "endpoint_log"
-    __table_args__ = ()
+    __table_args__ = (
+        Index("ix_endpoint_log_start_utc_id", "start_utc", "id"),
+        {"postgresql_partition_by": "RANGE (start_utc)"},
+    )
 
     _ID_SEQ = Sequence("endpoint_log_id_seq")
     id = Column(pgsql.INTEGER, _ID_SEQ, server_default=_ID_SEQ.next_value(), primary_key=True,
                 nullable=False)
-    start_utc = Column(pgsql.TIMESTAMP(timezone=False), nullable=False)
+    start_utc = Column(pgsql.TIMESTAMP(timezone=False), primary_key=True, nullable=False)
     duration_ms = Column(pgsql.INTEGER, nullable=False)
     endpoint = Column(pgsql.TEXT)
     username = Column(pgsql.TEXT)
     method = Column(pgsql.TEXT)
     http_code = Column(pgsql.TEXT)
     error_message = Column(pgsql.TEXT)
+    db_queries = Column(pgsql.INTEGER)
+    db_time_ms = Column(pgsql.INTEGER)
 
     def __init__(self, start_utc: datetime.datetime, duration_ms: int, endpoint: str,
-                 username: str, method: str, http_code: int, error_message: str=None):
+                 username: str, method: str, http_code: int, error_message: str=None,
+                 db_queries: int=None, db_time_ms: int=None):
         self.start_utc = str(start_utc)
         self.duration_ms = duration_ms
         self.endpoint = endpoint
@@ -32,6 +40,8 @@ class EndpointLog(Base):
         self.method = method
         self.http_code = http_code
         self.error_message = error_message
+        self.db_queries = db_queries
+        self.db_time_ms = db_time_ms
 
     def __str__(self):
         return "[{start_utc}]{username}: {method} {endpoint} HTTP: {http_code}".format(**{
@@ -0,0 +1,25 @@
+"""
+    per-minute aggregates of endpoint_log, written by the rollup job
+"""
+from sqlalchemy import Column
+from sqlalchemy.dialects import postgresql as pgsql
+from . import Base
+
+class EndpointStatsMinute(Base):
+    """ the requests of one minute for one endpoint, method and status. duration_ms_buckets holds
+    non-cumulative counts for each bound of metrics.LATENCY_BUCKETS_MS (a duration lands in the
+    first bucket it's less than or equal to) plus a last slot for anything slower """
+    __tablename__ = "endpoint_stats_minute"
+
+    minute_utc = Column(pgsql.TIMESTAMP(timezone=False), primary_key=True, nullable=False)
+    endpoint = Column(pgsql.TEXT, primary_key=True, nullable=False)
+    method = Column(pgsql.TEXT, primary_key=True, nullable=False)
+    http_code = Column(pgsql.TEXT, primary_key=True, nullable=False)
+    count = Column(pgsql.INTEGER, nullable=False)
+    error_count = Column(pgsql.INTEGER, nullable=False)
+    duration_ms_sum = Column(pgsql.BIGINT, nullable=False)
+    duration_ms_min = Column(pgsql.INTEGER, nullable=False)
+    duration_ms_max = Column(pgsql.INTEGER, nullable=False)
+    db_queries_sum = Column(pgsql.BIGINT)
+    db_time_ms_sum = Column(pgsql.BIGINT)
+    duration_ms_buckets = Column(pgsql.ARRAY(pgsql.INTEGER), nullable=False)
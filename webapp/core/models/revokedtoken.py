@@ -0,0 +1,30 @@
+"""
+    tokens that were logged out before they expired. in stateless token mode this is the only
+    record of a logout
+"""
+import datetime
+from sqlalchemy import Column, Index
+from sqlalchemy.sql import func
+from sqlalchemy.schema import Sequence
+from sqlalchemy.dialects import postgresql as pgsql
+from . import Base
+
+class RevokedToken(Base):
+    """ a revoked JWT, identified by its jti claim. rows can be purged once the token expires """
+    __tablename__ = "revoked_token"
+    __table_args__ = (
+        Index("ix_revoked_token_jti", "jti", unique=True),
+        Index("ix_revoked_token_revoked_utc", "revoked_utc"),
+        Index("ix_revoked_token_expires_utc_id", "expires_utc", "id"),
+    )
+
+    _ID_SEQ = Sequence("revoked_token_id_seq")
+    id = Column(pgsql.INTEGER, _ID_SEQ, server_default=_ID_SEQ.next_value(), primary_key=True,
+                nullable=False)
+    jti = Column(pgsql.TEXT, nullable=False)
+    expires_utc = Column(pgsql.TIMESTAMP(timezone=False), nullable=False)
+    revoked_utc = Column(pgsql.TIMESTAMP(timezone=False), server_default=func.now(), nullable=False)
+
+    def __init__(self, jti: str, expires_utc: datetime.datetime):
+        self.jti = jti
+        self.expires_utc = expires_utc
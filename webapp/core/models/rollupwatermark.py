@@ -0,0 +1,13 @@
+"""
+    how far each rollup job has aggregated
+"""
+from sqlalchemy import Column
+from sqlalchemy.dialects import postgresql as pgsql
+from . import Base
+
+class RollupWatermark(Base):
+    """ rows before last_utc have been rolled up by the job called name """
+    __tablename__ = "rollup_watermark"
+
+    name = Column(pgsql.TEXT, primary_key=True, nullable=False)
+    last_utc = Column(pgsql.TIMESTAMP(timezone=False), nullable=False)
@@ -1,20 +1,30 @@
-from sqlalchemy import Column
+import datetime
+from sqlalchemy import Column, Index
 from sqlalchemy.sql import func
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.schema import Sequence
 from sqlalchemy.dialects import postgresql as pgsql
+from ..utils.security import token_digest
 from . import Base
 
 class SessionToken(Base):
+    """ an issued session. only a digest of the token is stored, never the token itself """
     __tablename__ = "session_token"
+    __table_args__ = (
+        Index("ix_session_token_token_digest", "token_digest", unique=True),
+        Index("ix_session_token_user_id_created_utc", "user_id", "created_utc"),
+        Index("ix_session_token_expires_utc_id", "expires_utc", "id"),
+    )
 
     _ID_SEQ = Sequence("session_token_id_seq")
     id = Column(pgsql.INTEGER, _ID_SEQ, server_default=_ID_SEQ.next_value(), primary_key=True,
                 nullable=False)
-    user_id = Column(pgsql.TEXT)
-    token = Column(pgsql.TEXT)
+    user_id = Column(pgsql.TEXT, nullable=False)
+    token_digest = Column(pgsql.TEXT, nullable=False)
     created_utc = Column(pgsql.TIMESTAMP(timezone=False), server_default=func.now())
+    expires_utc = Column(pgsql.TIMESTAMP(timezone=False), nullable=False)
 
-    def __init__(self, user_id: str, token: str):
+    def __init__(self, user_id: str, token: str, expires_utc: datetime.datetime):
         self.user_id = user_id
-        self.token = token
+        self.token_digest = token_digest(token)
+        self.expires_utc = expires_utc
@@ -3,7 +3,7 @@
 """
 import datetime
 from enum import unique, auto
-from sqlalchemy import Column
+from sqlalchemy import Column, Index
 from sqlalchemy.sql import func
 from sqlalchemy.dialects import postgresql as pgsql
 from sqlalchemy.schema import Sequence
@@ -34,11 +34,17 @@ class LogLevel(AutoNamedEnum):
     # NOTE: AWS goes down
     CRITICAL = auto()
 
+    # markers written by Logger.start() and Logger.end() around a timed event
+    START_EVENT = auto()
+    END_EVENT = auto()
+
 
 class SystemLog(Base):
     """ a single log """
     __tablename__ = "system_log"
-    __table_args__ = ()
+    __table_args__ = (
+        Index("ix_system_log_event_utc_id", "event_utc", "id"),
+    )
 
     _ID_SEQ = Sequence("system_log_id_seq")
     id = Column(pgsql.INTEGER, _ID_SEQ, server_default=_ID_SEQ.next_value(), primary_key=True,
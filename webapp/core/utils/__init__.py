@@ -1,6 +1,7 @@
 import os
 from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, scoped_session
+from sqlalchemy.orm import sessionmaker
+from . import poolstats, sqlstats
 
 # Sessions and Connections
 # https://stackoverflow.com/questions/34322471/sqlalchemy-engine-connection-and-session-difference
@@ -16,34 +17,71 @@ class MissingDatabaseException(Exception):
         super(MissingDatabaseException, self).__init__("Database Not Initialized")
 
 
+def _env_flag(name: str, default: str) -> bool:
+    return os.getenv(name, default).lower() in ("1", "true", "yes", "on")
+
+
+def _engine_options(prefix: str) -> dict:
+    """ pool settings read from <prefix>_POOL_SIZE, <prefix>_MAX_OVERFLOW, <prefix>_POOL_TIMEOUT,
+    <prefix>_POOL_PRE_PING, <prefix>_POOL_RECYCLE and <prefix>_STATEMENT_CACHE_SIZE. pre-ping and
+    recycle default to on because heroku kills idle connections """
+    return {
+        "poolclass": poolstats.TimedQueuePool,
+        "pool_size": int(os.getenv(prefix + "_POOL_SIZE", 5)),
+        "max_overflow": int(os.getenv(prefix + "_MAX_OVERFLOW", 10)),
+        "pool_timeout": float(os.getenv(prefix + "_POOL_TIMEOUT", 30)),
+        "pool_pre_ping": _env_flag(prefix + "_POOL_PRE_PING", "true"),
+        "pool_recycle": int(os.getenv(prefix + "_POOL_RECYCLE", 1800)),
+        "query_cache_size": int(os.getenv(prefix + "_STATEMENT_CACHE_SIZE", 500)),
+    }
+
+
+# engines and session factories are built once, at import. every session is a plain Session from
+# these factories; a scoped registry would hand nested dbsession() blocks the same session
+_engine = None
+_ro_engine = None
 _session_factory = None
+_primary_read_session_factory = None
 _ro_session_factory = None
+pool_stats = {}
 
+# read sessions run in auto-commit mode: a plain SELECT needs no BEGIN/COMMIT round trips
 if "DATABASE_URL" in os.environ:
-    _engine = create_engine(os.getenv("DATABASE_URL"), convert_unicode=True)
-    _session_factory = sessionmaker(bind=_engine)
+    _engine = create_engine(os.getenv("DATABASE_URL"), **_engine_options("DB"))
+    pool_stats["primary"] = poolstats.instrument(_engine, "primary")
+    sqlstats.instrument(_engine)
+    _session_factory = sessionmaker(bind=_engine, autoflush=False, expire_on_commit=True)
+    _primary_read_session_factory = sessionmaker(
+        bind=_engine.execution_options(isolation_level="AUTOCOMMIT"),
+        autoflush=False, expire_on_commit=False)
 
 if "DATABASE_RO_URL" in os.environ:
-    _ro_engine = create_engine(os.getenv("DATABASE_RO_URL"), convert_unicode=True)
-    _ro_session_factory = sessionmaker(bind=_ro_engine)
+    _ro_engine = create_engine(os.getenv("DATABASE_RO_URL"), isolation_level="AUTOCOMMIT",
+                               **_engine_options("DB_RO"))
+    pool_stats["replica"] = poolstats.instrument(_ro_engine, "replica")
+    sqlstats.instrument(_ro_engine)
+    _ro_session_factory = sessionmaker(bind=_ro_engine, autoflush=False, expire_on_commit=False)
 
 
 def _configure_session(factory, autocommit, autoflush, expire_on_commit):
     if factory:
-        s = scoped_session(factory)
-        s.configure(autocommit=autocommit,
-                    autoflush=autoflush,
-                    expire_on_commit=expire_on_commit)
-        return s
+        return factory(autocommit=autocommit,
+                       autoflush=autoflush,
+                       expire_on_commit=expire_on_commit)
     else:
         raise MissingDatabaseException()
 
 
-def create_read_session(autocommit=False, autoflush=False, expire_on_commit=False):
+def create_read_session(autocommit=False, autoflush=False, expire_on_commit=False, replica=True):
+    """ a session for read-only queries. it reads from the replica when one is configured and
+    replica is True, otherwise from the primary """
+    factory = _ro_session_factory if replica and _ro_session_factory else _primary_read_session_factory
     try:
-        return _configure_session(_ro_session_factory, autocommit, autoflush, expire_on_commit)
+        session = _configure_session(factory, autocommit, autoflush, expire_on_commit)
     except Exception as exc:
         raise(exc)
+    session.info["replica"] = factory is _ro_session_factory
+    return session
 
 
 def create_session(autocommit=False, autoflush=False, expire_on_commit=True):
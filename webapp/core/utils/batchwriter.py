@@ -0,0 +1,164 @@
+"""
+    background writer that inserts rows into a table in batches. callers append rows to a bounded
+    in-process queue and a single writer thread flushes them with one multi-row insert per batch
+"""
+import atexit
+import os
+import queue
+import threading
+import time
+import traceback
+from .dbsession import dbsession
+from . import sqlstats
+
+
+class BatchWriter():
+    """ buffers row dicts destined for a single table. a batch is flushed when it reaches
+    flush_rows rows or when flush_ms milliseconds have passed since its first row, whichever
+    comes first. all rows written by one writer must have the same keys """
+
+    # what to do when the queue is full
+    DROP_NEWEST = "drop-newest"     # discard the incoming row right away
+    BLOCK = "block"                 # wait up to block_ms for room, then discard the incoming row
+
+    # postgres caps a single statement at 65535 bind parameters
+    MAX_PARAMS = 65535
+
+    def __init__(self, table, max_queue: int=10000, flush_rows: int=500, flush_ms: int=1000,
+                 policy: str=DROP_NEWEST, block_ms: int=50):
+        if policy not in (self.DROP_NEWEST, self.BLOCK):
+            raise ValueError("unknown drop policy: {}".format(policy))
+
+        self.table = table
+        self.flush_rows = max(1, min(flush_rows, self.MAX_PARAMS // max(1, len(table.columns))))
+        self.flush_ms = max(1, flush_ms)
+        self.policy = policy
+        self.block_ms = block_ms
+
+        self.__queue = queue.Queue(maxsize=max_queue)
+        self.__lock = threading.Lock()
+        self.__thread = None
+        self.__stopping = threading.Event()
+        self.__counters = {
+            "enqueued": 0,
+            "dropped": 0,
+            "written": 0,
+            "batches": 0,
+            "failed_batches": 0,
+            "failed_rows": 0,
+        }
+
+    @classmethod
+    def from_env(cls, table, prefix: str):
+        """ build a writer configured through <prefix>_QUEUE_SIZE, <prefix>_FLUSH_ROWS,
+        <prefix>_FLUSH_MS, <prefix>_DROP_POLICY and <prefix>_BLOCK_MS env vars """
+        return cls(table,
+                   max_queue=int(os.getenv(prefix + "_QUEUE_SIZE", 10000)),
+                   flush_rows=int(os.getenv(prefix + "_FLUSH_ROWS", 500)),
+                   flush_ms=int(os.getenv(prefix + "_FLUSH_MS", 1000)),
+                   policy=os.getenv(prefix + "_DROP_POLICY", cls.DROP_NEWEST),
+                   block_ms=int(os.getenv(prefix + "_BLOCK_MS", 50)))
+
+    def put(self, row: dict) -> bool:
+        """ queue a row for writing. returns False if the row was dropped because the queue
+        is full or the writer has been closed """
+        if self.__stopping.is_set():
+            self.__count("dropped")
+            return False
+
+        self.__ensure_started()
+        try:
+            if self.policy == self.BLOCK:
+                self.__queue.put(row, timeout=self.block_ms / 1000)
+            else:
+                self.__queue.put_nowait(row)
+        except queue.Full:
+            self.__count("dropped")
+            return False
+
+        self.__count("enqueued")
+        return True
+
+    def flush(self):
+        """ synchronously write everything currently queued. used on shutdown and by scripts
+        that want their logs persisted before moving on """
+        while True:
+            batch = self.__take_nowait()
+            if not batch:
+                return
+            self.__write(batch)
+
+    def close(self, timeout: float=5.0):
+        """ stop accepting rows, let the writer thread drain the queue, then flush whatever
+        is left """
+        self.__stopping.set()
+        thread = self.__thread
+        if thread and thread.is_alive():
+            thread.join(timeout)
+        self.flush()
+
+    def stats(self) -> dict:
+        """ counters describing the writer's throughput and drop behavior """
+        with self.__lock:
+            stats = dict(self.__counters)
+        stats["queued"] = self.__queue.qsize()
+        stats["capacity"] = self.__queue.maxsize
+        return stats
+
+    def __count(self, name: str, n: int=1):
+        with self.__lock:
+            self.__counters[name] += n
+
+    def __ensure_started(self):
+        if self.__thread is not None:
+            return
+        with self.__lock:
+            if self.__thread is None:
+                thread = threading.Thread(target=self.__run,
+                                          name="batchwriter-{}".format(self.table.name))
+                thread.daemon = True
+                thread.start()
+                atexit.register(self.close)
+                self.__thread = thread
+
+    def __run(self):
+        while not (self.__stopping.is_set() and self.__queue.empty()):
+            batch = self.__take()
+            if batch:
+                self.__write(batch)
+
+    def __take(self) -> list:
+        """ block for the first row, then keep collecting until the batch is full or its
+        flush deadline passes """
+        batch = []
+        deadline = time.monotonic() + self.flush_ms / 1000
+        while len(batch) < self.flush_rows:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.__queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def __take_nowait(self) -> list:
+        batch = []
+        while len(batch) < self.flush_rows:
+            try:
+                batch.append(self.__queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def __write(self, batch: list):
+        try:
+            with sqlstats.suppressed(), dbsession() as session:
+                session.execute(self.table.insert().values(batch))
+            self.__count("written", len(batch))
+            self.__count("batches")
+        except Exception:
+            # there's nowhere left to log this to but stdout
+            traceback.print_exc()
+            self.__count("failed_batches")
+            self.__count("failed_rows", len(batch))
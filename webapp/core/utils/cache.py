@@ -0,0 +1,364 @@
+"""
+    named caches with pluggable backends and cross-process invalidation. writers call
+    notify_invalidation() inside their transaction; postgres delivers the NOTIFY to every worker
+    when that transaction commits, and each worker's listener thread evicts the key from its local
+    caches. the listener connects to DATABASE_URL and starts with the first cache in a process.
+
+    CACHE_BACKEND picks where entries live:
+        local   -- an in-process LRU per cache (default)
+        memory  -- one store shared by every cache of the process. a stand-in for a shared
+                   backend in tests and scripts
+        redis   -- a redis server at CACHE_REDIS_URL, shared by every worker. needs the redis package
+"""
+import json
+import os
+import select
+import threading
+import time
+import psycopg2
+import psycopg2.extensions
+from sqlalchemy import text
+from .logger import Logger
+from .ttlcache import TTLCache, InvalidationLog
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+_CHANNEL = os.getenv("CACHE_CHANNEL", "cache_invalidation")
+_NOTIFY = text("select pg_notify(:channel, :payload)")
+
+# name -> Cache, so invalidation messages can find their cache
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def _encode_key(key) -> str:
+    """ cache keys are str or bytes; NOTIFY payloads are text """
+    if isinstance(key, bytes):
+        return "b:" + key.hex()
+    return "s:" + str(key)
+
+
+def _decode_key(encoded: str):
+    kind, _, value = encoded.partition(":")
+    return bytes.fromhex(value) if kind == "b" else value
+
+
+def _encode_value(value) -> bytes:
+    """ values in a shared backend are raw bytes or JSON, never pickles: anyone who can write to
+    the backend must not be able to run code in the workers """
+    if isinstance(value, bytes):
+        return b"b" + value
+    return b"j" + json.dumps(value).encode("utf-8")
+
+
+def _decode_value(raw: bytes):
+    if raw[:1] == b"b":
+        return raw[1:]
+    return json.loads(raw[1:].decode("utf-8"))
+
+
+class LocalBackend():
+    """ an in-process LRU with per-entry expiration """
+
+    def __init__(self, name: str, max_size: int, ttl: float):
+        self.__cache = TTLCache(max_size=max_size, ttl=ttl)
+
+    def get(self, key, default=None):
+        return self.__cache.get(key, default)
+
+    def generation(self) -> int:
+        return self.__cache.generation()
+
+    def set(self, key, value, ttl: float=None, generation: int=None):
+        self.__cache.set(key, value, ttl, generation)
+
+    def invalidate(self, key) -> bool:
+        return self.__cache.invalidate(key)
+
+    def clear(self):
+        self.__cache.clear()
+
+    def stats(self) -> dict:
+        return self.__cache.stats()
+
+
+class MemoryBackend():
+    """ behaves like a shared backend inside one process: caches with the same name, even ones
+    created separately, see the same entries """
+
+    _stores = {}
+    _stores_lock = threading.Lock()
+
+    def __init__(self, name: str, max_size: int, ttl: float):
+        with self._stores_lock:
+            store = self._stores.get(name)
+            if store is None:
+                store = self._stores[name] = LocalBackend(name, max_size, ttl)
+        self.__store = store
+
+    def get(self, key, default=None):
+        return self.__store.get(key, default)
+
+    def generation(self) -> int:
+        return self.__store.generation()
+
+    def set(self, key, value, ttl: float=None, generation: int=None):
+        self.__store.set(key, value, ttl, generation)
+
+    def invalidate(self, key) -> bool:
+        return self.__store.invalidate(key)
+
+    def clear(self):
+        self.__store.clear()
+
+    def stats(self) -> dict:
+        return self.__store.stats()
+
+
+class RedisBackend():
+    """ entries stored in redis under "<name>:<key>" with redis' own expiration. max_size is up
+    to redis' eviction policy. values must be bytes or JSON serializable """
+
+    def __init__(self, name: str, max_size: int, ttl: float):
+        if redis is None:
+            raise RuntimeError("CACHE_BACKEND=redis needs the redis package")
+        self.name = name
+        self.ttl = ttl
+        self.__client = redis.StrictRedis.from_url(os.getenv("CACHE_REDIS_URL", "redis://localhost:6379/0"))
+        self.__lock = threading.Lock()
+        # this process' invalidations, including the ones its listener receives. the stale check
+        # and the write are made under __write_lock so an invalidation can't land in between
+        self.__invalidations = InvalidationLog(max_size)
+        self.__write_lock = threading.Lock()
+        self.__counters = {"hits": 0, "misses": 0, "invalidations": 0, "stale_sets": 0}
+
+    def __key(self, key) -> str:
+        return "{}:{}".format(self.name, _encode_key(key))
+
+    def get(self, key, default=None):
+        raw = self.__client.get(self.__key(key))
+        with self.__lock:
+            self.__counters["misses" if raw is None else "hits"] += 1
+        return default if raw is None else _decode_value(raw)
+
+    def generation(self) -> int:
+        return self.__invalidations.generation()
+
+    def set(self, key, value, ttl: float=None, generation: int=None):
+        ttl_ms = int((self.ttl if ttl is None else ttl) * 1000)
+        if ttl_ms <= 0:
+            return
+        with self.__write_lock:
+            if generation is not None and self.__invalidations.stale(key, generation):
+                with self.__lock:
+                    self.__counters["stale_sets"] += 1
+                return
+            self.__client.set(self.__key(key), _encode_value(value), px=ttl_ms)
+
+    def invalidate(self, key) -> bool:
+        with self.__write_lock:
+            self.__invalidations.record(key)
+            removed = bool(self.__client.delete(self.__key(key)))
+        if removed:
+            with self.__lock:
+                self.__counters["invalidations"] += 1
+        return removed
+
+    def clear(self):
+        with self.__write_lock:
+            self.__invalidations.record()
+            for key in self.__client.scan_iter(match=self.name + ":*"):
+                self.__client.delete(key)
+
+    def stats(self) -> dict:
+        with self.__lock:
+            stats = dict(self.__counters)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        stats["evictions"] = 0
+        stats["size"] = 0
+        return stats
+
+
+_BACKENDS = {
+    "local": LocalBackend,
+    "memory": MemoryBackend,
+    "redis": RedisBackend,
+}
+
+
+class Cache():
+    """ a named cache. get/set/invalidate act on this process' backend; notify_invalidation()
+    reaches every worker once the caller's transaction commits """
+
+    def __init__(self, name: str, max_size: int=10000, ttl: float=60.0, backend: str="local"):
+        if backend not in _BACKENDS:
+            raise ValueError("unknown cache backend: {}".format(backend))
+        self.name = name
+        self.max_size = max_size
+        self.ttl = ttl
+        self.__backend = _BACKENDS[backend](name, max_size, ttl)
+
+        with _caches_lock:
+            _caches[name] = self
+        listener().ensure_started()
+
+    @classmethod
+    def from_env(cls, name: str, prefix: str, max_size: int=10000, ttl: float=60.0):
+        """ build a cache sized through <prefix>_SIZE and <prefix>_TTL env vars, on the
+        CACHE_BACKEND backend """
+        return cls(name,
+                   max_size=int(os.getenv(prefix + "_SIZE", max_size)),
+                   ttl=float(os.getenv(prefix + "_TTL", ttl)),
+                   backend=os.getenv("CACHE_BACKEND", "local"))
+
+    def get(self, key, default=None):
+        return self.__backend.get(key, default)
+
+    def generation(self) -> int:
+        """ take this before reading a value from its source and pass it to set(), so the value
+        isn't cached if the key is invalidated while the read runs """
+        return self.__backend.generation()
+
+    def set(self, key, value=True, ttl: float=None, generation: int=None):
+        if self.max_size <= 0:
+            return
+        self.__backend.set(key, value, ttl, generation)
+
+    def invalidate(self, key) -> bool:
+        """ drop a key from this process' view right away """
+        return self.__backend.invalidate(key)
+
+    def notify_invalidation(self, session, key):
+        """ drop the key here and have every worker drop it when session's transaction commits """
+        self.invalidate(key)
+        notify_invalidation(session, self.name, key)
+
+    def clear(self):
+        self.__backend.clear()
+
+    def stats(self) -> dict:
+        return self.__backend.stats()
+
+
+def notify_invalidation(session, name: str, key):
+    """ queue an invalidation of key in the cache called name. it's sent as a NOTIFY in the
+    session's transaction, so it's delivered only if and when that transaction commits """
+    payload = json.dumps({"cache": name, "key": _encode_key(key)})
+    session.execute(_NOTIFY, {"channel": _CHANNEL, "payload": payload})
+
+
+class InvalidationListener():
+    """ a daemon thread that LISTENs on the invalidation channel and evicts the keys it's told
+    about. after a lost connection every cache is cleared, since notifications sent while
+    disconnected are gone. a quiet connection is probed every heartbeat_seconds, and TCP
+    keepalives are on, so a connection that died without closing is noticed too """
+
+    def __init__(self, dsn: str, channel: str, retry_seconds: float=5.0,
+                 heartbeat_seconds: float=30.0):
+        self.dsn = dsn
+        self.channel = channel
+        self.retry_seconds = retry_seconds
+        self.heartbeat_seconds = heartbeat_seconds
+
+        self.__thread = None
+        self.__lock = threading.Lock()
+        self.__counters = {
+            "received": 0,
+            "evicted": 0,
+            "reconnects": 0,
+            "errors": 0,
+        }
+
+    def ensure_started(self):
+        if self.__thread is not None or not self.dsn:
+            return
+        with self.__lock:
+            if self.__thread is None:
+                thread = threading.Thread(target=self.__run, name="cache-invalidation-listener")
+                thread.daemon = True
+                thread.start()
+                self.__thread = thread
+
+    def stats(self) -> dict:
+        with self.__lock:
+            stats = dict(self.__counters)
+        stats["running"] = self.__thread is not None and self.__thread.is_alive()
+        return stats
+
+    def __count(self, name: str, n: int=1):
+        with self.__lock:
+            self.__counters[name] += n
+
+    def __run(self):
+        connected_before = False
+        # warned about the current outage already; retries while the database is down stay quiet
+        warned = False
+        while True:
+            conn = None
+            try:
+                conn = psycopg2.connect(self.dsn, keepalives=1, keepalives_idle=30,
+                                        keepalives_interval=10, keepalives_count=3)
+                conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                with conn.cursor() as curs:
+                    # quoted so the name matches pg_notify()'s case-sensitive string exactly
+                    curs.execute("listen {}".format(
+                        psycopg2.extensions.quote_ident(self.channel, conn)))
+
+                if connected_before:
+                    self.__count("reconnects")
+                    for cache in list(_caches.values()):
+                        cache.clear()
+                connected_before = True
+                warned = False
+
+                while True:
+                    if select.select([conn], [], [], self.heartbeat_seconds) == ([], [], []):
+                        # raises on a dead connection, which takes the reconnect and clear path
+                        with conn.cursor() as curs:
+                            curs.execute("select 1")
+                    conn.poll()
+                    while conn.notifies:
+                        self.__handle(conn.notifies.pop(0).payload)
+            except Exception as e:
+                # routine during database restarts and failovers; the caches are cleared on
+                # reconnect, so this is a warning rather than an error, and once per outage
+                if not warned:
+                    Logger.warn("cache invalidation listener lost its connection", e)
+                    warned = True
+                self.__count("errors")
+                time.sleep(self.retry_seconds)
+            finally:
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+
+    def __handle(self, payload: str):
+        self.__count("received")
+        try:
+            message = json.loads(payload)
+            cache = _caches.get(message["cache"])
+            if cache and cache.invalidate(_decode_key(message["key"])):
+                self.__count("evicted")
+        except (ValueError, KeyError) as e:
+            Logger.error("bad cache invalidation payload: {}".format(payload), e)
+
+
+_listener = None
+_listener_lock = threading.Lock()
+
+
+def listener() -> InvalidationListener:
+    """ the process-wide invalidation listener. set CACHE_LISTEN=0 to disable it """
+    global _listener
+    if _listener is None:
+        with _listener_lock:
+            if _listener is None:
+                dsn = os.getenv("DATABASE_URL") if os.getenv("CACHE_LISTEN", "1") != "0" else None
+                _listener = InvalidationListener(dsn, _CHANNEL)
+    return _listener
@@ -0,0 +1,227 @@
+"""
+    thread-safe psycopg2 connection pool used by PostgreSQLConn. checkouts block up to a timeout
+    when every connection is busy, connections are health checked after sitting idle and replaced
+    once they reach a maximum age, and the pool keeps counters describing how it's used
+"""
+import bisect
+import collections
+import os
+import threading
+import time
+import psycopg2
+import psycopg2.extensions
+
+
+class PoolTimeoutException(Exception):
+    def __init__(self, timeout: float):
+        super(PoolTimeoutException, self).__init__(
+            "No Database Connection Available After {}s".format(timeout))
+
+
+class PooledConnection():
+    """ a pooled psycopg2 connection and the bookkeeping the pool needs for it. statements holds
+    the connection's prepared statement registry, if its user attached one """
+    __slots__ = ("conn", "created", "last_used", "statements")
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.created = time.monotonic()
+        self.last_used = self.created
+        self.statements = None
+
+
+class ConnectionPool():
+    """ min_size - connections opened up front on first use
+    max_size - upper bound on open connections
+    timeout - seconds a checkout waits for a free connection before giving up
+    max_age - seconds after which a connection is closed and replaced instead of reused
+    ping_after - seconds a connection may sit idle before it's checked with a round trip """
+
+    # upper bounds, in ms, of the checkout wait histogram buckets
+    WAIT_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, float("inf"))
+
+    def __init__(self, dsn: str, min_size: int=1, max_size: int=10, timeout: float=5.0,
+                 max_age: float=1800.0, ping_after: float=30.0):
+        self.dsn = dsn
+        self.min_size = min(min_size, max_size)
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_age = max_age
+        self.ping_after = ping_after
+
+        self.__idle = collections.deque()
+        self.__size = 0
+        self.__in_use = 0
+        self.__filled = False
+        self.__cond = threading.Condition()
+        self.__counters = {
+            "checkouts": 0,
+            "timeouts": 0,
+            "created": 0,
+            "recycled": 0,
+            "unhealthy": 0,
+        }
+        self.__wait_buckets = [0] * len(self.WAIT_BUCKETS_MS)
+        self.__wait_sum_ms = 0.0
+
+    @classmethod
+    def from_env(cls, dsn: str):
+        """ sized by PG_POOL_MIN, PG_POOL_MAX, PG_POOL_TIMEOUT, PG_POOL_RECYCLE and
+        PG_POOL_PING_AFTER """
+        return cls(dsn,
+                   min_size=int(os.getenv("PG_POOL_MIN", 1)),
+                   max_size=int(os.getenv("PG_POOL_MAX", 10)),
+                   timeout=float(os.getenv("PG_POOL_TIMEOUT", 5)),
+                   max_age=float(os.getenv("PG_POOL_RECYCLE", 1800)),
+                   ping_after=float(os.getenv("PG_POOL_PING_AFTER", 30)))
+
+    def getconn(self) -> PooledConnection:
+        """ check out a healthy connection, waiting up to timeout seconds for one to free up.
+        raises PoolTimeoutException if none does """
+        if not self.__filled:
+            self.__fill()
+
+        start = time.monotonic()
+        deadline = start + self.timeout
+        with self.__cond:
+            while True:
+                if self.__idle:
+                    record = self.__idle.pop()
+                    break
+                if self.__size < self.max_size:
+                    # reserve a slot, the connection is opened outside the lock
+                    self.__size += 1
+                    record = None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.__counters["timeouts"] += 1
+                    raise PoolTimeoutException(self.timeout)
+                self.__cond.wait(remaining)
+            self.__in_use += 1
+
+        try:
+            record = self.__check(record)
+        except Exception:
+            with self.__cond:
+                self.__size -= 1
+                self.__in_use -= 1
+                self.__cond.notify()
+            raise
+
+        waited_ms = (time.monotonic() - start) * 1000
+        with self.__cond:
+            self.__counters["checkouts"] += 1
+            self.__wait_buckets[bisect.bisect_left(self.WAIT_BUCKETS_MS, waited_ms)] += 1
+            self.__wait_sum_ms += waited_ms
+        return record
+
+    def putconn(self, record: PooledConnection, close: bool=False):
+        """ return a connection. it's closed instead of reused if asked to, if it's broken or if
+        it's past max_age. an open transaction is rolled back """
+        conn = record.conn
+        if not close and not conn.closed:
+            try:
+                if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except psycopg2.Error:
+                close = True
+        if not close and time.monotonic() - record.created > self.max_age:
+            close = True
+            self.__count("recycled")
+
+        if close or conn.closed:
+            self.__close(conn)
+            with self.__cond:
+                self.__size -= 1
+                self.__in_use -= 1
+                self.__cond.notify()
+            return
+
+        record.last_used = time.monotonic()
+        with self.__cond:
+            self.__idle.append(record)
+            self.__in_use -= 1
+            self.__cond.notify()
+
+    def closeall(self):
+        """ close every idle connection. checked out connections are closed when returned """
+        with self.__cond:
+            idle, self.__idle = self.__idle, collections.deque()
+            self.__size -= len(idle)
+        for record in idle:
+            self.__close(record.conn)
+
+    def stats(self) -> dict:
+        """ usage counters, current in-use/idle counts and the checkout wait histogram """
+        with self.__cond:
+            stats = dict(self.__counters)
+            stats["in_use"] = self.__in_use
+            stats["idle"] = len(self.__idle)
+            stats["size"] = self.__size
+            stats["max_size"] = self.max_size
+            stats["wait_ms_sum"] = self.__wait_sum_ms
+            stats["wait_ms_buckets"] = list(zip(self.WAIT_BUCKETS_MS, self.__wait_buckets))
+        return stats
+
+    def __count(self, name: str):
+        with self.__cond:
+            self.__counters[name] += 1
+
+    def __connect(self) -> PooledConnection:
+        record = PooledConnection(psycopg2.connect(self.dsn))
+        self.__count("created")
+        return record
+
+    def __close(self, conn):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def __fill(self):
+        with self.__cond:
+            if self.__filled:
+                return
+            self.__filled = True
+            missing = max(0, self.min_size - self.__size)
+            self.__size += missing
+
+        opened = []
+        try:
+            for _ in range(missing):
+                opened.append(self.__connect())
+        finally:
+            with self.__cond:
+                self.__size -= missing - len(opened)
+                self.__idle.extend(opened)
+                self.__cond.notify_all()
+
+    def __check(self, record: PooledConnection) -> PooledConnection:
+        """ returns a usable connection: the given one if it passes the health checks or a
+        freshly opened replacement """
+        if record is None:
+            return self.__connect()
+
+        now = time.monotonic()
+        if record.conn.closed:
+            self.__count("unhealthy")
+        elif now - record.created > self.max_age:
+            self.__count("recycled")
+        elif now - record.last_used > self.ping_after and not self.__ping(record.conn):
+            self.__count("unhealthy")
+        else:
+            return record
+
+        self.__close(record.conn)
+        return self.__connect()
+
+    def __ping(self, conn) -> bool:
+        try:
+            with conn.cursor() as curs:
+                curs.execute("select 1")
+            if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
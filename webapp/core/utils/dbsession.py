@@ -5,18 +5,117 @@
     https://docs.sqlalchemy.org/en/latest/orm/contextual.html
     http://stackoverflow.com/questions/12223335/sqlalchemy-creating-vs-reusing-a-session
     http://stackoverflow.com/questions/5544774/whats-the-recommended-scoped-session-usage-pattern-in-a-multithreaded-sqlalchem
+
+    while a unit of work is open on the current thread (the app opens one per request) every
+    dbsession() block shares one session, opened on first use, and nothing is committed until
+    commit_unit_of_work(). read_dbsession() blocks keep their own auto-commit session until the
+    shared one has written. blocks outside a request, such as the log writers and jobs, keep
+    getting their own session and transaction
 """
+import threading
+from sqlalchemy import event
 from . import create_read_session, create_session
+from . import replica
 from contextlib import contextmanager
 
+_unit_of_work = threading.local()
+
+
+def _flushed(session, flush_context):
+    session.info["wrote"] = True
+
+
+def _executed(orm_execute_state):
+    if not getattr(orm_execute_state.statement, "is_select", False):
+        orm_execute_state.session.info["wrote"] = True
+
+
+def _track_writes(session):
+    """ set session.info["wrote"] once the session flushes changes or executes anything other
+    than a plain select, so only sessions that wrote pin the request's reads to the primary """
+    event.listen(session, "after_flush", _flushed)
+    event.listen(session, "do_orm_execute", _executed)
+    return session
+
+
+def _wrote(session) -> bool:
+    return session.info.get("wrote", False)
+
+
+def begin_unit_of_work():
+    """ start sharing one session between the dbsession() blocks of the current thread """
+    _unit_of_work.active = True
+    _unit_of_work.session = None
+    _unit_of_work.failed = False
+
+
+def commit_unit_of_work():
+    """ commit the unit of work's transaction. it's rolled back instead if any of its blocks
+    raised. raises if the commit fails """
+    session = getattr(_unit_of_work, "session", None)
+    if session is None:
+        return
+    if _unit_of_work.failed:
+        session.rollback()
+        return
+    session.commit()
+    if _wrote(session):
+        replica.mark_write()
+
+
+def end_unit_of_work():
+    """ roll back anything left uncommitted and release the session's connection """
+    session = getattr(_unit_of_work, "session", None)
+    _unit_of_work.active = False
+    _unit_of_work.session = None
+    if session is not None:
+        try:
+            session.rollback()
+        finally:
+            session.close()
+
+
+def _unit_of_work_session():
+    if not getattr(_unit_of_work, "active", False):
+        return None
+    if _unit_of_work.session is None:
+        _unit_of_work.session = _track_writes(create_session(autocommit=False, autoflush=False,
+                                                             expire_on_commit=True))
+    return _unit_of_work.session
+
+
+@contextmanager
+def _shared(session):
+    """ a block of the unit of work. it's flushed so errors surface inside the block, but only
+    commit_unit_of_work() commits it """
+    try:
+        yield session
+        session.flush()
+    except Exception as exc:
+        # the whole unit of work is void now; roll back so later blocks can still run
+        _unit_of_work.failed = True
+        session.rollback()
+        raise(exc)
+
 
 @contextmanager
-def dbsession():
+def dbsession(independent: bool=False):
+    """ a session for reads and writes against the primary. inside a unit of work it's the shared
+    request session unless independent is True, which gives the block its own transaction that
+    commits when the block ends """
+    if not independent and getattr(_unit_of_work, "active", False):
+        with _shared(_unit_of_work_session()) as session:
+            yield session
+        return
+
     session = None
     try:
-        session = create_session(autocommit=False, autoflush=False, expire_on_commit=True)
+        session = _track_writes(create_session(autocommit=False, autoflush=False,
+                                               expire_on_commit=True))
         yield session
         session.commit()
+        if _wrote(session):
+            replica.mark_write()
     except Exception as exc:
         if session:
             session.rollback()
@@ -27,12 +126,25 @@ def dbsession():
 
 
 @contextmanager
-def read_dbsession():
+def read_dbsession(primary: bool=False):
+    """ a session for read-only queries. it's routed to the read replica unless primary is True,
+    the replica is lagging or the current request already wrote to the primary. the session runs
+    in auto-commit mode so no BEGIN/COMMIT is sent. once the unit of work's session has written,
+    reads use that session instead so they see its uncommitted writes """
+    shared = getattr(_unit_of_work, "session", None) \
+        if getattr(_unit_of_work, "active", False) else None
+    if shared is not None and _wrote(shared):
+        with _shared(shared) as session:
+            yield session
+        return
+
+    use_replica = not primary and replica.use_replica()
+
     session = None
     try:
-        session = create_read_session(autocommit=False, autoflush=False, expire_on_commit=False)
+        session = create_read_session(autocommit=False, autoflush=False, expire_on_commit=False,
+                                      replica=use_replica)
         yield session
-        session.commit()
     except Exception as e:
         if session:
             session.rollback()
@@ -40,3 +152,16 @@ def read_dbsession():
     finally:
         if session:
             session.close()
+
+
+def read_or_primary(query):
+    """ run query(session) on a read session and return its result. when the read went to the
+    replica and found nothing it's repeated on the primary: a row written in the last few seconds
+    may not have reached a lagging replica yet """
+    with read_dbsession() as session:
+        result = query(session)
+        on_replica = session.info.get("replica", False)
+    if result is None and on_replica:
+        with read_dbsession(primary=True) as session:
+            result = query(session)
+    return result
@@ -0,0 +1,79 @@
+"""
+    runs CPU-bound password hashing in a pool of worker processes so it doesn't hold the GIL on
+    the request threads. the number of pending jobs is bounded; once it's reached callers get a
+    HashPoolSaturatedException instead of piling up behind the queue
+"""
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+
+class HashPoolSaturatedException(Exception):
+    def __init__(self):
+        super(HashPoolSaturatedException, self).__init__("Password Hashing Pool Saturated")
+
+
+class HashPool():
+    """ workers - number of processes. 0 runs every job inline on the calling thread
+    max_pending - jobs allowed to wait for a free worker on top of the running ones
+    wait_ms - how long a caller waits for room in the queue before giving up
+    timeout - how long a caller waits for its result before giving up """
+
+    def __init__(self, workers: int, max_pending: int, wait_ms: int=100, timeout: float=5.0):
+        self.workers = workers
+        self.wait_ms = wait_ms
+        self.timeout = timeout
+        self.__slots = threading.BoundedSemaphore(max(1, workers + max_pending))
+        self.__lock = threading.Lock()
+        self.__executor = None
+
+    @classmethod
+    def from_env(cls):
+        """ sized by HASH_POOL_WORKERS (default: cpu count), HASH_POOL_QUEUE (default: 4 jobs per
+        worker), HASH_POOL_WAIT_MS and HASH_POOL_TIMEOUT """
+        workers = int(os.getenv("HASH_POOL_WORKERS", os.cpu_count() or 1))
+        return cls(workers,
+                   max_pending=int(os.getenv("HASH_POOL_QUEUE", workers * 4)),
+                   wait_ms=int(os.getenv("HASH_POOL_WAIT_MS", 100)),
+                   timeout=float(os.getenv("HASH_POOL_TIMEOUT", 5)))
+
+    def run(self, fn, *args):
+        """ run fn(*args) in a worker process and return its result. fn must be picklable, i.e.
+        a module level function """
+        if self.workers <= 0:
+            return fn(*args)
+
+        if not self.__slots.acquire(timeout=self.wait_ms / 1000):
+            raise HashPoolSaturatedException()
+
+        try:
+            future = self.__get_executor().submit(fn, *args)
+        except BrokenProcessPool:
+            # a worker died; start a fresh pool for the next caller
+            self.__slots.release()
+            self.__reset_executor()
+            raise
+        except Exception:
+            self.__slots.release()
+            raise
+
+        # the slot is held until the job finishes, even if this caller stops waiting for it
+        future.add_done_callback(lambda f: self.__slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            raise HashPoolSaturatedException()
+
+    def __get_executor(self) -> ProcessPoolExecutor:
+        if self.__executor is None:
+            with self.__lock:
+                if self.__executor is None:
+                    self.__executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self.__executor
+
+    def __reset_executor(self):
+        with self.__lock:
+            executor, self.__executor = self.__executor, None
+        if executor:
+            executor.shutdown(wait=False)
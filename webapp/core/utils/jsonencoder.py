@@ -0,0 +1,64 @@
+"""
+    one place to turn response payloads into JSON bytes. uses orjson when it's installed and
+    falls back to simplejson. both backends handle Decimal, datetime, date and UUID values.
+    JSON_BACKEND=simplejson|orjson forces a backend
+"""
+import datetime
+import decimal
+import os
+import uuid
+import simplejson
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _simplejson_default(obj):
+    # simplejson already handles Decimal itself
+    if isinstance(obj, (datetime.datetime, datetime.date, datetime.time)):
+        return obj.isoformat()
+    if isinstance(obj, uuid.UUID):
+        return str(obj)
+    raise TypeError("Object of type {} is not JSON serializable".format(type(obj).__name__))
+
+
+def _orjson_default(obj):
+    # orjson already handles datetime and UUID itself
+    if isinstance(obj, decimal.Decimal):
+        return float(obj)
+    raise TypeError("Object of type {} is not JSON serializable".format(type(obj).__name__))
+
+
+def _simplejson_dumps(obj) -> bytes:
+    return simplejson.dumps(obj, default=_simplejson_default, separators=(",", ":")).encode("utf-8")
+
+
+def _orjson_dumps(obj) -> bytes:
+    return orjson.dumps(obj, default=_orjson_default, option=orjson.OPT_NON_STR_KEYS)
+
+
+_backends = {"simplejson": _simplejson_dumps}
+if orjson:
+    _backends["orjson"] = _orjson_dumps
+
+_dumps = None
+backend = None
+
+
+def set_backend(name: str):
+    """ switch the serializer used by dumps(). raises ValueError if it isn't installed """
+    global _dumps, backend
+    if name not in _backends:
+        raise ValueError("json backend not available: {}".format(name))
+    _dumps = _backends[name]
+    backend = name
+
+
+def dumps(obj) -> bytes:
+    """ serialize obj to UTF-8 JSON bytes """
+    return _dumps(obj)
+
+
+set_backend(os.getenv("JSON_BACKEND", "orjson" if orjson else "simplejson"))
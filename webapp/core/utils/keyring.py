@@ -0,0 +1,116 @@
+"""
+    the HMAC keys used to sign and verify session JWTs, loaded from the environment once. several
+    keys can be live at the same time so a secret can be rotated without logging everyone out: new
+    tokens are signed with the active key and name it in their kid header, and tokens signed with
+    any other configured key keep verifying until that key is removed
+"""
+import os
+import threading
+import jwt
+
+
+class KeyRing():
+    """ kid -> secret, the kid that signs new tokens and the expected issuer. invalid tokens are
+    rejected without raising or printing anything; rejections are counted by reason instead """
+
+    ALGORITHM = "HS256"
+
+    def __init__(self, keys: dict, active_kid: str, issuer: str, legacy_secret: str=None):
+        if active_kid not in keys:
+            raise ValueError("active kid {} is not in the key ring".format(active_kid))
+        self.keys = dict(keys)
+        self.active_kid = active_kid
+        self.issuer = issuer
+        # verifies tokens issued before kid headers existed
+        self.legacy_secret = legacy_secret
+
+        self.__lock = threading.Lock()
+        self.__counters = {
+            "verified": 0,
+            "malformed": 0,
+            "unknown_kid": 0,
+            "expired": 0,
+            "bad_signature": 0,
+            "invalid_claims": 0,
+        }
+
+    @classmethod
+    def from_env(cls):
+        """ JWT_KEYS holds "kid:secret" pairs separated by commas and JWT_ACTIVE_KID picks the
+        signing key (the first one by default). without JWT_KEYS, JWT_SECRET is the only key.
+        JWT_SECRET also verifies tokens without a kid header. JWT_ISS is the issuer """
+        legacy_secret = os.getenv("JWT_SECRET")
+        keys = {}
+        order = []
+        for pair in os.getenv("JWT_KEYS", "").split(","):
+            if not pair.strip():
+                continue
+            kid, sep, secret = pair.strip().partition(":")
+            if not sep or not kid or not secret:
+                raise ValueError("JWT_KEYS entries must look like kid:secret")
+            keys[kid] = secret
+            order.append(kid)
+
+        if not keys:
+            if not legacy_secret:
+                raise ValueError("set JWT_KEYS or JWT_SECRET")
+            keys["default"] = legacy_secret
+            order.append("default")
+
+        return cls(keys, os.getenv("JWT_ACTIVE_KID", order[0]), os.getenv("JWT_ISS"),
+                   legacy_secret or keys[order[0]])
+
+    def sign(self, payload: dict) -> str:
+        """ sign the claims with the active key. the issuer claim is set here """
+        payload["iss"] = self.issuer
+        token = jwt.encode(payload, self.keys[self.active_kid], algorithm=self.ALGORITHM,
+                           headers={"kid": self.active_kid})
+        return token.decode("utf-8") if isinstance(token, bytes) else token
+
+    def decode(self, token: str) -> dict:
+        """ the verified claims of the token, or None if it's malformed, names an unknown key, has
+        a bad signature, is expired or was issued by someone else """
+        # anything that isn't three dot separated segments never reaches the jwt library
+        if not isinstance(token, str) or token.count(".") != 2:
+            return self.__reject("malformed")
+
+        try:
+            header = jwt.get_unverified_header(token)
+        except jwt.InvalidTokenError:
+            return self.__reject("malformed")
+
+        kid = header.get("kid")
+        # the header isn't verified yet; a list or object kid would make the lookup raise
+        if kid is not None and not isinstance(kid, str):
+            return self.__reject("malformed")
+        secret = self.keys.get(kid) if kid is not None else self.legacy_secret
+        if secret is None:
+            return self.__reject("unknown_kid")
+
+        try:
+            claims = jwt.decode(token, secret, algorithms=[self.ALGORITHM], issuer=self.issuer)
+        except jwt.ExpiredSignatureError:
+            return self.__reject("expired")
+        except jwt.DecodeError:
+            # the header already parsed, so this is the signature (or a mangled payload)
+            return self.__reject("bad_signature")
+        except jwt.InvalidTokenError:
+            return self.__reject("invalid_claims")
+
+        self.__count("verified")
+        return claims
+
+    def stats(self) -> dict:
+        """ verified tokens and rejections by reason """
+        with self.__lock:
+            stats = dict(self.__counters)
+        stats["keys"] = len(self.keys)
+        return stats
+
+    def __count(self, name: str):
+        with self.__lock:
+            self.__counters[name] += 1
+
+    def __reject(self, reason: str):
+        self.__count(reason)
+        return None
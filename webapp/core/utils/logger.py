@@ -1,39 +1,64 @@
 """
     simple logging framework used by the fetchy backend
 """
+import datetime
 import hashlib
+import sys
 import time
 import traceback
-import inspect
 from .dbsession import dbsession
+from .batchwriter import BatchWriter
 from ..models.systemlog import SystemLog, LogLevel
 from ..models.endpointlog import EndpointLog
 
+# log rows are written by background threads so callers never wait on the insert
+_eplog_writer = BatchWriter.from_env(EndpointLog.__table__, "ENDPOINT_LOG")
+_syslog_writer = BatchWriter.from_env(SystemLog.__table__, "SYSTEM_LOG")
+
+# "file:function" prefixes keyed by code object so each call site is formatted once
+_SOURCE_CACHE_MAX = 4096
+_source_cache = {}
+
+
+def caller_source(depth: int=1) -> str:
+    """ returns "file:function(line)" of the frame `depth` levels above the caller. only that one
+    frame is looked up; unlike inspect.stack() no frame records or source lines are built """
+    frame = sys._getframe(depth + 1)
+    code = frame.f_code
+    prefix = _source_cache.get(code)
+    if prefix is None:
+        if len(_source_cache) >= _SOURCE_CACHE_MAX:
+            _source_cache.clear()
+        prefix = "{}:{}".format(code.co_filename, code.co_name)
+        _source_cache[code] = prefix
+    return "{}({})".format(prefix, frame.f_lineno)
+
 
 class Logger():
 
     @classmethod
     def __write_syslog(cls, level: LogLevel, message: str, session=None):
-        frame, file_name, line_number, func_name, lines, index = inspect.stack()[2]
-        source = "{filepath}:{funcname}({line_num})".format(**{
-            "filepath": file_name,
-            "funcname": func_name,
-            "line_num": line_number,
-            })
+        """ must be called directly from a public Logger method so the captured source is the
+        caller of that method. returns the new row id if a session is given, otherwise the row
+        is queued for the background writer and None is returned """
+        source = caller_source(2)
 
-        syslog = SystemLog(level, source, message)
-        print(syslog)
         if session:
+            syslog = SystemLog(level, source, message)
+            print(syslog)
             session.add(syslog)
             session.commit()
-            sid = syslog.id
-        else:
-            with dbsession() as session:
-                session.add(syslog)
-                session.commit()
-                sid = syslog.id
+            return syslog.id
 
-        return sid
+        row = {
+            "event_utc": datetime.datetime.utcnow(),
+            "level": repr(level),
+            "source": source,
+            "message": message,
+        }
+        print("[{event_utc} {level}] {source}: {message}".format(**row))
+        _syslog_writer.put(row)
+        return None
 
     @classmethod
     def __write_eplog(cls, eplog: EndpointLog, session=None):
@@ -47,7 +72,6 @@ class Logger():
     def start(cls, existing_session=None):
         """ mark the start of some event. returns a unique id """
         eid = hashlib.md5(str(time.time()).encode()).hexdigest()
-        frame, file_name, line_number, func_name, lines, index = inspect.stack()[1]
         cls.__write_syslog(LogLevel.START_EVENT, "[{eid}] starting".format(**{
             "eid": eid,
             }), existing_session)
@@ -56,7 +80,6 @@ class Logger():
     @classmethod
     def end(cls, event_id: str, existing_session=None):
         """ mark the end of some event. requires the events id """
-        frame, file_name, line_number, func_name, lines, index = inspect.stack()[1]
         cls.__write_syslog(LogLevel.END_EVENT, "[{eid}] ending".format(**{
             "eid": event_id,
             }), existing_session)
@@ -72,30 +95,66 @@ class Logger():
         cls.__write_syslog(LogLevel.INFO, message, existing_session)
 
     @classmethod
-    def warn(cls, message: str, exc: Exception=None, existing_session=None) -> int:
+    def warn(cls, message: str, exc: Exception=None, existing_session=None):
         """ server-side non-critical/unexpected/business-logic errors.
-        system continues working, however. """
+        system continues working, however. returns the system_log id when existing_session is
+        given; otherwise the row is written in the background and None is returned """
         if exc:
             traceback.print_exception(type(exc), exc, None)
         return cls.__write_syslog(LogLevel.WARN, message, existing_session)
 
     @classmethod
-    def error(cls, message: str, exc: Exception, existing_session=None) -> int:
-        """ something that if you saw at 4AM you would wake up immediately to fix """
+    def error(cls, message: str, exc: Exception, existing_session=None):
+        """ something that if you saw at 4AM you would wake up immediately to fix. returns the
+        system_log id when existing_session is given, otherwise None """
         traceback.print_exception(type(exc), exc, None)
         return cls.__write_syslog(LogLevel.ERROR, message, existing_session)
 
     @classmethod
-    def critical(cls, message: str, exc: Exception, existing_session=None) -> int:
+    def critical(cls, message: str, exc: Exception, existing_session=None):
         """ an unexpected mission-critical error caused by something outside our control. get into
-        contact immediately. triage issue right away. """
+        contact immediately. triage issue right away. returns the system_log id when
+        existing_session is given, otherwise None """
         traceback.print_exception(type(exc), exc, None)
         return cls.__write_syslog(LogLevel.CRITICAL, message, existing_session)
 
     @classmethod
     def endpoint_hit(cls, start_epoch_utc: float, duration_ms: int, endpoint: str,
                      auth_username: str, method: str, http_code: int, error_message: str=None,
-                     existing_session=None):
-        log = EndpointLog(start_epoch_utc, duration_ms, endpoint, auth_username, method, http_code,
-                          error_message)
-        cls.__write_eplog(log, existing_session)
+                     existing_session=None, db_queries: int=None, db_time_ms: int=None):
+        """ record an endpoint hit along with the number of statements it ran and the time it spent
+        in the database. unless a session is given the row is queued and written in a batch by a
+        background thread. returns False if the row had to be dropped """
+        if existing_session:
+            log = EndpointLog(start_epoch_utc, duration_ms, endpoint, auth_username, method,
+                              http_code, error_message, db_queries, db_time_ms)
+            cls.__write_eplog(log, existing_session)
+            return True
+
+        return _eplog_writer.put({
+            "start_utc": start_epoch_utc,
+            "duration_ms": duration_ms,
+            "endpoint": endpoint,
+            "username": auth_username,
+            "method": method,
+            "http_code": str(http_code),
+            "error_message": error_message,
+            "db_queries": db_queries,
+            "db_time_ms": db_time_ms,
+            })
+
+    @classmethod
+    def endpoint_log_stats(cls) -> dict:
+        """ queue depth, drop and write counters of the endpoint log writer """
+        return _eplog_writer.stats()
+
+    @classmethod
+    def system_log_stats(cls) -> dict:
+        """ queue depth, drop and write counters of the system log writer """
+        return _syslog_writer.stats()
+
+    @classmethod
+    def flush(cls):
+        """ write out every queued log row before returning """
+        _syslog_writer.flush()
+        _eplog_writer.flush()
@@ -0,0 +1,278 @@
+"""
+    in-process request metrics rendered in the prometheus text format. request latencies are kept
+    as per route/method/status histograms with log-linear (1-2-5) buckets, next to gauges for the
+    database pools, log queues and caches.
+
+    when several worker processes serve the app, set METRICS_MULTIPROC_DIR to a directory they all
+    share. each process then writes a snapshot of its metrics there every METRICS_FLUSH_SECONDS and
+    render() merges the snapshots of every live process: histograms are summed, gauges get a pid
+    label. snapshots of processes that are gone are deleted
+"""
+import atexit
+import bisect
+import json
+import os
+import re
+import threading
+import time
+import traceback
+
+# upper bounds, in ms, of the latency buckets. anything slower lands in the +Inf bucket
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 20000, 50000)
+
+_MULTIPROC_DIR = os.getenv("METRICS_MULTIPROC_DIR")
+_FLUSH_SECONDS = float(os.getenv("METRICS_FLUSH_SECONDS", 5))
+
+_HISTOGRAM_SUFFIX = re.compile(r"_(bucket|sum|count)$")
+
+
+class LatencyHistograms():
+    """ one histogram per (route, method, status). observe() takes a lock for a couple of integer
+    increments, nothing more """
+
+    def __init__(self, buckets: tuple=LATENCY_BUCKETS_MS):
+        self.buckets = buckets
+        self.__lock = threading.Lock()
+        # (route, method, status) -> [bucket counts..., +Inf count, sum of ms]
+        self.__series = {}
+
+    def observe(self, route: str, method: str, status: int, duration_ms: float):
+        i = bisect.bisect_left(self.buckets, duration_ms)
+        key = (route, method, str(status))
+        with self.__lock:
+            series = self.__series.get(key)
+            if series is None:
+                series = self.__series[key] = [0] * (len(self.buckets) + 2)
+            series[i] += 1
+            series[-1] += duration_ms
+
+    def snapshot(self) -> list:
+        """ [[route, method, status, counts, sum_ms], ...] with non-cumulative bucket counts """
+        with self.__lock:
+            return [list(key) + [series[:-1], series[-1]] for key, series in self.__series.items()]
+
+
+latencies = LatencyHistograms()
+
+
+def _gauges() -> list:
+    """ (name, type, labels, value) samples of this process' pools, queues and caches """
+    # imported here to keep this module free of import cycles
+    from . import pool_stats
+    from .postgresqlconn import connection_pool_stats
+    from .logger import Logger
+    from .security import token_stats
+    from .cache import listener
+    from ...managers.sessionmanager import SessionManager
+    from ...managers.accountmanager import AccountManager
+
+    samples = []
+    pools = {name: stats.stats() for name, stats in pool_stats.items()}
+    pg_pool = connection_pool_stats()
+    if pg_pool:
+        pools["postgresqlconn"] = pg_pool
+    for name, stats in pools.items():
+        labels = {"pool": name}
+        samples.append(("db_pool_checkouts_total", "counter", labels, stats["checkouts"]))
+        samples.append(("db_pool_in_use", "gauge", labels, stats["in_use"]))
+        if "idle" in stats:
+            samples.append(("db_pool_idle", "gauge", labels, stats["idle"]))
+        if "peak_in_use" in stats:
+            samples.append(("db_pool_peak_in_use", "gauge", labels, stats["peak_in_use"]))
+        cumulative = 0
+        for le, count in stats["wait_ms_buckets"]:
+            cumulative += count
+            samples.append(("db_pool_checkout_wait_ms_bucket", "histogram",
+                            dict(labels, le=_format_le(le)), cumulative))
+        samples.append(("db_pool_checkout_wait_ms_sum", "histogram", labels, stats["wait_ms_sum"]))
+        samples.append(("db_pool_checkout_wait_ms_count", "histogram", labels, cumulative))
+
+    for name, stats in (("endpoint_log", Logger.endpoint_log_stats()),
+                        ("system_log", Logger.system_log_stats())):
+        labels = {"queue": name}
+        samples.append(("log_queue_depth", "gauge", labels, stats["queued"]))
+        samples.append(("log_queue_capacity", "gauge", labels, stats["capacity"]))
+        samples.append(("log_rows_written_total", "counter", labels, stats["written"]))
+        samples.append(("log_rows_dropped_total", "counter", labels, stats["dropped"]))
+        samples.append(("log_rows_failed_total", "counter", labels, stats["failed_rows"]))
+
+    for name, stats in (("session", SessionManager.cache_stats()),
+                        ("credential", AccountManager.cache_stats())):
+        labels = {"cache": name}
+        samples.append(("cache_hits_total", "counter", labels, stats["hits"]))
+        samples.append(("cache_misses_total", "counter", labels, stats["misses"]))
+        samples.append(("cache_evictions_total", "counter", labels, stats["evictions"]))
+        samples.append(("cache_size", "gauge", labels, stats["size"]))
+
+    invalidations = listener().stats()
+    samples.append(("cache_invalidations_received_total", "counter", {}, invalidations["received"]))
+    samples.append(("cache_invalidation_listener_reconnects_total", "counter", {},
+                    invalidations["reconnects"]))
+
+    revocations = SessionManager.revocation_stats()
+    samples.append(("revoked_tokens", "gauge", {}, revocations["revoked"]))
+    samples.append(("revocation_refreshes_total", "counter", {}, revocations["refreshes"]))
+    samples.append(("revocation_refresh_failures_total", "counter", {},
+                    revocations["refresh_failures"]))
+
+    tokens = token_stats()
+    samples.append(("jwt_verified_total", "counter", {}, tokens.get("verified", 0)))
+    for reason in ("malformed", "unknown_kid", "expired", "bad_signature", "invalid_claims"):
+        samples.append(("jwt_rejected_total", "counter", {"reason": reason}, tokens.get(reason, 0)))
+    return samples
+
+
+def _snapshot() -> dict:
+    return {
+        "pid": os.getpid(),
+        "latencies": latencies.snapshot(),
+        "gauges": _gauges(),
+    }
+
+
+def _read_snapshots() -> list:
+    """ this process' live snapshot plus the latest snapshot written by every other process """
+    snapshots = [_snapshot()]
+    if not _MULTIPROC_DIR:
+        return snapshots
+
+    own = "metrics_{}.json".format(os.getpid())
+    for name in os.listdir(_MULTIPROC_DIR):
+        if not name.startswith("metrics_") or not name.endswith(".json") or name == own:
+            continue
+        try:
+            pid = int(name[len("metrics_"):-len(".json")])
+        except ValueError:
+            continue
+        if not _alive(pid):
+            # a worker that exited or was restarted. its numbers would otherwise be summed in
+            # forever and the directory would grow with every restart
+            _remove(os.path.join(_MULTIPROC_DIR, name))
+            continue
+        try:
+            with open(os.path.join(_MULTIPROC_DIR, name)) as f:
+                snapshots.append(json.load(f))
+        except (OSError, ValueError):
+            # a process is replacing its file right now or died mid-write; skip it this time
+            continue
+    return snapshots
+
+
+def _alive(pid: int) -> bool:
+    """ whether a process with this pid exists. the snapshot directory must not be shared
+    between hosts or containers with separate pid namespaces """
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _remove(path: str):
+    for stale in (path, path + ".tmp"):
+        try:
+            os.remove(stale)
+        except OSError:
+            pass
+
+
+def _write_snapshot():
+    path = os.path.join(_MULTIPROC_DIR, "metrics_{}.json".format(os.getpid()))
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(_snapshot(), f)
+    os.replace(tmp, path)
+
+
+def _flush_loop():
+    while True:
+        time.sleep(_FLUSH_SECONDS)
+        try:
+            _write_snapshot()
+        except Exception:
+            traceback.print_exc()
+
+
+_flusher = None
+_flusher_lock = threading.Lock()
+
+
+def _ensure_flusher():
+    global _flusher
+    if not _MULTIPROC_DIR or _flusher is not None:
+        return
+    with _flusher_lock:
+        if _flusher is None:
+            os.makedirs(_MULTIPROC_DIR, exist_ok=True)
+            thread = threading.Thread(target=_flush_loop, name="metrics-flush")
+            thread.daemon = True
+            thread.start()
+            atexit.register(_write_snapshot)
+            _flusher = thread
+
+
+def observe_request(route: str, method: str, status: int, duration_ms: float):
+    """ record one served request """
+    _ensure_flusher()
+    latencies.observe(route, method, status, duration_ms)
+
+
+def _format_le(le: float) -> str:
+    return "+Inf" if le == float("inf") else "{:g}".format(le)
+
+
+def _format_labels(labels: dict) -> str:
+    return "{" + ",".join('{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"'))
+                          for k, v in labels.items()) + "}"
+
+
+def render() -> str:
+    """ every metric in the prometheus text exposition format """
+    snapshots = _read_snapshots()
+
+    # sum the latency histograms of every process
+    merged = {}
+    for snapshot in snapshots:
+        for route, method, status, counts, total_ms in snapshot["latencies"]:
+            key = (route, method, status)
+            if key not in merged:
+                merged[key] = [[0] * len(counts), 0.0]
+            merged[key][0] = [a + b for a, b in zip(merged[key][0], counts)]
+            merged[key][1] += total_ms
+
+    lines = [
+        "# HELP http_request_duration_ms request latency by route, method and status",
+        "# TYPE http_request_duration_ms histogram",
+    ]
+    for (route, method, status), (counts, total_ms) in sorted(merged.items()):
+        labels = {"route": route, "method": method, "status": status}
+        cumulative = 0
+        for le, count in zip(LATENCY_BUCKETS_MS + (float("inf"),), counts):
+            cumulative += count
+            lines.append("http_request_duration_ms_bucket{} {}".format(
+                _format_labels(dict(labels, le=_format_le(le))), cumulative))
+        lines.append("http_request_duration_ms_sum{} {}".format(_format_labels(labels), total_ms))
+        lines.append("http_request_duration_ms_count{} {}".format(_format_labels(labels), cumulative))
+
+    # gauges stay per process, labeled by pid. the exposition format wants every sample of a
+    # family in one block, so samples are grouped by family across snapshots first
+    families = {}
+    order = []
+    for snapshot in snapshots:
+        for name, kind, labels, value in snapshot["gauges"]:
+            family = _HISTOGRAM_SUFFIX.sub("", name) if kind == "histogram" else name
+            if family not in families:
+                families[family] = (kind, [])
+                order.append(family)
+            if _MULTIPROC_DIR:
+                labels = dict(labels, pid=snapshot["pid"])
+            families[family][1].append("{}{} {}".format(name, _format_labels(labels), value))
+
+    for family in order:
+        kind, samples = families[family]
+        lines.append("# TYPE {} {}".format(family, kind))
+        lines.extend(samples)
+
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,128 @@
+"""
+    timing for the sqlalchemy engine pools: how long checkouts wait for a connection, how long
+    connections stay checked out and how many are in use. a summary line is printed every
+    DB_POOL_LOG_SECONDS so pool size can be matched to the number of waitress threads. these go to
+    stdout rather than through Logger, which itself needs a pooled connection to write
+"""
+import bisect
+import os
+import threading
+import time
+from sqlalchemy import event
+from sqlalchemy.pool import QueuePool
+
+_LOG_SECONDS = float(os.getenv("DB_POOL_LOG_SECONDS", 60))
+
+
+class PoolStats():
+    """ counters for one engine's pool """
+
+    # upper bounds, in ms, of the checkout wait histogram buckets
+    WAIT_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, float("inf"))
+
+    def __init__(self, name: str, log_seconds: float=_LOG_SECONDS):
+        self.name = name
+        self.log_seconds = log_seconds
+        self.__lock = threading.Lock()
+        self.__counters = {
+            "checkouts": 0,
+            "connects": 0,
+            "invalidations": 0,
+            "in_use": 0,
+            "peak_in_use": 0,
+        }
+        self.__wait_buckets = [0] * len(self.WAIT_BUCKETS_MS)
+        self.__wait_sum_ms = 0.0
+        self.__wait_max_ms = 0.0
+        self.__hold_sum_ms = 0.0
+        self.__hold_max_ms = 0.0
+        self.__holds = 0
+        self.__logged_at = time.monotonic()
+
+    def record_wait(self, waited_ms: float):
+        with self.__lock:
+            self.__wait_buckets[bisect.bisect_left(self.WAIT_BUCKETS_MS, waited_ms)] += 1
+            self.__wait_sum_ms += waited_ms
+            self.__wait_max_ms = max(self.__wait_max_ms, waited_ms)
+
+    def checkout(self):
+        with self.__lock:
+            self.__counters["checkouts"] += 1
+            self.__counters["in_use"] += 1
+            self.__counters["peak_in_use"] = max(self.__counters["peak_in_use"],
+                                                 self.__counters["in_use"])
+
+    def checkin(self, held_ms: float):
+        with self.__lock:
+            self.__counters["in_use"] = max(0, self.__counters["in_use"] - 1)
+            if held_ms is not None:
+                self.__holds += 1
+                self.__hold_sum_ms += held_ms
+                self.__hold_max_ms = max(self.__hold_max_ms, held_ms)
+            due = time.monotonic() - self.__logged_at >= self.log_seconds
+            if due:
+                self.__logged_at = time.monotonic()
+        if due:
+            self.log()
+
+    def count(self, name: str):
+        with self.__lock:
+            self.__counters[name] += 1
+
+    def stats(self) -> dict:
+        with self.__lock:
+            stats = dict(self.__counters)
+            checkouts = stats["checkouts"]
+            stats["wait_ms_sum"] = self.__wait_sum_ms
+            stats["wait_ms_avg"] = self.__wait_sum_ms / checkouts if checkouts else 0.0
+            stats["wait_ms_max"] = self.__wait_max_ms
+            stats["wait_ms_buckets"] = list(zip(self.WAIT_BUCKETS_MS, self.__wait_buckets))
+            stats["hold_ms_avg"] = self.__hold_sum_ms / self.__holds if self.__holds else 0.0
+            stats["hold_ms_max"] = self.__hold_max_ms
+        return stats
+
+    def log(self):
+        print("[db pool {name}] checkouts={checkouts} in_use={in_use} peak_in_use={peak_in_use} "
+              "connects={connects} invalidations={invalidations} wait_ms avg={wait_ms_avg:.1f} "
+              "max={wait_ms_max:.1f} hold_ms avg={hold_ms_avg:.1f} max={hold_ms_max:.1f}".format(
+                  name=self.name, **self.stats()))
+
+
+class TimedQueuePool(QueuePool):
+    """ a QueuePool that records how long each checkout waited for a connection. set the stats
+    attribute before the pool is used """
+    stats = None
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            if self.stats:
+                self.stats.record_wait((time.perf_counter() - start) * 1000)
+
+
+def instrument(engine, name: str) -> PoolStats:
+    """ attach a PoolStats to an engine created with poolclass=TimedQueuePool """
+    stats = PoolStats(name)
+    engine.pool.stats = stats
+
+    @event.listens_for(engine, "connect")
+    def on_connect(dbapi_conn, record):
+        stats.count("connects")
+
+    @event.listens_for(engine, "checkout")
+    def on_checkout(dbapi_conn, record, proxy):
+        record.info["checked_out_at"] = time.perf_counter()
+        stats.checkout()
+
+    @event.listens_for(engine, "checkin")
+    def on_checkin(dbapi_conn, record):
+        start = record.info.pop("checked_out_at", None)
+        stats.checkin((time.perf_counter() - start) * 1000 if start else None)
+
+    @event.listens_for(engine, "invalidate")
+    def on_invalidate(dbapi_conn, record, exc):
+        stats.count("invalidations")
+
+    return stats
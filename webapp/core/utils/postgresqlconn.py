@@ -1,10 +1,84 @@
 import psycopg2
 import psycopg2.extras
-import psycopg2.pool
+import datetime
+import itertools
 import os
-import time
+import threading
 import traceback as tb
-from io import StringIO
+import uuid
+from collections import namedtuple
+import simplejson as json
+from .connpool import ConnectionPool, PoolTimeoutException
+from .preparedstatements import PreparedStatementCache
+from . import sqlstats
+
+_pool = None
+_pool_lock = threading.Lock()
+
+# prepared statements kept per connection. 0 disables preparing
+_STMT_CACHE_SIZE = int(os.getenv("PG_STMT_CACHE_SIZE", 100))
+
+
+def connection_pool() -> ConnectionPool:
+    """ the process-wide pool behind PostgreSQLConn, created on first use """
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool.from_env(os.getenv("DATABASE_URL"))
+    return _pool
+
+
+def connection_pool_stats():
+    """ stats of the PostgreSQLConn pool, or None if nothing has used it yet """
+    return _pool.stats() if _pool is not None else None
+
+
+def _csv_field(value) -> str:
+    """ encode one value for COPY ... (format csv). NULL is the only unquoted empty field, so every
+    other value is quoted, which keeps empty strings, "None", delimiters, quotes, newlines and
+    backslashes intact """
+    if value is None:
+        return ""
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        value = "\\x" + bytes(value).hex()
+    elif isinstance(value, (dict, list)):
+        value = json.dumps(value)
+    elif isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        value = value.isoformat()
+    else:
+        value = str(value)
+    return '"' + value.replace('"', '""') + '"'
+
+
+class _CopyStream():
+    """ a read-only file-like object over an iterable of row dicts that copy_expert pulls from. rows
+    are encoded as CSV a chunk at a time so memory stays flat no matter how many rows there are """
+
+    def __init__(self, rows, columns: tuple, chunk_rows: int):
+        self.columns = columns
+        self.chunk_rows = chunk_rows
+        self.rows_read = 0
+        self.__rows = iter(rows)
+        self.__buffer = b""
+        self.__exhausted = False
+
+    def read(self, size: int = -1) -> bytes:
+        while not self.__exhausted and (size < 0 or len(self.__buffer) < size):
+            chunk = list(itertools.islice(self.__rows, self.chunk_rows))
+            if not chunk:
+                self.__exhausted = True
+                break
+            self.rows_read += len(chunk)
+            self.__buffer += "".join(
+                ",".join(_csv_field(row.get(c)) for c in self.columns) + "\n" for row in chunk
+                ).encode("utf-8")
+
+        if size < 0:
+            data, self.__buffer = self.__buffer, b""
+        else:
+            data, self.__buffer = self.__buffer[:size], self.__buffer[size:]
+        return data
 
 
 class PostgreSQLConn:
@@ -12,25 +86,27 @@ class PostgreSQLConn:
         "auto-commit": psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT,
         "read-committed": psycopg2.extensions.ISOLATION_LEVEL_READ_COMMITTED,
     }
-    __pool = psycopg2.pool.SimpleConnectionPool(1, 10, os.getenv("DATABASE_URL"))
 
     def __init__(self, dbname: str, isolation: str = "auto-commit"):
         # Establishes the connection with the backend databases.
 
         isolation_level = self.isolation_opts.get(isolation, psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        self.__pool = None
+        self.__record = None
+        self.__conn = None
         try:
             if dbname == "YOUR_DATABASE_NAME":
-                self.__conn = self.__pool.getconn()
+                self.__pool = connection_pool()
+                self.__record = self.__pool.getconn()
+                self.__conn = self.__record.conn
+                if self.__record.statements is None:
+                    self.__record.statements = PreparedStatementCache(_STMT_CACHE_SIZE)
                 self.__conn.set_isolation_level(isolation_level)
-            else:
-                self.__pool = None
-                self.__conn = None
-        except psycopg2.pool.PoolError as e:
-            self.__pool = None
-            self.__conn = None
+        except PoolTimeoutException as e:
             raise(e)
         except Exception as e:
             tb.print_exc()
+            self.__release()
             raise(e)
 
     def __enter__(self):
@@ -39,9 +115,16 @@ class PostgreSQLConn:
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         """ implicity called after the last expression within a with-block. exiting the with block also commits
-        everything in the current transaction """
-        self.__conn.commit()
-        self.__del__()
+        everything in the current transaction, or rolls it back if the block raised. either way the connection
+        goes back to the pool right away """
+        try:
+            if self.__conn:
+                if exc_type is None:
+                    self.__conn.commit()
+                else:
+                    self.__conn.rollback()
+        finally:
+            self.__release()
 
         # https://infohost.nmt.edu/tcc/help/pubs/python/web/exit-method.html
         #   returning True surpresses any exceptions caused by the with block
@@ -49,20 +132,24 @@ class PostgreSQLConn:
         return False
 
     def __del__(self):
-        """ implicitly called when garbage collections comes around to clean up objects.
-        the database connection is returned to the pool """
+        """ safety net for connections that weren't released through a with-block or disconnect(). the
+        connection is returned to the pool """
+        self.__release()
 
-        if self.__pool and self.__conn:
-            self.__pool.putconn(self.__conn)
+    def __release(self, close: bool = False):
+        if self.__pool and self.__record:
+            self.__pool.putconn(self.__record, close=close)
         self.__pool = None
+        self.__record = None
         self.__conn = None
 
+    def release(self):
+        """ return the connection to the pool. use this when not using a with-block """
+        self.__release()
+
     def disconnect(self):
         """ close the connection. it doesn't return to the pool """
-        if self.__pool and self.__conn:
-            self.__pool.putconn(self.__conn, close=True)
-        self.__pool = None
-        self.__conn = None
+        self.__release(close=True)
 
     def commit_transaction(self):
         """ a function that allows explicit control over commiting transactions. this should be used when the
@@ -80,15 +167,29 @@ class PostgreSQLConn:
     def update_exact(self, table_name: str, conditions: dict, newvalues: dict) -> int:
         """ updates rows that match the given equality conditions with new values. both conditions
         and newvalues are dictionaries. kv pairs in conditions are translated into 'column = value'
-        conditions and kv pairs in newvalues are used in the SET clause
+        conditions and kv pairs in newvalues are used in the SET clause. conditions can't be empty,
+        so a missing filter never rewrites the whole table
 
         returns the number of rows updated
         """
         if not self.__conn:
             raise psycopg2.InterfaceError("null connection")
 
+        if not conditions:
+            raise ValueError("update_exact needs at least one condition")
+        if not newvalues:
+            return 0
+
         try:
-            pass
+            query = "update {table_name} set {assignments} where {conditions}".format(**{
+                "table_name": table_name,
+                "assignments": ",".join("{} = %s".format(c) for c in newvalues.keys()),
+                "conditions": " and ".join("{} = %s".format(c) for c in conditions.keys()),
+                })
+
+            with self.__conn.cursor() as curs:
+                self.__execute(curs, query, tuple(newvalues.values()) + tuple(conditions.values()))
+                return curs.rowcount
         except Exception as e:
             tb.print_exc()
             raise(e)
@@ -116,44 +217,45 @@ class PostgreSQLConn:
                 })
 
             with self.__conn.cursor() as curs:
-                curs.execute(query, fillers)
+                self.__execute(curs, query, fillers)
                 return curs.fetchone()[0]
 
         except Exception as e:
             tb.print_exc()
             raise(e)
 
-    def insert_bulk(self, table_name: str, rows: list, unique_cols: list = []):
-        """ just like insert except we use the postgres copy function to move new data from a temp
-        table into the target table
+    def insert_bulk(self, table_name: str, rows, unique_cols: list = [], chunk_rows: int = 10000,
+                    copy_buffer_bytes: int = 65536) -> int:
+        """ just like insert except rows are streamed with the postgres copy function into a temp table
+        and moved from there into the target table. rows are encoded as CSV while copy reads them, so a
+        generator of millions of rows never has more than one chunk in memory.
 
-        rows - a list of dicts representing all the new rows
+        rows - any iterable (list, generator, ...) of dicts. the first row's keys are the columns;
+            keys missing from later rows are inserted as NULL
         unique_cols - name of all unique columns. if duplicates are found then the newly given rows
-            will overwrite the old rows.
+            will overwrite the old rows. the target table needs a unique index on exactly these columns
+        chunk_rows - rows encoded at a time
+        copy_buffer_bytes - size of each read copy makes
 
-        returns number of rows inserted or None on error
+        returns number of rows inserted or updated
         """
-        if not self.__conn or not rows:
+        if not self.__conn:
             raise psycopg2.InterfaceError("null connection")
 
         # if the batch is small just resort to standard insert
-        if not unique_cols and len(rows) < 10:
-            return self.insert(table_name, rows)
-
-        # The keys of the first dictionary in data are the column names we need
-        cols = rows[0].keys()
-
+        if not unique_cols and isinstance(rows, (list, tuple)) and len(rows) < 10:
+            return self.insert(table_name, rows) if rows else 0
+
+        rows = iter(rows)
+        first = next(rows, None)
+        if first is None:
+            return 0
+        cols = tuple(first.keys())
+        stream = _CopyStream(itertools.chain([first], rows), cols, chunk_rows)
+
+        # Make a temp table to hold the imported data
+        temptable = "bulk_{}".format(uuid.uuid4().hex)
         try:
-            # Put the data into a string file-like object, in csv format
-            csv = StringIO()
-            for row in rows:
-                # Strip all strings in values() and put them into a semicol del string
-                tstr = "|".join([str(x).strip() for x in row.values()]) + "\n"
-                csv.write(tstr)
-            csv.seek(0)
-
-            # Make a temp table to hold the imported data
-            temptable = "{}_{}".format(table_name, int(time.time() * 100000))
             query = """
                     create temporary table {temptable} as
                         select {columns} from {table_name} where 1 = 0
@@ -165,56 +267,104 @@ class PostgreSQLConn:
             self.execute_write_query(query)
 
             with self.__conn.cursor() as curs:
-                query = "copy {temptable} from stdin with null as 'None' delimiter '|'".format(
-                         **{"temptable": temptable})
-                curs.copy_expert(query, csv)
+                query = "copy {temptable} ({columns}) from stdin with (format csv)".format(**{
+                    "temptable": temptable,
+                    "columns": ",".join(cols),
+                    })
+                with sqlstats.timed(query):
+                    curs.copy_expert(query, stream, size=copy_buffer_bytes)
 
-            # Delete duplicates from target table if unique_cols specified
-            distinct = ""
             if unique_cols:
-                colstr = ','.join(unique_cols)
-                distinct = " distinct on ( {} ) ".format(colstr)
-                where = " where ({}) in (select {} from {})".format(colstr, colstr, temptable)
-                query = "delete from {} {}".format(table_name, where)
-                self.execute_write_query(query)
-
-            # Insert new rows into target
-            query = "insert into %s (%s) select %s * from %s" % (table_name, ",".join(cols), distinct, temptable)
+                # upsert in one statement. distinct on keeps one row per key (the last one given, since
+                # a fresh temp table is stored in insertion order) so no row is touched twice
+                colstr = ",".join(unique_cols)
+                updates = [c for c in cols if c not in unique_cols]
+                if updates:
+                    conflict = "do update set " + ",".join("{0} = excluded.{0}".format(c) for c in updates)
+                else:
+                    conflict = "do nothing"
+                query = """
+                    insert into {table_name} ({columns})
+                        select distinct on ({colstr}) {columns} from {temptable}
+                        order by {colstr}, ctid desc
+                    on conflict ({colstr}) {conflict}
+                    """.format(**{
+                    "table_name": table_name,
+                    "columns": ",".join(cols),
+                    "colstr": colstr,
+                    "temptable": temptable,
+                    "conflict": conflict,
+                    })
+            else:
+                query = "insert into {table_name} ({columns}) select {columns} from {temptable}".format(**{
+                    "table_name": table_name,
+                    "columns": ",".join(cols),
+                    "temptable": temptable,
+                    })
             n_inserted = self.execute_write_query(query)
 
             return n_inserted
         except Exception as e:
             tb.print_exc()
             raise(e)
-
-    def insert(self, table_name: str, rows: list) -> int:
+        finally:
+            if self.__conn and not self.__conn.closed:
+                try:
+                    self.execute_write_query("drop table if exists {}".format(temptable))
+                except psycopg2.Error:
+                    # inside a failed transaction; the temp table goes away with the rollback
+                    pass
+
+    def insert(self, table_name: str, rows: list, returning: str = None, page_size: int = 1000):
         """ inserts the given data into the specified table.
 
-        An individual insert statement is generated per row. The query is handled as a prepared
-        statement so multi-inserts are more efficient.
+        Rows are grouped by their set of columns and each group is sent as multi-row
+        "insert ... values (...), (...), ..." statements of up to page_size rows, so inserting N rows
+        costs about N / page_size round trips instead of N. Full pages reuse one prepared statement.
 
         table_name --
         rows -- list of dicts. each dict representing a row to be inserted
+        returning -- optional column name. when given, the inserted values of that column are returned
+        page_size -- max rows per statement
 
-        returns: the number of rows inserted
+        returns: the number of rows inserted, or the list of returned values if returning is set. values
+            come back grouped by column set, in the order each set first appears in rows
         """
         n_inserted = 0
+        returned = []
         if not self.__conn or not rows:
             raise psycopg2.InterfaceError("null connection")
 
-        try:
-            for row in rows:
-                columns = "(" + ",".join(row.keys()) + ")"   # "(col1, col2, col3...)"
-                params = ",".join(["%s"] * len(row.keys()))  # "%s, %s, %s..."
+        # column set -> (column order, list of value tuples in that order)
+        groups = {}
+        for row in rows:
+            key = frozenset(row)
+            if key not in groups:
+                groups[key] = (tuple(row), [])
+            columns, values = groups[key]
+            values.append(tuple(row[c] for c in columns))
 
-                query = "insert into {table_name} {columns} select {params}".format(**{
-                    "table_name": table_name,
-                    "columns": columns,
-                    "params": params,
-                    })
-
-                n_inserted += self.execute_write_query(query, tuple(row.values()))
-            return n_inserted
+        try:
+            with self.__conn.cursor() as curs:
+                for columns, values in groups.values():
+                    prefix = "insert into {table_name} ({columns}) values ".format(**{
+                        "table_name": table_name,
+                        "columns": ",".join(columns),
+                        })
+                    suffix = " returning {}".format(returning) if returning else ""
+                    template = "(" + ",".join(["%s"] * len(columns)) + ")"
+                    # every full page shares one prepared statement; postgres takes at most 65535 parameters
+                    rows_per_page = max(1, min(page_size, 65535 // len(columns)))
+
+                    for i in range(0, len(values), rows_per_page):
+                        page = values[i:i + rows_per_page]
+                        query = prefix + ",".join([template] * len(page)) + suffix
+                        self.__execute(curs, query, tuple(itertools.chain.from_iterable(page)))
+                        n_inserted += curs.rowcount
+                        if returning:
+                            returned.extend(r[0] for r in curs.fetchall())
+
+            return returned if returning else n_inserted
         except Exception as e:
             tb.print_exc()
             raise(e)
@@ -228,8 +378,9 @@ class PostgreSQLConn:
 
         try:
             with self.__conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as curs:
-                curs.execute(query, args)
-                rows = curs.fetchall()
+                with sqlstats.timed(query):
+                    curs.execute(query, args)
+                    rows = curs.fetchall()
         except Exception as e:
             tb.print_exc()
             raise(e)
@@ -238,6 +389,60 @@ class PostgreSQLConn:
             return []
         return rows
 
+    def iter_read_query(self, query: str, args: tuple = (), itersize: int = 2000, row_format: str = "dict"):
+        """ like execute_read_query but rows are streamed from a server-side cursor, itersize rows per
+        round trip, so peak memory is bounded by the batch size instead of the result size.
+
+        row_format -- "dict" for a dict per row, "tuple" for plain tuples or "namedtuple" for tuples whose
+            field names are shared by every row
+
+        returns a generator. the cursor is closed when the generator is exhausted or closed
+        """
+        if not self.__conn:
+            raise psycopg2.InterfaceError("null connection")
+        if row_format not in ("dict", "tuple", "namedtuple"):
+            raise ValueError("unknown row format: {}".format(row_format))
+
+        # named cursors only live inside a transaction. rather than a WITH HOLD cursor, which would
+        # materialize the whole result on the server, an auto-commit connection gets a transaction for
+        # the duration of the scan
+        conn = self.__conn
+        autocommit = conn.autocommit
+        if autocommit:
+            conn.autocommit = False
+
+        factory = psycopg2.extras.RealDictCursor if row_format == "dict" else None
+        curs = conn.cursor(name="stream_{}".format(uuid.uuid4().hex), cursor_factory=factory)
+        try:
+            curs.itersize = itersize
+            with sqlstats.timed(query):
+                curs.execute(query, args)
+            row_type = None
+            while True:
+                batch = curs.fetchmany(itersize)
+                if not batch:
+                    break
+                if row_format == "namedtuple":
+                    if row_type is None:
+                        row_type = namedtuple("Row", [col[0] for col in curs.description], rename=True)
+                    for row in batch:
+                        yield row_type._make(row)
+                else:
+                    for row in batch:
+                        yield row
+        except Exception as e:
+            tb.print_exc()
+            raise(e)
+        finally:
+            # release() may have run before the generator was closed or collected. the pool rolled
+            # the connection back then, which dropped the cursor, and the connection may belong to
+            # another caller by now, so it's left alone
+            if self.__conn is conn and not conn.closed:
+                curs.close()
+                if autocommit:
+                    conn.rollback()
+                    conn.autocommit = True
+
     def execute_write_query(self, query: str, args: tuple = ()) -> int:
         """ perform a write query
 
@@ -250,7 +455,7 @@ class PostgreSQLConn:
             raise psycopg2.InterfaceError("null connection")
 
         try:
-            with self.__conn.cursor() as curs:
+            with self.__conn.cursor() as curs, sqlstats.timed(query):
                 curs.execute(query, args)
         except Exception as e:
             tb.print_exc()
@@ -258,6 +463,11 @@ class PostgreSQLConn:
 
         return curs.rowcount
 
+    def __execute(self, curs, query: str, args: tuple = ()):
+        """ run a statement through this connection's prepared statement cache """
+        with sqlstats.timed(query):
+            self.__record.statements.execute(curs, query, args)
+
     def generate_query(self, query: str, args: tuple = ()) -> str:
         """ return the query string, with the given parameters, that would be executed against the database.
         nothing is executed.
@@ -0,0 +1,114 @@
+"""
+    per-connection registry of server-side prepared statements. statements are PREPAREd the first
+    time their normalized text is seen on a connection and EXECUTEd from then on, so postgres parses
+    and plans them once per connection instead of once per call
+"""
+import re
+import threading
+import time
+from collections import OrderedDict
+import psycopg2
+import psycopg2.errorcodes
+
+_WHITESPACE = re.compile(r"\s+")
+_PLACEHOLDER = re.compile(r"%[s%]")
+
+# totals across every connection's registry
+_stats_lock = threading.Lock()
+_stats = {
+    "hits": 0,
+    "misses": 0,
+    "evictions": 0,
+    "resets": 0,
+    "prepare_roundtrip_ms": 0.0,
+    "saved_prepare_roundtrip_ms": 0.0,
+}
+
+
+def _count(**deltas):
+    with _stats_lock:
+        for name, delta in deltas.items():
+            _stats[name] += delta
+
+
+def prepared_statement_stats() -> dict:
+    """ hits, misses and evictions across all connections. prepare_roundtrip_ms is the client side
+    wall time of every PREPARE, and saved_prepare_roundtrip_ms credits each hit with that time for
+    its statement. both include a network round trip, so they are an upper bound on the parse/plan
+    time saved, not a measurement of it """
+    with _stats_lock:
+        stats = dict(_stats)
+    lookups = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+    return stats
+
+
+def normalize(query: str) -> str:
+    return _WHITESPACE.sub(" ", query).strip()
+
+
+def _to_positional(query: str) -> str:
+    """ rewrite psycopg2's %s placeholders as postgres' $1, $2, ... """
+    counter = iter(range(1, 65536))
+    return _PLACEHOLDER.sub(lambda m: "%" if m.group() == "%%" else "${}".format(next(counter)), query)
+
+
+class PreparedStatementCache():
+    """ the prepared statements of one connection, least recently used first. a registry belongs
+    to exactly one connection and dies with it, so a connection the pool recycles starts empty """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        # normalized query -> (statement name, ms the PREPARE round trip took)
+        self.__entries = OrderedDict()
+        self.__next_id = 0
+
+    def execute(self, curs, query: str, args: tuple = ()):
+        """ run query through its prepared statement, preparing it first if needed. queries using
+        named %(name)s placeholders aren't prepared and run as-is """
+        if self.max_size <= 0 or "%(" in query:
+            curs.execute(query, args)
+            return
+
+        key = normalize(query)
+        entry = self.__entries.get(key)
+        if entry:
+            self.__entries.move_to_end(key)
+            _count(hits=1, saved_prepare_roundtrip_ms=entry[1])
+        else:
+            entry = self.__prepare(curs, key)
+            _count(misses=1, prepare_roundtrip_ms=entry[1])
+
+        try:
+            if args:
+                curs.execute("execute {}({})".format(entry[0], ",".join(["%s"] * len(args))), args)
+            else:
+                curs.execute("execute {}".format(entry[0]))
+        except psycopg2.Error as e:
+            if e.pgcode == psycopg2.errorcodes.INVALID_SQL_STATEMENT_NAME:
+                # something deallocated our statements behind our back (e.g. DISCARD ALL)
+                self.reset()
+            raise
+
+    def reset(self):
+        """ forget every statement. used when the server side state is gone """
+        self.__entries.clear()
+        _count(resets=1)
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def __prepare(self, curs, key: str) -> tuple:
+        self.__next_id += 1
+        name = "ps_{}".format(self.__next_id)
+
+        start = time.perf_counter()
+        curs.execute("prepare {} as {}".format(name, _to_positional(key)))
+        entry = (name, (time.perf_counter() - start) * 1000)
+        self.__entries[key] = entry
+
+        while len(self.__entries) > self.max_size:
+            _, (evicted, _) = self.__entries.popitem(last=False)
+            curs.execute("deallocate {}".format(evicted))
+            _count(evictions=1)
+        return entry
@@ -0,0 +1,83 @@
+"""
+    decides whether read-only queries can go to the read replica. the replica is skipped when its
+    replication lag is over REPLICA_MAX_LAG_SECONDS, when the lag can't be measured, and for the
+    rest of a request that has already written to the primary so it reads its own writes
+"""
+import os
+import threading
+import time
+import traceback
+from sqlalchemy import text
+from . import _ro_engine
+
+_MAX_LAG_SECONDS = float(os.getenv("REPLICA_MAX_LAG_SECONDS", 5))
+_LAG_CHECK_SECONDS = float(os.getenv("REPLICA_LAG_CHECK_SECONDS", 5))
+
+# a caught up standby has replayed everything it received, even if the primary has been idle for
+# a while and the last replayed transaction is old
+_LAG_QUERY = text("""
+    select case
+        when pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() then 0
+        else coalesce(extract(epoch from now() - pg_last_xact_replay_timestamp()), 0)
+    end as lag
+    """)
+
+_request_state = threading.local()
+
+
+class _LagMonitor():
+    """ measures replica lag at most once every check_seconds. one thread measures while the
+    others use the last known value """
+
+    def __init__(self, engine, max_lag: float, check_seconds: float):
+        self.engine = engine
+        self.max_lag = max_lag
+        self.check_seconds = check_seconds
+        self.lag = None
+        self.__checked_at = 0.0
+        self.__lock = threading.Lock()
+
+    def usable(self) -> bool:
+        if self.engine is None:
+            return False
+        if time.monotonic() - self.__checked_at > self.check_seconds and self.__lock.acquire(False):
+            try:
+                self.lag = self.__measure()
+                self.__checked_at = time.monotonic()
+            finally:
+                self.__lock.release()
+        return self.lag is not None and self.lag <= self.max_lag
+
+    def __measure(self):
+        try:
+            with self.engine.connect() as conn:
+                return float(conn.execute(_LAG_QUERY).scalar())
+        except Exception:
+            traceback.print_exc()
+            return None
+
+
+_monitor = _LagMonitor(_ro_engine, _MAX_LAG_SECONDS, _LAG_CHECK_SECONDS)
+
+
+def begin_request():
+    """ called at the start of every request so one request's writes don't pin the next one
+    served by this thread to the primary """
+    _request_state.wrote = False
+
+
+def mark_write():
+    """ record that the current request committed a write to the primary """
+    _request_state.wrote = True
+
+
+def use_replica() -> bool:
+    """ True if a read-only query issued now should go to the replica """
+    if getattr(_request_state, "wrote", False):
+        return False
+    return _monitor.usable()
+
+
+def replica_lag():
+    """ the last measured replica lag in seconds, or None if unknown """
+    return _monitor.lag
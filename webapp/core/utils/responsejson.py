@@ -1,25 +1,25 @@
 """
     simple classes that define standardized JSON structures for responses
 """
-import simplejson as json
+from flask import Response
+from . import jsonencoder
 
 
 class ResponseJson():
     __data = {}
     __code = 0
+    __body = None
 
     def __init__(self, data: dict, code: int=200):
         """ define a custom JSON response and return code """
 
-        # this code looks weird but its to properly handle data types that can't be handled
-        # by the standard flask jsonify method (e.g. Decimals). so we use simplejson to dump the
-        # raw json to a string (simplejson converts decimals to strings) and then load it
-        # back to json for flask to take care of later
-        self.data = json.loads(json.dumps(data))
+        # the payload is serialized once, lazily, by jsonencoder which also handles data types
+        # flask's jsonify can't (e.g. Decimals). make_response hands the bytes straight to flask
+        self.data = data
         self.return_code = code
 
     def __str__(self):
-        return json.dumps(self.__data)
+        return self.body.decode("utf-8")
 
     @property
     def return_code(self):
@@ -36,9 +36,18 @@ class ResponseJson():
     @data.setter
     def data(self, data):
         self.__data = data
+        self.__body = None
 
-    def make_response(self):
-        return self.__data, self.__code
+    @property
+    def body(self) -> bytes:
+        """ the serialized payload. computed on first access """
+        if self.__body is None:
+            self.__body = jsonencoder.dumps(self.__data)
+        return self.__body
+
+    def make_response(self, headers: dict=None) -> Response:
+        body = b"" if self.__code == 204 else self.body
+        return Response(body, status=self.__code, headers=headers, mimetype="application/json")
 
 
 class DeprecatedResponseJson(ResponseJson):
@@ -79,7 +88,7 @@ class UnauthorizedResponseJson(ResponseJson):
 
     def make_response(self):
         """ override parent impl to include some special header info """
-        return self.data, self.return_code, {'WWW-Authenticate': 'Basic realm="Login Required"'}
+        return super().make_response({'WWW-Authenticate': 'Basic realm="Login Required"'})
 
 
 class UnauthorizedGuestResponseJson(ResponseJson):
@@ -90,7 +99,19 @@ class UnauthorizedGuestResponseJson(ResponseJson):
         super().__init__(data, 406)
 
     def make_response(self):
-        return self.data, self.return_code, {'WWW-Authenticate': 'Basic realm="Login Required"'}
+        return super().make_response({'WWW-Authenticate': 'Basic realm="Login Required"'})
+
+
+class ServiceUnavailableResponseJson(ResponseJson):
+    """ json structure telling the client we're too busy right now and to retry shortly """
+
+    def __init__(self, retry_after: int = 1):
+        data = {"error": "service busy, try again shortly"}
+        super().__init__(data, 503)
+        self.retry_after = retry_after
+
+    def make_response(self):
+        return super().make_response({'Retry-After': str(self.retry_after)})
 
 
 class MessageResponseJson(ResponseJson):
@@ -0,0 +1,180 @@
+"""
+    per-process view of the revoked_token table used by stateless token verification. revoked jtis
+    are kept in an exact set fronted by a Bloom filter, so the common case (a token that was never
+    revoked) is answered from a few bit tests. the set is refreshed incrementally from the table at
+    most every REVOCATION_REFRESH_SECONDS, which bounds how long a logout takes to reach the other
+    workers
+"""
+import datetime
+import hashlib
+import math
+import os
+import threading
+import time
+import traceback
+from sqlalchemy import text
+from . import create_read_session
+
+_LOAD_REVOCATIONS = text("""
+    select jti, expires_utc, revoked_utc from revoked_token
+    where revoked_utc >= :since and expires_utc > :now
+    """)
+
+
+class BloomFilter():
+    """ fixed-size Bloom filter over strings sized for `capacity` entries at `error_rate` false
+    positives. there are no false negatives """
+
+    def __init__(self, capacity: int, error_rate: float=0.01):
+        capacity = max(1, capacity)
+        self.capacity = capacity
+        self.n_bits = max(8, int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)))
+        self.n_hashes = max(1, int(round(self.n_bits / capacity * math.log(2))))
+        self.__bits = bytearray((self.n_bits + 7) // 8)
+        self.__count = 0
+
+    def __positions(self, key: str):
+        # double hashing: k positions from the two halves of one digest
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.n_bits for i in range(self.n_hashes)]
+
+    def add(self, key: str):
+        for pos in self.__positions(key):
+            self.__bits[pos >> 3] |= 1 << (pos & 7)
+        self.__count += 1
+
+    def __contains__(self, key: str) -> bool:
+        bits = self.__bits
+        return all(bits[pos >> 3] & (1 << (pos & 7)) for pos in self.__positions(key))
+
+    def __len__(self):
+        return self.__count
+
+
+class RevocationList():
+    """ the revoked, unexpired jtis known to this process. nothing is known until the first
+    refresh succeeds, and is_revoked() returns None until then so callers can fall back to the
+    database """
+
+    def __init__(self, refresh_seconds: float=5.0, overlap_seconds: float=60.0,
+                 capacity: int=100000, error_rate: float=0.01):
+        self.refresh_seconds = refresh_seconds
+        self.overlap_seconds = overlap_seconds
+        self.error_rate = error_rate
+
+        # jti -> expires_utc
+        self.__revoked = {}
+        self.__bloom = BloomFilter(capacity, error_rate)
+        self.__lock = threading.Lock()
+        self.__loaded = False
+        self.__watermark = datetime.datetime.min
+        self.__next_refresh = 0.0
+        self.__counters = {
+            "checks": 0,
+            "bloom_positives": 0,
+            "false_positives": 0,
+            "refreshes": 0,
+            "refresh_failures": 0,
+        }
+
+    @classmethod
+    def from_env(cls):
+        """ build a list configured through REVOCATION_REFRESH_SECONDS, REVOCATION_OVERLAP_SECONDS
+        and REVOCATION_CAPACITY """
+        return cls(refresh_seconds=float(os.getenv("REVOCATION_REFRESH_SECONDS", 5)),
+                   overlap_seconds=float(os.getenv("REVOCATION_OVERLAP_SECONDS", 60)),
+                   capacity=int(os.getenv("REVOCATION_CAPACITY", 100000)))
+
+    def is_revoked(self, jti: str):
+        """ True if the jti is revoked, False if not, None if the list hasn't loaded yet """
+        self.__maybe_refresh()
+        if not self.__loaded:
+            return None
+
+        self.__counters["checks"] += 1
+        if jti not in self.__bloom:
+            return False
+        self.__counters["bloom_positives"] += 1
+        if jti in self.__revoked:
+            return True
+        self.__counters["false_positives"] += 1
+        return False
+
+    def revoke(self, jti: str, expires_utc: datetime.datetime):
+        """ record a revocation made by this process without waiting for the next refresh """
+        with self.__lock:
+            self.__add(jti, expires_utc)
+
+    def refresh(self):
+        """ pull revocations recorded since the last refresh. rows from the last
+        overlap_seconds are read again because a transaction that started earlier can commit
+        after the previous refresh ran """
+        now = datetime.datetime.utcnow()
+        since = self.__watermark - datetime.timedelta(seconds=self.overlap_seconds) \
+            if self.__loaded else datetime.datetime.min
+
+        session = create_read_session(replica=False)
+        try:
+            rows = session.execute(_LOAD_REVOCATIONS, {"since": since, "now": now}).fetchall()
+        finally:
+            session.close()
+
+        with self.__lock:
+            self.__prune(now)
+            for row in rows:
+                self.__add(row.jti, row.expires_utc)
+                if row.revoked_utc > self.__watermark:
+                    self.__watermark = row.revoked_utc
+            self.__loaded = True
+        self.__counters["refreshes"] += 1
+
+    def stats(self) -> dict:
+        stats = dict(self.__counters)
+        stats["revoked"] = len(self.__revoked)
+        stats["bloom_bits"] = self.__bloom.n_bits
+        stats["loaded"] = self.__loaded
+        return stats
+
+    def __maybe_refresh(self):
+        if time.monotonic() < self.__next_refresh:
+            return
+        # only one thread refreshes; the others keep answering from the current data
+        if not self.__lock.acquire(blocking=False):
+            return
+        try:
+            self.__next_refresh = time.monotonic() + self.refresh_seconds
+        finally:
+            self.__lock.release()
+
+        try:
+            self.refresh()
+        except Exception:
+            traceback.print_exc()
+            self.__counters["refresh_failures"] += 1
+
+    def __add(self, jti: str, expires_utc: datetime.datetime):
+        if jti in self.__revoked:
+            return
+        self.__revoked[jti] = expires_utc
+        if len(self.__bloom) >= self.__bloom.capacity:
+            self.__rebuild(len(self.__revoked) * 2)
+        else:
+            self.__bloom.add(jti)
+
+    def __prune(self, now: datetime.datetime):
+        """ expired tokens fail verification anyway, so their jtis are dropped and the filter
+        rebuilt once they make up half of it """
+        expired = [jti for jti, expires_utc in self.__revoked.items() if expires_utc <= now]
+        for jti in expired:
+            del self.__revoked[jti]
+        if expired and len(self.__bloom) >= 2 * len(self.__revoked):
+            self.__rebuild(self.__bloom.capacity)
+
+    def __rebuild(self, capacity: int):
+        bloom = BloomFilter(max(capacity, len(self.__revoked)), self.error_rate)
+        for jti in self.__revoked:
+            bloom.add(jti)
+        # swapped in whole so readers never see a half built filter
+        self.__bloom = bloom
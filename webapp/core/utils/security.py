@@ -1,12 +1,16 @@
 """
    handles hashes, encryption, and token generation
 """
-import traceback
-import jwt
+import hashlib
+import hmac
+import threading
 import os
 import time
+import uuid
 import datetime as dt
 from passlib.context import CryptContext
+from .hashpool import HashPool
+from .keyring import KeyRing
 
 _cryptcxt = CryptContext(
         schemes=["sha256_crypt"],
@@ -14,14 +18,34 @@ _cryptcxt = CryptContext(
         sha256_crypt__salt_size=16
     )
 
+_hash_pool = HashPool.from_env()
 
-def generate_token(payload: dict, exp_seconds: int) -> str:
-    """ generate a JWT with the given payload. uses HMAC + SHA-256 hash algorithm. the token 
-    expires after the given number of seconds. """
-    jwt_secret = os.getenv("JWT_SECRET")
-    jwt_iss = os.getenv("JWT_ISS")
+# per-process key for credential_mac(). it never leaves memory, so the macs are useless outside
+# of this process
+_mac_key = os.urandom(32)
+
+# debug runs stamp tokens with the machine's local time instead of UTC
+_LOCAL_TIME = bool(os.getenv("DEBUG"))
+
+_keyring = None
+_keyring_lock = threading.Lock()
+
+
+def keyring() -> KeyRing:
+    """ the process-wide JWT key ring, loaded from the environment on first use """
+    global _keyring
+    if _keyring is None:
+        with _keyring_lock:
+            if _keyring is None:
+                _keyring = KeyRing.from_env()
+    return _keyring
 
-    if os.getenv("DEBUG"):
+
+def generate_token(payload: dict, exp_seconds: int) -> str:
+    """ generate a JWT with the given payload, signed with the active key of the key ring using
+    HMAC + SHA-256. the token expires after the given number of seconds. every token gets a unique
+    jti so it can be revoked on its own """
+    if _LOCAL_TIME:
         # if running in debug mode, use timezone of machine
         payload["iat"] = int(dt.datetime.now().timestamp())
         payload["exp"] = int((dt.datetime.now() + dt.timedelta(seconds=exp_seconds)).timestamp())
@@ -30,34 +54,53 @@ def generate_token(payload: dict, exp_seconds: int) -> str:
         payload["iat"] = int(dt.datetime.utcnow().timestamp())
         payload["exp"] = int((dt.datetime.utcnow() + dt.timedelta(seconds=exp_seconds)).timestamp())
 
-    payload["iss"] = jwt_iss
+    payload["jti"] = uuid.uuid4().hex
+    return keyring().sign(payload)
+
 
-    try:
-        token = jwt.encode(payload, jwt_secret, algorithm="HS256")
-        return token.decode("utf-8")
-    except Exception as e:
-        raise(e)
+def decode_token(token: str) -> dict:
+    """ the claims of a fetchy fox JWT, or None if it's malformed or its key, signature, issuer or
+    expiry is invalid. rejections are only counted, see token_stats() """
+    return keyring().decode(token)
 
 
 def verify_token(token: str) -> bool:
     """ verify a fetchy fox JWT """
-    jwt_secret = os.getenv("JWT_SECRET")
-    jwt_iss = os.getenv("JWT_ISS")
-    try:
-        jwt.decode(token, jwt_secret, issuer=jwt_iss)
-        return True
-    except Exception as e:
-        traceback.print_exc()
-        return False
+    return keyring().decode(token) is not None
+
+
+def token_stats() -> dict:
+    """ verified tokens and rejections by reason. empty until the key ring is first used """
+    return _keyring.stats() if _keyring else {}
+
+
+def token_digest(token: str) -> str:
+    """ fixed-size sha256 hex digest of a token. this is what gets stored and looked up instead of
+    the token itself """
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+def _hash(text: str) -> str:
+    return _cryptcxt.hash(text)
+
+
+def _verify(text: str, hash: str) -> bool:
+    return _cryptcxt.verify(text, hash)
 
 
 def generate_hash(text: str) -> str:
     """ hash the given text data using pbkdf2_sha256. this should be used for passwords and other sensitive
-    info """
-    h = _cryptcxt.encrypt(text)
-    return h
+    info. runs in the hashing pool; raises HashPoolSaturatedException if the pool is full """
+    return _hash_pool.run(_hash, text)
 
 
 def verify_hash(text: str, hash: str) -> bool:
-    """ verify the given text against the given hash. """
-    return _cryptcxt.verify(text, hash)
+    """ verify the given text against the given hash. runs in the hashing pool; raises
+    HashPoolSaturatedException if the pool is full """
+    return _hash_pool.run(_verify, text, hash)
+
+
+def credential_mac(*parts: str) -> bytes:
+    """ keyed HMAC-SHA256 of the given strings. used to remember that credentials were valid
+    without keeping the credentials themselves """
+    return hmac.new(_mac_key, "\0".join(parts).encode("utf-8"), hashlib.sha256).digest()
@@ -0,0 +1,119 @@
+"""
+    per-request SQL accounting. every statement run through the sqlalchemy engines or PostgreSQLConn
+    is counted and timed against the current thread's request, and statements slower than
+    SLOW_QUERY_MS are logged as a WARN with their normalized SQL and the code that issued them
+"""
+import contextlib
+import os
+import re
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from sqlalchemy import event
+
+_SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", 200))
+
+_state = threading.local()
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER = re.compile(r"%\(\w+\)s|%s|\$\d+|(?<!:):(?!:)\w+")
+_VALUE_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+_WHITESPACE = re.compile(r"\s+")
+
+# frames from these files are skipped when looking for the code that issued a query. contextlib
+# is in there because statements flushed when a dbsession() block ends run under its __exit__
+_INTERNAL_PATHS = tuple(os.sep + p + os.sep for p in ("sqlalchemy", "psycopg2")) + tuple(
+    os.path.join(os.path.dirname(__file__), name) for name in (
+        "sqlstats.py", "dbsession.py", "postgresqlconn.py", "preparedstatements.py",
+        "__init__.py")) + (contextlib.__file__,)
+
+
+def normalize(statement) -> str:
+    """ the statement with literals and parameters replaced by ? so identical queries with
+    different values look the same """
+    if isinstance(statement, bytes):
+        statement = statement.decode("utf-8", "replace")
+    sql = _STRING_LITERAL.sub("?", statement)
+    sql = _PLACEHOLDER.sub("?", sql)
+    sql = _NUMBER_LITERAL.sub("?", sql)
+    sql = _VALUE_LIST.sub("(?)", sql)
+    return _WHITESPACE.sub(" ", sql).strip()
+
+
+def call_site() -> str:
+    """ "file:function(line)" of the innermost frame outside the database layers """
+    frame = sys._getframe(1)
+    while frame is not None:
+        path = frame.f_code.co_filename
+        if not any(p in path for p in _INTERNAL_PATHS):
+            return "{}:{}({})".format(path, frame.f_code.co_name, frame.f_lineno)
+        frame = frame.f_back
+    return "unknown"
+
+
+def begin_request():
+    """ reset the current thread's counters. called at the start of every request """
+    _state.queries = 0
+    _state.time_ms = 0.0
+
+
+def current() -> (int, int):
+    """ the number of statements and total ms spent in the database by the current request """
+    return getattr(_state, "queries", 0), int(getattr(_state, "time_ms", 0.0))
+
+
+@contextmanager
+def suppressed():
+    """ don't count or slow-log statements run inside this block. used by the log writers so
+    their own inserts don't feed back into the log """
+    previous = getattr(_state, "suppressed", False)
+    _state.suppressed = True
+    try:
+        yield
+    finally:
+        _state.suppressed = previous
+
+
+def record(statement, duration_ms: float):
+    if getattr(_state, "suppressed", False):
+        return
+    _state.queries = getattr(_state, "queries", 0) + 1
+    _state.time_ms = getattr(_state, "time_ms", 0.0) + duration_ms
+
+    if duration_ms >= _SLOW_QUERY_MS:
+        # imported here because the logger itself depends on the database modules
+        from .logger import Logger
+        with suppressed():
+            Logger.warn("slow query ({:.0f} ms) at {}: {}".format(
+                duration_ms, call_site(), normalize(statement)))
+
+
+@contextmanager
+def timed(statement):
+    """ count and time the statement executed inside this block """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(statement, (time.perf_counter() - start) * 1000)
+
+
+def instrument(engine):
+    """ count and time every statement the engine runs """
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("sqlstats_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        start = conn.info["sqlstats_start"].pop()
+        record(statement, (time.perf_counter() - start) * 1000)
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(context):
+        starts = context.connection.info.get("sqlstats_start") if context.connection else None
+        if starts:
+            starts.pop()
@@ -0,0 +1,132 @@
+"""
+    bounded in-process cache with least-recently-used eviction and per-entry expiration
+"""
+import threading
+import time
+from collections import OrderedDict
+
+
+class InvalidationLog():
+    """ remembers recent invalidations so a value read from its source before its key was
+    invalidated isn't cached after the invalidation. take generation() before the read and check
+    stale() before caching the result. only the last max_keys invalidated keys are remembered;
+    reads that started before a forgotten invalidation count as stale """
+
+    def __init__(self, max_keys: int=10000):
+        self.max_keys = max(1, max_keys)
+        self.__generation = 0
+        # key -> generation of its last invalidation, oldest first
+        self.__keys = OrderedDict()
+        # reads that started before this generation may have missed a forgotten invalidation
+        self.__floor = 0
+        self.__lock = threading.Lock()
+
+    def generation(self) -> int:
+        return self.__generation
+
+    def record(self, key=None):
+        """ note an invalidation of key, or of every key if key is None """
+        with self.__lock:
+            self.__generation += 1
+            if key is None:
+                self.__keys.clear()
+                self.__floor = self.__generation
+                return
+            self.__keys[key] = self.__generation
+            self.__keys.move_to_end(key)
+            while len(self.__keys) > self.max_keys:
+                _, self.__floor = self.__keys.popitem(last=False)
+
+    def stale(self, key, generation: int) -> bool:
+        """ True if key may have been invalidated after generation was taken """
+        with self.__lock:
+            return generation < self.__floor or self.__keys.get(key, 0) > generation
+
+
+class TTLCache():
+    """ a thread-safe LRU cache whose entries also expire ttl seconds after they're set. a
+    max_size of 0 disables the cache: every get() misses and set() stores nothing """
+
+    _MISSING = object()
+
+    def __init__(self, max_size: int=10000, ttl: float=60.0):
+        self.max_size = max_size
+        self.ttl = ttl
+
+        # key -> (expires_at, value), least recently used first
+        self.__entries = OrderedDict()
+        self.__invalidations = InvalidationLog(max_size)
+        self.__lock = threading.Lock()
+        self.__counters = {
+            "hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "expirations": 0,
+            "invalidations": 0,
+            "stale_sets": 0,
+        }
+
+    def get(self, key, default=None):
+        """ returns the cached value or default if the key is missing or expired """
+        now = time.monotonic()
+        with self.__lock:
+            entry = self.__entries.get(key, self._MISSING)
+            if entry is self._MISSING:
+                self.__counters["misses"] += 1
+                return default
+            if entry[0] <= now:
+                del self.__entries[key]
+                self.__counters["expirations"] += 1
+                self.__counters["misses"] += 1
+                return default
+            self.__entries.move_to_end(key)
+            self.__counters["hits"] += 1
+            return entry[1]
+
+    def generation(self) -> int:
+        """ take this before reading a value from its source and pass it to set() """
+        return self.__invalidations.generation()
+
+    def set(self, key, value=True, ttl: float=None, generation: int=None):
+        """ cache a value, evicting the least recently used entry if the cache is full. ttl
+        overrides the cache's default lifetime for this entry. with a generation from
+        generation(), nothing is cached if the key was invalidated since it was taken """
+        if self.max_size <= 0:
+            return
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self.__lock:
+            if generation is not None and self.__invalidations.stale(key, generation):
+                self.__counters["stale_sets"] += 1
+                return
+            self.__entries[key] = (expires_at, value)
+            self.__entries.move_to_end(key)
+            while len(self.__entries) > self.max_size:
+                self.__entries.popitem(last=False)
+                self.__counters["evictions"] += 1
+
+    def invalidate(self, key) -> bool:
+        """ drop a key right away. returns True if it was cached """
+        with self.__lock:
+            self.__invalidations.record(key)
+            if self.__entries.pop(key, self._MISSING) is self._MISSING:
+                return False
+            self.__counters["invalidations"] += 1
+            return True
+
+    def clear(self):
+        with self.__lock:
+            self.__invalidations.record()
+            self.__entries.clear()
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def stats(self) -> dict:
+        """ hit/miss/eviction counters plus the current size, used for sizing the cache """
+        with self.__lock:
+            stats = dict(self.__counters)
+            stats["size"] = len(self.__entries)
+        stats["max_size"] = self.max_size
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
@@ -8,6 +8,7 @@ from functools import wraps
 from flask import request, Response
 from .requestparser import RequestParser
 from ..core.utils.responsejson import *
+from ..core.utils.hashpool import HashPoolSaturatedException
 from ..managers.sessionmanager import SessionManager
 from ..managers.accountmanager import AccountManager
 
@@ -91,6 +92,8 @@ def require_password(func):
                 valid = manager.verify_account(username, password)
                 if not valid:
                     return UnauthorizedResponseJson().make_response()
+            except HashPoolSaturatedException:
+                return ServiceUnavailableResponseJson().make_response()
             except Exception as e:
                 traceback.print_exc()
                 return ExceptionResponseJson("unable to validate credentials", e).make_response()
@@ -1,5 +1,6 @@
 from flask import request
 from flask_restful import reqparse, abort
+from werkzeug import exceptions
 
 
 class RequestParser(reqparse.RequestParser):
@@ -0,0 +1,223 @@
+"""
+    request argument schemas that are compiled once instead of rebuilt on every request. a Schema
+    takes the same flask-restful Arguments a RequestParser does and turns them into a validator that
+    reads each request source once and converts values without reqparse's per-argument machinery.
+    errors are reported exactly like RequestParser reports them
+"""
+import decimal
+from collections.abc import MutableSequence
+from flask import request, current_app
+from flask_restful import abort
+from flask_restful.reqparse import Argument, Namespace, _friendly_location
+from werkzeug import exceptions
+from werkzeug.datastructures import MultiDict
+
+# types that are called with just the value. anything else goes through reqparse's
+# type(value, name, op) fallback chain
+_PLAIN_TYPES = (str, int, float, bool, decimal.Decimal)
+
+# the sources reqparse falls back to for arguments without an explicit location; also what strict
+# mode checks for unknown arguments
+_DEFAULT_LOCATION = ("json", "values")
+
+
+class _Field():
+    """ one compiled Argument """
+
+    __slots__ = ("arg", "name", "dest", "location", "required", "default", "convert",
+                 "choices", "append", "store_missing", "help", "trim", "lower", "ignore",
+                 "nullable", "missing_message")
+
+    def __init__(self, arg: Argument):
+        self.arg = arg
+        self.name = arg.name
+        self.dest = arg.dest or arg.name
+        # a single location is read as is; several are merged, exactly like Argument.source
+        self.location = arg.location if isinstance(arg.location, str) else tuple(arg.location)
+        self.required = arg.required
+        self.default = arg.default
+        self.convert = self.__converter(arg)
+        self.append = arg.action == "append"
+        self.store_missing = arg.store_missing
+        self.help = arg.help
+        self.trim = arg.trim
+        self.lower = not arg.case_sensitive
+        self.ignore = arg.ignore
+        self.nullable = arg.nullable
+
+        choices = arg.choices
+        if choices and self.lower:
+            choices = [c.lower() if isinstance(c, str) else c for c in choices]
+        self.choices = choices
+
+        locations = (self.location,) if isinstance(self.location, str) else self.location
+        self.missing_message = "Missing required parameter in {}".format(
+            " or ".join(_friendly_location.get(l, l) for l in locations))
+
+    @staticmethod
+    def __converter(arg: Argument):
+        arg_type = arg.type
+        if arg_type in _PLAIN_TYPES:
+            if arg_type is decimal.Decimal:
+                return lambda value: arg_type(str(value))
+            return arg_type
+
+        def convert(value):
+            try:
+                return arg_type(value, arg.name, "=")
+            except TypeError:
+                try:
+                    return arg_type(value, arg.name)
+                except TypeError:
+                    return arg_type(value)
+        return convert
+
+    def error(self, error: Exception, bundle_errors: bool) -> dict:
+        """ the {name: message} reqparse reports. aborts right away unless errors are bundled """
+        message = str(error)
+        if self.help:
+            message = self.help.format(error_msg=message)
+        msg = {self.name: message}
+        if bundle_errors:
+            return msg
+        abort(400, message=msg)
+
+    def parse(self, source, bundle_errors: bool):
+        """ returns (value, found, error). error is a {name: message} dict when errors are bundled """
+        if self.name in source:
+            if hasattr(source, "getlist"):
+                values = source.getlist(self.name)
+            else:
+                values = source.get(self.name)
+                if not (isinstance(values, MutableSequence) and self.append):
+                    values = [values]
+
+            results = []
+            for value in values:
+                if self.trim and hasattr(value, "strip"):
+                    value = value.strip()
+                if self.lower and hasattr(value, "lower"):
+                    value = value.lower()
+                try:
+                    if value is None:
+                        if not self.nullable:
+                            raise ValueError("Must not be null!")
+                    else:
+                        value = self.convert(value)
+                except Exception as e:
+                    if self.ignore:
+                        continue
+                    return None, False, self.error(e, bundle_errors)
+
+                if self.choices and value not in self.choices:
+                    return None, False, self.error(
+                        ValueError("{} is not a valid choice".format(value)), bundle_errors)
+                results.append(value)
+
+            if results:
+                if self.append:
+                    return results, True, None
+                return results[0], True, None
+
+        if self.required:
+            return None, False, self.error(ValueError(self.missing_message), bundle_errors)
+        default = self.default() if callable(self.default) else self.default
+        return default, False, None
+
+
+class Schema():
+    """ a compiled set of request arguments. build it once, e.g. as a class attribute of the
+    resource, and call parse() in the handler:
+
+        class EchoWorld(Resource):
+            schema = Schema(
+                Argument("message", type=str, required=True, location="args"),
+                Argument("number", type=int, location="args"))
+
+            def get(self):
+                args = self.schema.parse()
+
+    arguments with features the compiled path doesn't handle (operators other than "=", custom
+    argument classes) are parsed by reqparse itself, so any Argument works """
+
+    def __init__(self, *args: Argument, bundle_errors: bool=False):
+        self.bundle_errors = bundle_errors
+        self.names = frozenset(a.name for a in args)
+
+        # fields grouped by their location so each source is resolved once per request
+        self.__groups = {}
+        self.__fields = []
+        self.__fallback = False
+        for arg in args:
+            if list(arg.operators) != ["="] or type(arg) is not Argument:
+                self.__fields.append((None, arg))
+                self.__fallback = True
+                continue
+            field = _Field(arg)
+            self.__groups.setdefault(field.location, None)
+            self.__fields.append((field.location, field))
+
+    @classmethod
+    def from_parser(cls, parser):
+        """ compile the arguments of an existing RequestParser """
+        return cls(*parser.args, bundle_errors=parser.bundle_errors)
+
+    def parse(self, req=None, strict: bool=False) -> Namespace:
+        """ validate the request and return its arguments as a Namespace. aborts with a 400 like
+        RequestParser.parse_args on the first invalid argument, or on all of them when errors are
+        bundled """
+        if req is None:
+            req = request
+        bundle_errors = self.bundle_errors or current_app.config.get("BUNDLE_ERRORS", False)
+
+        if self.__fallback:
+            # Argument.parse pops the names it finds from here, as it does under RequestParser
+            req.unparsed_arguments = dict(_source(req, _DEFAULT_LOCATION)) if strict else {}
+
+        sources = {location: _source(req, location) for location in self.__groups}
+        namespace = Namespace()
+        errors = {}
+        for location, field in self.__fields:
+            if location is None:
+                value, found = field.parse(req, bundle_errors)
+                if isinstance(value, ValueError):
+                    errors.update(found)
+                    continue
+                if found or field.store_missing:
+                    namespace[field.dest or field.name] = value
+                continue
+
+            value, found, error = field.parse(sources[location], bundle_errors)
+            if error:
+                errors.update(error)
+                continue
+            if found or field.store_missing:
+                namespace[field.dest] = value
+
+        if errors:
+            abort(400, error=errors)
+
+        if strict:
+            unknown = [k for k in _source(req, _DEFAULT_LOCATION) if k not in self.names]
+            if unknown:
+                raise exceptions.BadRequest("Unknown arguments: {}".format(", ".join(unknown)))
+        return namespace
+
+
+def _source(req, location):
+    """ the request's values for an Argument location, like Argument.source: a single location is
+    returned as is and a tuple of them is merged into one MultiDict """
+    if isinstance(location, str):
+        value = getattr(req, location, None)
+        if callable(value):
+            value = value()
+        return value if value is not None else MultiDict()
+
+    values = MultiDict()
+    for l in location:
+        value = getattr(req, l, None)
+        if callable(value):
+            value = value()
+        if value is not None:
+            values.update(value)
+    return values
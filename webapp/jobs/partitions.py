@@ -0,0 +1,83 @@
+"""
+    maintenance of the daily range partitions of endpoint_log. the reaper and rollup jobs make sure
+    partitions exist PARTITION_DAYS_AHEAD days ahead, and the reaper drops whole partitions once
+    they fall out of the retention window, which is instant compared to deleting their rows.
+
+    rows that fall outside every daily partition land in <table>_default. a daily partition can't be
+    created over a range the default partition already holds rows for, so keep the jobs running
+"""
+import datetime
+import os
+from sqlalchemy import text
+from ..core.utils.dbsession import dbsession, read_dbsession
+
+# table -> partition key column
+PARTITIONED_TABLES = (
+    ("endpoint_log", "start_utc"),
+)
+
+_DAYS_AHEAD = int(os.getenv("PARTITION_DAYS_AHEAD", 7))
+
+_LIST_PARTITIONS = text("""
+    select child.relname as name
+    from pg_inherits
+    join pg_class parent on parent.oid = pg_inherits.inhparent
+    join pg_class child on child.oid = pg_inherits.inhrelid
+    where parent.relname = :table
+    """)
+
+
+def partition_name(table: str, day: datetime.date) -> str:
+    return "{}_p{}".format(table, day.strftime("%Y%m%d"))
+
+
+def daily_partitions(table: str) -> dict:
+    """ day -> partition name of every daily partition of table """
+    prefix = table + "_p"
+    with read_dbsession() as session:
+        names = [row.name for row in session.execute(_LIST_PARTITIONS, {"table": table})]
+
+    partitions = {}
+    for name in names:
+        if not name.startswith(prefix):
+            continue
+        try:
+            day = datetime.datetime.strptime(name[len(prefix):], "%Y%m%d").date()
+        except ValueError:
+            continue
+        partitions[day] = name
+    return partitions
+
+
+def ensure_partitions(table: str, days_ahead: int=_DAYS_AHEAD) -> list:
+    """ create the daily partitions from today through days_ahead days from now. returns the
+    names of the partitions created """
+    existing = daily_partitions(table)
+    today = datetime.datetime.utcnow().date()
+    created = []
+    for offset in range(days_ahead + 1):
+        day = today + datetime.timedelta(days=offset)
+        if day in existing:
+            continue
+        name = partition_name(table, day)
+        with dbsession(independent=True) as session:
+            session.execute(text("""
+                create table if not exists {name} partition of {table}
+                for values from ('{start}') to ('{end}')
+                """.format(name=name, table=table, start=day, end=day + datetime.timedelta(days=1))))
+        created.append(name)
+    return created
+
+
+def drop_partitions(table: str, cutoff: datetime.datetime) -> list:
+    """ drop every daily partition whose whole day is older than cutoff. returns the names of the
+    partitions dropped """
+    dropped = []
+    for day, name in sorted(daily_partitions(table).items()):
+        end = datetime.datetime.combine(day + datetime.timedelta(days=1), datetime.time())
+        if end > cutoff:
+            break
+        with dbsession(independent=True) as session:
+            session.execute(text("drop table if exists {}".format(name)))
+        dropped.append(name)
+    return dropped
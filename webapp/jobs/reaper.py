@@ -0,0 +1,141 @@
+"""
+    maintenance job that deletes expired sessions, expired token revocations and log rows older than the retention window.
+    rows are removed in small keyset-paginated batches, each in its own short transaction, with a
+    pause in between so the job never holds long locks or starves the web process of connections.
+
+    run once:               python -m webapp.jobs.reaper --once
+    run as a process type:  python -m webapp.jobs.reaper
+"""
+import argparse
+import datetime
+import os
+import time
+from sqlalchemy import text
+from ..core.utils.dbsession import dbsession
+from ..core.utils.logger import Logger
+from . import partitions
+
+# table -> time column. a row is purged once its time column is older than the table's cutoff
+_TARGETS = (
+    ("session_token", "expires_utc"),
+    ("revoked_token", "expires_utc"),
+    ("endpoint_log", "start_utc"),
+    ("system_log", "event_utc"),
+)
+
+_DELETE_BATCH = """
+    with doomed as (
+        select id, {column} from {table}
+        where ({column}, id) > (:last_time, :last_id) and {column} < :cutoff
+        order by {column}, id
+        limit :batch_size
+    )
+    delete from {table} t using doomed
+    where t.id = doomed.id and t.{column} = doomed.{column}
+    returning t.{column} as time, t.id as id
+    """
+
+
+def purge_table(table: str, column: str, cutoff: datetime.datetime, batch_size: int,
+                sleep_ms: int) -> dict:
+    """ delete every row of table whose column is older than cutoff. returns the number of rows
+    purged and the duration of each batch in milliseconds """
+    query = text(_DELETE_BATCH.format(table=table, column=column))
+    last_time, last_id = datetime.datetime.min, 0
+    purged = 0
+    batch_ms = []
+
+    while True:
+        start = time.monotonic()
+        with dbsession() as session:
+            rows = session.execute(query, {
+                "last_time": last_time,
+                "last_id": last_id,
+                "cutoff": cutoff,
+                "batch_size": batch_size,
+                }).fetchall()
+        batch_ms.append(int((time.monotonic() - start) * 1000))
+
+        purged += len(rows)
+        if len(rows) < batch_size:
+            break
+
+        last_time, last_id = max((r.time, r.id) for r in rows)
+        time.sleep(sleep_ms / 1000)
+
+    return {"purged": purged, "batch_ms": batch_ms}
+
+
+def reap(retention_days: int, batch_size: int, sleep_ms: int) -> dict:
+    """ purge expired sessions and old logs. returns a report keyed by table name """
+    now = datetime.datetime.utcnow()
+    cutoffs = {
+        "session_token": now,
+        # an expired token fails its signature check, so its revocation isn't needed anymore
+        "revoked_token": now,
+        "endpoint_log": now - datetime.timedelta(days=retention_days),
+        "system_log": now - datetime.timedelta(days=retention_days),
+    }
+
+    # partitioned tables lose whole days at once; the batched delete below only has the day
+    # straddling the cutoff and the default partition left to go through
+    dropped = {}
+    for table, _ in partitions.PARTITIONED_TABLES:
+        partitions.ensure_partitions(table)
+        dropped[table] = partitions.drop_partitions(table, cutoffs[table])
+        if dropped[table]:
+            print("[reaper] {table}: dropped partitions {names}".format(**{
+                "table": table,
+                "names": ", ".join(dropped[table]),
+                }))
+
+    report = {}
+    for table, column in _TARGETS:
+        result = purge_table(table, column, cutoffs[table], batch_size, sleep_ms)
+        result["dropped_partitions"] = dropped.get(table, [])
+        report[table] = result
+
+        batch_ms = result["batch_ms"]
+        print("[reaper] {table}: purged {purged} rows in {batches} batches "
+              "(batch ms min {min} / avg {avg} / max {max})".format(**{
+                  "table": table,
+                  "purged": result["purged"],
+                  "batches": len(batch_ms),
+                  "min": min(batch_ms),
+                  "avg": sum(batch_ms) // len(batch_ms),
+                  "max": max(batch_ms),
+                  }))
+
+    Logger.info("reaper purged {}".format(", ".join(
+        "{}={}".format(table, result["purged"]) for table, result in report.items())))
+    Logger.flush()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="delete expired sessions and old log rows")
+    parser.add_argument("--once", action="store_true",
+                        help="run a single pass and exit instead of looping")
+    parser.add_argument("--retention-days", type=int,
+                        default=int(os.getenv("LOG_RETENTION_DAYS", 30)),
+                        help="age, in days, after which log rows are deleted")
+    parser.add_argument("--batch-size", type=int,
+                        default=int(os.getenv("REAPER_BATCH_SIZE", 1000)),
+                        help="rows deleted per transaction")
+    parser.add_argument("--sleep-ms", type=int,
+                        default=int(os.getenv("REAPER_SLEEP_MS", 100)),
+                        help="pause between batches")
+    parser.add_argument("--interval", type=int,
+                        default=int(os.getenv("REAPER_INTERVAL_SECONDS", 3600)),
+                        help="seconds between passes when looping")
+    args = parser.parse_args()
+
+    while True:
+        reap(args.retention_days, args.batch_size, args.sleep_ms)
+        if args.once:
+            break
+        time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    main()
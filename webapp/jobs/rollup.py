@@ -0,0 +1,141 @@
+"""
+    job that aggregates endpoint_log into endpoint_stats_minute, one row per minute, endpoint,
+    method and status, so dashboards read the rollup instead of scanning the log. it's incremental:
+    rollup_watermark remembers the first minute not yet aggregated, and only minutes that ended at
+    least --lag-seconds ago are aggregated, giving the endpoint log writers time to flush. each
+    chunk of minutes is aggregated and the watermark advanced in one transaction.
+
+    rows can still arrive after their minute was aggregated, e.g. when the log writer's queue backs
+    up or the database was down. every pass aggregates the last --recheck-minutes before the
+    watermark again, which the upsert makes idempotent. rows later than that are left out
+
+    run once:               python -m webapp.jobs.rollup --once
+    run as a process type:  python -m webapp.jobs.rollup
+"""
+import argparse
+import datetime
+import os
+import time
+from sqlalchemy import text
+from ..core.utils.dbsession import dbsession
+from ..core.utils.logger import Logger
+from ..core.utils.metrics import LATENCY_BUCKETS_MS
+from . import partitions
+
+_NAME = "endpoint_stats_minute"
+
+
+def _buckets_sql(bounds: tuple) -> str:
+    """ an int array of non-cumulative counts per latency bucket, bucketed like the in-process
+    histograms: each bound is inclusive and the last slot counts everything slower """
+    counts = []
+    lower = None
+    for upper in bounds:
+        condition = "duration_ms <= {}".format(upper) if lower is None else \
+            "duration_ms > {} and duration_ms <= {}".format(lower, upper)
+        counts.append("(count(*) filter (where {}))::int".format(condition))
+        lower = upper
+    counts.append("(count(*) filter (where duration_ms > {}))::int".format(lower))
+    return "array[{}]".format(", ".join(counts))
+
+
+_ROLLUP = text("""
+    insert into endpoint_stats_minute (minute_utc, endpoint, method, http_code, count, error_count,
+        duration_ms_sum, duration_ms_min, duration_ms_max, db_queries_sum, db_time_ms_sum,
+        duration_ms_buckets)
+    select date_trunc('minute', start_utc), coalesce(endpoint, ''), coalesce(method, ''),
+        coalesce(http_code, ''), count(*),
+        count(*) filter (where left(http_code, 1) in ('4', '5')),
+        sum(duration_ms), min(duration_ms), max(duration_ms), sum(db_queries), sum(db_time_ms),
+        {buckets}
+    from endpoint_log
+    where start_utc >= :start and start_utc < :end
+    group by 1, 2, 3, 4
+    on conflict (minute_utc, endpoint, method, http_code) do update set
+        count = excluded.count,
+        error_count = excluded.error_count,
+        duration_ms_sum = excluded.duration_ms_sum,
+        duration_ms_min = excluded.duration_ms_min,
+        duration_ms_max = excluded.duration_ms_max,
+        db_queries_sum = excluded.db_queries_sum,
+        db_time_ms_sum = excluded.db_time_ms_sum,
+        duration_ms_buckets = excluded.duration_ms_buckets
+    """.format(buckets=_buckets_sql(LATENCY_BUCKETS_MS)))
+
+_LOCK_WATERMARK = text("select last_utc from rollup_watermark where name = :name for update")
+
+
+def rollup(lag_seconds: int, batch_minutes: int, recheck_minutes: int=0) -> dict:
+    """ aggregate every closed minute past the watermark, then the recheck_minutes before it
+    again. returns the number of minutes covered and rollup rows written """
+    closed = datetime.datetime.utcnow() - datetime.timedelta(seconds=lag_seconds)
+    closed = closed.replace(second=0, microsecond=0)
+    minutes = 0
+    rows = 0
+
+    while True:
+        with dbsession() as session:
+            session.execute(text("""
+                insert into rollup_watermark (name, last_utc)
+                select :name, coalesce(date_trunc('minute', min(start_utc)), :closed)
+                from endpoint_log
+                on conflict (name) do nothing
+                """), {"name": _NAME, "closed": closed})
+            # the row lock keeps a second rollup process from working on the same minutes
+            start = session.execute(_LOCK_WATERMARK, {"name": _NAME}).scalar()
+            if start >= closed:
+                break
+
+            end = min(closed, start + datetime.timedelta(minutes=batch_minutes))
+            result = session.execute(_ROLLUP, {"start": start, "end": end})
+            session.execute(text("update rollup_watermark set last_utc = :end where name = :name"),
+                            {"name": _NAME, "end": end})
+
+        minutes += int((end - start).total_seconds() // 60)
+        rows += max(0, result.rowcount)
+
+    if recheck_minutes > 0:
+        with dbsession() as session:
+            end = session.execute(_LOCK_WATERMARK, {"name": _NAME}).scalar()
+            start = end - datetime.timedelta(minutes=recheck_minutes)
+            result = session.execute(_ROLLUP, {"start": start, "end": end})
+        rows += max(0, result.rowcount)
+
+    return {"minutes": minutes, "rows": rows, "watermark": closed}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="aggregate endpoint_log into per-minute stats")
+    parser.add_argument("--once", action="store_true",
+                        help="run a single pass and exit instead of looping")
+    parser.add_argument("--lag-seconds", type=int,
+                        default=int(os.getenv("ROLLUP_LAG_SECONDS", 120)),
+                        help="only aggregate minutes that ended at least this long ago")
+    parser.add_argument("--batch-minutes", type=int,
+                        default=int(os.getenv("ROLLUP_BATCH_MINUTES", 60)),
+                        help="minutes aggregated per transaction")
+    parser.add_argument("--recheck-minutes", type=int,
+                        default=int(os.getenv("ROLLUP_RECHECK_MINUTES", 60)),
+                        help="minutes before the watermark aggregated again to pick up late rows")
+    parser.add_argument("--interval", type=int,
+                        default=int(os.getenv("ROLLUP_INTERVAL_SECONDS", 60)),
+                        help="seconds between passes when looping")
+    args = parser.parse_args()
+
+    while True:
+        try:
+            for table, _ in partitions.PARTITIONED_TABLES:
+                partitions.ensure_partitions(table)
+            result = rollup(args.lag_seconds, args.batch_minutes, args.recheck_minutes)
+            if result["minutes"]:
+                print("[rollup] aggregated {minutes} minutes into {rows} rows".format(**result))
+        except Exception as e:
+            Logger.error("rollup pass failed", e)
+            Logger.flush()
+        if args.once:
+            break
+        time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,13 +3,23 @@
 """
 import traceback
 import datetime
+import hmac
 import os
-from ..core.utils.security import generate_hash, verify_hash
-from ..core.utils.dbsession import dbsession
-from ..core.utils.responsejson import MessageResponseJson, ErrorResponseJson, ResponseJson
+from sqlalchemy.dialects.postgresql import insert
+from ..core.utils.basics import prefixed_uuid4
+from ..core.utils.security import generate_hash, verify_hash, credential_mac
+from ..core.utils.cache import Cache
+from ..core.utils.dbsession import dbsession, read_dbsession, read_or_primary
+from ..core.utils.responsejson import MessageResponseJson, ErrorResponseJson, ResponseJson, \
+    UnauthorizedResponseJson
 from ..core.models.account import Account
 from ..managers.sessionmanager import SessionManager
 
+# email -> HMAC of the last password verified for it, mixed with the stored hash so a password
+# change stops matching right away. the password itself is never stored. a write that changes or
+# removes an account's credentials should call _verified_credentials.notify_invalidation()
+_verified_credentials = Cache.from_env("verified_credentials", "CREDENTIAL_CACHE",
+                                       max_size=10000, ttl=30)
 
 class AccountManager():
 
@@ -26,32 +36,31 @@ class AccountManager():
 
 
     def create(self, email: str, password: str) -> ResponseJson:
-        """ create a new user account """
+        """ create a new user account and its first session in a single transaction. the unique
+        index on email decides races between concurrent signups """
         try:
-            with dbsession() as session:
-                account = session.query(Account)\
-                    .filter(Account.email == email)\
-                    .first()
+            h_password = generate_hash(password)
+            user_id = prefixed_uuid4("usr")
 
-            if not account:
-                # woohoo a new account!
+            with dbsession() as session:
+                created = session.execute(
+                    insert(Account.__table__)
+                    .values(user_id=user_id, email=email, secret=h_password)
+                    .on_conflict_do_nothing(index_elements=["email"])
+                    .returning(Account.__table__.c.user_id)
+                    ).first()
 
-                h_password = generate_hash(password)
-                account = Account(email, h_password)
-                with dbsession() as session:
-                    session.add(account)
-                    user_id = account.user_id
+                if not created:
+                    return ErrorResponseJson("username already taken")
 
                 # now create the session token the user will use going forward
-                session_token = SessionManager().create(user_id, email)
-                payload = {
-                    "uuid": user_id,
-                    "token": session_token,
-                }
-                return ResponseJson(payload)
+                session_token = SessionManager().create(user_id, email, session=session)
 
-            else:
-                return ErrorResponseJson("username already taken")
+            payload = {
+                "uuid": user_id,
+                "token": session_token,
+            }
+            return ResponseJson(payload)
 
         except Exception as e:
             traceback.print_exc()
@@ -60,40 +69,49 @@ class AccountManager():
     def login(self, email: str, password: str) -> ResponseJson:
         """ return a new session token if credentials are valid """
         try:
-                with dbsession() as session:
-                    account = session.query(Account)\
-                            .filter(Account.email == email)\
-                            .first()
-
-                if not account:
-                    return ErrorResponseJson("no account found")
-                else:
-                    with dbsession() as session:
-                        account = session.query(Account)\
-                            .filter(Account.email == email)\
-                            .with_entities(Account.user_id)\
-                            .first()
-                        user_id = account.user_id
-
-                    session_token = SessionManager().create(user_id, email)
-                    return ResponseJson({
-                        "uuid": user_id,
-                        "token": session_token,
-                    })
+            account = read_or_primary(lambda session: session.query(Account.user_id, Account.secret)
+                                      .filter(Account.email == email)
+                                      .first())
+
+            if not account:
+                return ErrorResponseJson("no account found")
+            if not verify_hash(password, account.secret):
+                return UnauthorizedResponseJson()
+
+            session_token = SessionManager().create(account.user_id, email)
+            return ResponseJson({
+                "uuid": account.user_id,
+                "token": session_token,
+            })
         except Exception as e:
             traceback.print_exc()
             raise(e)
 
 
     def verify_account(self, email: str, password: str) -> bool:
-        """ check if the given credentials are valid """
-        verified = False
-        with dbsession() as session:
-            account = session.query(Account)\
+        """ check if the given credentials are valid. credentials verified in the last
+        CREDENTIAL_CACHE_TTL seconds skip the password hash """
+        # the result fills the cache, so it's read from the primary and the generation is taken
+        # first so an invalidation that lands during the read keeps it out
+        generation = _verified_credentials.generation()
+        with read_dbsession(primary=True) as session:
+            account = session.query(Account.secret)\
                 .filter(Account.email == email)\
-                .with_entities(Account.secret)\
                 .first()
-        if account:
-            verified = verify_hash(password, account.secret)
+        if not account:
+            return False
+
+        mac = credential_mac(email, password, account.secret)
+        cached = _verified_credentials.get(email)
+        if cached and hmac.compare_digest(cached, mac):
+            return True
 
+        verified = verify_hash(password, account.secret)
+        if verified:
+            _verified_credentials.set(email, mac, generation=generation)
         return verified
+
+    @classmethod
+    def cache_stats(cls) -> dict:
+        """ hit/miss/eviction counters of the verified credential cache """
+        return _verified_credentials.stats()
@@ -1,24 +1,73 @@
-from ..core.utils.dbsession import dbsession
-from ..core.utils.security import generate_token, verify_token
+import datetime
+import hashlib
+import os
+import time
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import insert
+from ..core.utils.cache import Cache
+from ..core.utils.dbsession import dbsession, read_dbsession
+from ..core.utils.revocation import RevocationList
+from ..core.utils.security import generate_token, decode_token, token_digest
+from ..core.models.revokedtoken import RevokedToken
 from ..core.models.sessiontoken import SessionToken
 
+# "session" checks every token against session_token. "stateless" accepts any validly signed,
+# unexpired token whose jti hasn't been revoked, without a database round trip
+SESSION_MODE = "session"
+STATELESS_MODE = "stateless"
+_TOKEN_MODE = os.getenv("TOKEN_MODE", SESSION_MODE)
+
+# revoked jtis, refreshed from revoked_token. only consulted in stateless mode
+_revocations = RevocationList.from_env()
+
+# (user_id, token) pairs that recently passed verify(). only successes are cached so a token is
+# never rejected based on stale data; delete() and evictions drop the entry on every worker
+_verified_sessions = Cache.from_env("verified_sessions", "SESSION_CACHE", max_size=10000, ttl=60)
+
+# max live sessions per user. creating one more evicts the oldest. 0 means no limit
+_MAX_SESSIONS_PER_USER = int(os.getenv("SESSION_MAX_PER_USER", 10))
+
+_EVICT_OLDEST_SESSIONS = text("""
+    delete from session_token
+    where user_id = :user_id and id not in (
+        select id from session_token
+        where user_id = :user_id
+        order by created_utc desc, id desc
+        limit :keep)
+    returning token_digest
+    """)
+
+
+def _session_key(user_id: str, digest: str) -> bytes:
+    """ a 16 byte digest standing in for the (user_id, token) pair so cache entries don't hold
+    on to whole JWTs """
+    return hashlib.blake2b("{}\0{}".format(user_id, digest).encode(), digest_size=16).digest()
+
 
 class SessionManager():
 
-    def create(self, user_id: str, email: str, expires: int=2592000) -> str:
+    def create(self, user_id: str, email: str, expires: int=2592000, session=None) -> str:
         """ returns a new JWT representing a new session. this is used to interact
-        with all fetchy endpoints. a default token expires after 2592000 seconds (30 days)"""
+        with all fetchy endpoints. a default token expires after 2592000 seconds (30 days).
+        if the user already has SESSION_MAX_PER_USER sessions the oldest ones are removed.
+        pass an open session to create the token as part of the caller's transaction """
 
         try:
             payload = {
                 "email": email,
                 "uuid": user_id,
                 }
+            # generate_token() gives every token a random jti. without it two logins by the same
+            # user in the same second would sign the same claims and collide on the unique
+            # token_digest index
             token = generate_token(payload, expires)
+            expires_utc = datetime.datetime.utcnow() + datetime.timedelta(seconds=expires)
 
-            with dbsession() as session:
-                session_token = SessionToken(user_id, token)
-                session.add(session_token)
+            if session:
+                self.__insert(session, user_id, token, expires_utc)
+            else:
+                with dbsession() as session:
+                    self.__insert(session, user_id, token, expires_utc)
 
             return token
 
@@ -26,19 +75,101 @@ class SessionManager():
             raise(e)
 
 
+    def __insert(self, session, user_id: str, token: str, expires_utc: datetime.datetime):
+        """ adds the session row and removes the user's oldest sessions past the limit """
+        session.add(SessionToken(user_id, token, expires_utc))
+        session.flush()
+
+        if _MAX_SESSIONS_PER_USER <= 0:
+            return
+        evicted = session.execute(_EVICT_OLDEST_SESSIONS, {
+            "user_id": user_id,
+            "keep": _MAX_SESSIONS_PER_USER,
+            }).fetchall()
+        for row in evicted:
+            _verified_sessions.notify_invalidation(session, _session_key(user_id, row.token_digest))
+
+
     def verify(self, user_id: str, token: str) -> bool:
-        with dbsession() as session:
-            owner_sessions = session.query(SessionToken)\
-                .filter(SessionToken.user_id==user_id)\
-                .with_entities(SessionToken.token)\
-                .all()
+        if _TOKEN_MODE == STATELESS_MODE:
+            claims = decode_token(token)
+            if claims is None or claims.get("uuid") != user_id:
+                return False
+            revoked = _revocations.is_revoked(claims["jti"]) if "jti" in claims else None
+            if revoked is not None:
+                return not revoked
+            # a token issued before jtis existed, or the revocation list hasn't loaded yet
+            return self.__verify_session(user_id, token, claims)
 
-        return verify_token(token) and any([token == s.token for s in owner_sessions or []])
+        return self.__verify_session(user_id, token)
+
+
+    def __verify_session(self, user_id: str, token: str, claims: dict=None) -> bool:
+        """ checks that the token belongs to a live session of the user. pass the token's claims
+        if its signature was already checked """
+        digest = token_digest(token)
+        key = _session_key(user_id, digest)
+        if _verified_sessions.get(key):
+            return True
+
+        # the signature/expiry check is cheaper than the round trip, so it goes first
+        if claims is None:
+            claims = decode_token(token)
+            if claims is None:
+                return False
+
+        # taken before the read so a delete() that lands while it runs keeps the result uncached
+        generation = _verified_sessions.generation()
+        # always the primary: a lagging replica may not have a session created moments ago, and
+        # may still have one that was just deleted by a logout
+        with read_dbsession(primary=True) as session:
+            found = session.query(SessionToken.id)\
+                .filter(SessionToken.token_digest==digest, SessionToken.user_id==user_id)\
+                .first()
+
+        if found:
+            # hits skip the expiry check, so an entry never outlives the token
+            ttl = _verified_sessions.ttl
+            if "exp" in claims:
+                ttl = min(ttl, claims["exp"] - time.time())
+            if ttl > 0:
+                _verified_sessions.set(key, ttl=ttl, generation=generation)
+        return found is not None
 
 
     def delete(self, user_id: str, token: str):
+        """ end a session. the token's jti is also revoked so the logout holds in stateless mode,
+        and still holds if the mode is switched later """
+        digest = token_digest(token)
+        claims = decode_token(token)
+        jti = claims.get("jti") if claims else None
+        expires_utc = datetime.datetime.utcfromtimestamp(claims["exp"]) if jti else None
+
         with dbsession() as session:
             session.query(SessionToken)\
-                .filter(SessionToken.user_id==user_id, SessionToken.token==token)\
+                .filter(SessionToken.token_digest==digest, SessionToken.user_id==user_id)\
                 .delete(synchronize_session=False)
+            if jti:
+                session.execute(
+                    insert(RevokedToken.__table__)
+                    .values(jti=jti, expires_utc=expires_utc)
+                    .on_conflict_do_nothing(index_elements=["jti"]))
+            _verified_sessions.notify_invalidation(session, _session_key(user_id, digest))
+
+        # again now that the delete is committed: a verify here that read the row before the
+        # commit took its generation after the first invalidation
+        _verified_sessions.invalidate(_session_key(user_id, digest))
+        if jti:
+            _revocations.revoke(jti, expires_utc)
+
+
+    @classmethod
+    def cache_stats(cls) -> dict:
+        """ hit/miss/eviction counters of the verified session cache """
+        return _verified_sessions.stats()
+
 
+    @classmethod
+    def revocation_stats(cls) -> dict:
+        """ size and refresh counters of the revocation list used in stateless mode """
+        return _revocations.stats()